@@ -7,6 +7,14 @@ import os
 import shutil
 from kssmlib import MeshConfig
 from kssmlib.MeshSim import MeshSim
+from kssmlib.MeshScenario import read_scenario, scenario_records, scenario_size, copy_scenario
+from kssmlib.MeshTrace import MeshTraceReader
+from kssmlib.MeshSweep import run_sweep
+from kssmlib.MeshBranch import run_branches
+from kssmlib.MeshBenchmark import run_benchmark
+from kssmlib.MeshProfiler import profile_call, PROFILE_STATS_NAME, PROFILE_COLLAPSED_NAME
+from kssmlib.MeshRenderer import render_recording
+from kssmlib.KSSMconfig import KSSMconfig
 
 if __name__ == "__main__":
 
@@ -15,15 +23,33 @@ if __name__ == "__main__":
 	simulation_time = MeshConfig.SIMULATION_TIME
 	time_resolution = MeshConfig.SIMULATION_INTERVAL
 	slowmo_factor = MeshConfig.SLOWMO_FACTOR
-	results_dir = f"./kssm/"
+	results_dir = None	# ./kssm/, a resumed run continues in the results directory of its checkpoint
 	generate_mp4 = False
 	generate_png = False
-	messages_csv_name = results_dir + 'messages.csv'
-	nodes_csv_name = results_dir + 'nodes.csv'
 	config_file = 'kssm.json'
 	plot_dpi = 200
+	engine = 'tick'
+	reception_model = 'tick'
+	log_format = 'csv'
+	sweep_file = None
+	seed = None
+	mp4_mode = 'png'
+	record_frames = False
+	render_dir = None
+	processes = None
+	benchmark_file = None
+	profile = False
+	phase_timers = False
+	progress_interval = 0
+	report_interval = 0
+	checkpoint_interval = 0
+	resume_file = None
+	branch_file = None
+	branch_time = MeshConfig.SIMULATION_TIME
+	max_step = 0
+	verbose = True
 
-	options = ["nodes_data=", "simulation_time=", "time_resolution=", "results_dir=", "png", "mp4", "slowmo_factor=", "dpi=", "config=", "help"]
+	options = ["nodes_data=", "simulation_time=", "time_resolution=", "max_step=", "results_dir=", "png", "mp4", "slowmo_factor=", "dpi=", "config=", "engine=", "reception=", "log_format=", "export_csv=", "sweep=", "processes=", "seed=", "mp4_mode=", "record", "render=", "benchmark=", "profile", "phase_timers", "progress=", "report_interval=", "checkpoint=", "resume=", "branch=", "branch_time=", "quiet", "help"]
 
 	try:
 		opts, args = getopt.getopt(sys.argv[1:], "", options)
@@ -40,59 +66,131 @@ if __name__ == "__main__":
 			simulation_time = int(arg)
 		elif opt == '--time_resolution':
 			time_resolution = int(arg)
+		elif opt == '--max_step':
+			max_step = int(arg)
 		elif opt == '--png':
 			generate_png = True
 		elif opt == '--mp4':
 			generate_mp4 = True
-			generate_png = True
 		elif opt == '--slowmo_factor':
 			slowmo_factor = int(arg)
 		elif opt == '--dpi':
 			plot_dpi = int(arg)
 		elif opt == '--config':
 			config_file = arg
+		elif opt == '--engine':
+			engine = arg
+		elif opt == '--reception':
+			reception_model = arg
+		elif opt == '--log_format':
+			log_format = arg
+		elif opt == '--export_csv':
+			MeshTraceReader(arg).export_all_csv()
+			sys.exit(0)
+		elif opt == '--sweep':
+			sweep_file = arg
+		elif opt == '--processes':
+			processes = int(arg)
+		elif opt == '--seed':
+			seed = int(arg)
+		elif opt == '--mp4_mode':
+			mp4_mode = arg
+		elif opt == '--record':
+			record_frames = True
+		elif opt == '--render':
+			render_dir = arg
+		elif opt == '--benchmark':
+			benchmark_file = arg
+		elif opt == '--profile':
+			profile = True
+		elif opt == '--phase_timers':
+			phase_timers = True
+		elif opt == '--progress':
+			progress_interval = float(arg)
+		elif opt == '--report_interval':
+			report_interval = float(arg)
+		elif opt == '--checkpoint':
+			checkpoint_interval = int(arg)
+		elif opt == '--resume':
+			resume_file = arg
+		elif opt == '--branch':
+			branch_file = arg
+		elif opt == '--branch_time':
+			branch_time = int(arg)
+		elif opt == '--quiet':
+			verbose = False
 		elif opt == '--help':
 			for o in options:
 				print(f"--{o}")
 			sys.exit(0)
 
-	if nodes_data_file is None:
-		print("--nodes_data=file.json is required")
+	if render_dir is not None:
+		frames = render_recording(render_dir, KSSMconfig(config_file), dpi = plot_dpi, png = generate_png or not generate_mp4, mp4 = generate_mp4,
+			slowmo_factor = slowmo_factor, processes = MeshConfig.RENDER_PROCESSES, max_pending = MeshConfig.RENDER_QUEUE_SIZE, fps = MeshConfig.VIDEO_FPS)
+		print(f"{frames} frames rendered")
+		sys.exit(0)
+
+	if results_dir is None and (resume_file is None or benchmark_file is not None or sweep_file is not None):
+		results_dir = "./kssm/"
+
+	if benchmark_file is not None:
+		with open(benchmark_file, 'r') as f:
+			grid = json.load(f)
+		os.makedirs(results_dir, exist_ok = True)
+		shutil.copy(benchmark_file, results_dir + "/benchmark_grid.json")
+		run_benchmark(grid, results_dir, config_file = config_file, processes = processes if processes is not None else 1)
+		sys.exit(0)
+
+	if generate_mp4 and mp4_mode == 'png':
+		generate_png = True
+
+	if nodes_data_file is None and resume_file is None:
+		print("--nodes_data=file.json (or .csv, .npz) is required")
 		sys.exit(-1)
 	
-	os.makedirs(results_dir, exist_ok = True)
-	os.makedirs(results_dir + "/png/", exist_ok = True)
-	messages_csv_name = results_dir + 'messages.csv'
-	nodes_csv_name = results_dir + 'nodes.csv'
+	if results_dir is not None:
+		os.makedirs(results_dir, exist_ok = True)
+		os.makedirs(results_dir + "/png/", exist_ok = True)
+		messages_csv_name = results_dir + 'messages.csv'
+		nodes_csv_name = results_dir + 'nodes.csv'
 
-	with open(nodes_data_file, 'r') as f:
-		nodes_data = json.load(f)
-		shutil.copy(nodes_data_file, results_dir + "/input.json")
-		x_min, x_max, y_min, y_max = None, None, None, None
-		for n in nodes_data:
-			if "position" not in n.keys():
-				n["position"] = (0,0,0)
-			if x_min is None or x_min > n["position"][0]:
-				x_min = n["position"][0]
-			if x_max is None or x_max < n["position"][0]:
-				x_max = n["position"][0]
-			if y_min is None or y_min > n["position"][1]:
-				y_min = n["position"][1]
-			if y_max is None or y_max < n["position"][1]:
-				y_max = n["position"][1]
-		x_r = x_max - x_min
-		y_r = y_max - y_min
-		x_min -= int(0.2*x_r)
-		x_max += int(0.2*x_r)
-		y_min -= int(0.2*y_r)
-		y_max += int(0.2*y_r)
+	if sweep_file is not None:
+		nodes_data = scenario_records(read_scenario(nodes_data_file))
+		with open(sweep_file, 'r') as f:
+			grid = json.load(f)
+		copy_scenario(nodes_data_file, results_dir)
+		shutil.copy(sweep_file, results_dir + "/sweep.json")
+		run_sweep(nodes_data, grid, results_dir, config_file = config_file, simulation_time = simulation_time, time_resolution = time_resolution,
+			engine = engine, reception_model = reception_model, log_format = log_format, processes = processes, seed = seed)
+		sys.exit(0)
 
-		mesh_sim = MeshSim(nodes_data, config_file = config_file, size = (x_min, x_max, y_min, y_max), results_dir = results_dir, plot_dpi = plot_dpi, generate_png = generate_png, generate_mp4 = generate_mp4)
-		if generate_png:
+	if resume_file is not None:
+		mesh_sim = MeshSim.resume(resume_file, results_dir = results_dir, verbose = verbose, progress_interval = progress_interval,
+			report_interval = report_interval, checkpoint_interval = checkpoint_interval * 1000000)
+		time_resolution = mesh_sim.time_resolution
+		results_dir = mesh_sim.results_dir
+	else:
+		nodes_data = read_scenario(nodes_data_file)
+		copy_scenario(nodes_data_file, results_dir)
+		mesh_sim = MeshSim(nodes_data, config_file = config_file, size = scenario_size(nodes_data), results_dir = results_dir, plot_dpi = plot_dpi, generate_png = generate_png, generate_mp4 = generate_mp4, engine = engine, reception_model = reception_model, log_format = log_format, seed = seed, mp4_mode = mp4_mode, slowmo_factor = slowmo_factor, record_frames = record_frames, phase_timers = phase_timers, progress_interval = progress_interval, report_interval = report_interval, checkpoint_interval = checkpoint_interval * 1000000, max_step = max_step, verbose = verbose)
+		if generate_png or generate_mp4 or record_frames:
 			mesh_sim.plot_nodes()
-		for t in range((simulation_time * 1000000)//time_resolution):
-			mesh_sim.time_advance(time_resolution)
-		mesh_sim.make_summary()
-		if generate_mp4:
-			mesh_sim.make_video(slowmo_factor)
-		mesh_sim.make_html(simulation_time = simulation_time, time_resolution = time_resolution)
+	run_time = max(simulation_time * 1000000 - mesh_sim.current_time, 0)
+	if profile:
+		profile_call(lambda: mesh_sim.run(run_time, time_resolution),
+			results_dir + "/" + PROFILE_STATS_NAME, results_dir + "/" + PROFILE_COLLAPSED_NAME)
+	else:
+		mesh_sim.run(run_time, time_resolution)
+	if branch_file is not None:
+		with open(branch_file, 'r') as f:
+			variants = json.load(f)
+		shutil.copy(branch_file, results_dir + "/branches.json")
+		run_branches(mesh_sim, variants, branch_time * 1000000, results_dir, processes = processes)
+		mesh_sim.close()
+		sys.exit(0)
+	mesh_sim.close()
+	mesh_sim.write_profile()
+	mesh_sim.make_summary()
+	if generate_mp4:
+		mesh_sim.make_video(slowmo_factor)
+	mesh_sim.make_html(simulation_time = simulation_time, time_resolution = time_resolution)
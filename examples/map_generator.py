@@ -1,56 +1,70 @@
-import random
-import json
-NUM_NODES = 10
-X_SIZE = 20000
-Y_SIZE = 20000
-
-TX_POWER_MIN = 14
-TX_POWER_MAX = 22
-
-NOISE_MIN = -110
-NOISE_MAX = -95
-
-FREQUENCY = 869525000
+#!/usr/bin/env python3
 
-TYPE = "meshtastic"
-
-LORA_MODE = "MediumFast"
-
-HOP_START_MIN = 3
-HOP_START_MAX = 5
-
-ROLE = "CLIENT"
+import getopt
+import json
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from kssmlib.MeshTopology import generate_topology, LAYOUTS
+from kssmlib.MeshScenario import write_scenario, scenario_records
 
-POSITION_INTERVAL_MIN = 600
-POSITION_INTERVAL_MAX = 800
+"""
+Random mesh generator (see kssmlib/MeshTopology.py)
 
-NODEINFO_INTERVAL_MIN = 600
-NODEINFO_INTERVAL_MAX = 800
+$ python3 examples/map_generator.py [--layout=uniform] [--nodes=10] [--roles=CLIENT:0.9,ROUTER:0.1] [--lora_mode=MediumFast]
+	[--text_interval=10] [--node_spacing=1500] [--seed=1] [--parameters='{"clusters": 20}'] [--output=mesh.npz]
 
-TEXT_MESSAGE_MIN_INTERVAL = 2
-TEXT_MESSAGE_MAX_INTERVAL = 12
+The scenario is written to --output as JSON, CSV or NPZ by the extension of the file name (all of them are
+accepted by KSSM.py --nodes_data), without --output it is printed as JSON. --parameters are the parameters
+of the layout, e.g. clusters, width, waypoints, min_distance.
+"""
 
-nodes = []
+if __name__ == "__main__":
+	layout = 'uniform'
+	nodes = 10
+	roles = None
+	lora_mode = 'MediumFast'
+	text_interval = 10
+	node_spacing = 1500
+	seed = 1
+	parameters = {}
+	output = None
 
-for i in range(NUM_NODES):
-	n = {
-		"type":	TYPE,
-		"node_id": f"0x{random.randint(0, 0xffffffff):08x}",
-		"long_name": f"Node {i:02d}",
-		"position": [random.randint(0, X_SIZE), random.randint(0, Y_SIZE), 10],
-		"tx_power": random.randint(TX_POWER_MIN, TX_POWER_MAX+1),
-		"noise_level": random.randint(NOISE_MIN, NOISE_MAX+1),
-		"frequency": FREQUENCY,
-		"lora_mode": LORA_MODE,
-		"hop_start": random.randint(HOP_START_MIN, HOP_START_MAX),
-		"role": ROLE,
-		"position_interval": random.randint(POSITION_INTERVAL_MIN, POSITION_INTERVAL_MAX+1),
-		"nodeinfo_interval": random.randint(NODEINFO_INTERVAL_MIN, NODEINFO_INTERVAL_MAX+1),
-		"text_message_min_interval": TEXT_MESSAGE_MIN_INTERVAL,
-		"text_message_max_interval": TEXT_MESSAGE_MAX_INTERVAL,
-		"debug": True
-	}
-	nodes.append(n)
+	options = ["layout=", "nodes=", "roles=", "lora_mode=", "text_interval=", "node_spacing=", "seed=", "parameters=", "output=", "help"]
+	try:
+		opts, args = getopt.getopt(sys.argv[1:], "", options)
+	except getopt.GetoptError as err:
+		print(str(err))
+		sys.exit(2)
 
-print(json.dumps(nodes, indent=4))
+	for opt, arg in opts:
+		if opt == '--layout':
+			layout = arg
+		elif opt == '--nodes':
+			nodes = int(arg)
+		elif opt == '--roles':
+			roles = {name: float(fraction) for name, fraction in (item.split(':') for item in arg.split(','))}
+		elif opt == '--lora_mode':
+			lora_mode = arg
+		elif opt == '--text_interval':
+			text_interval = float(arg)
+		elif opt == '--node_spacing':
+			node_spacing = float(arg)
+		elif opt == '--seed':
+			seed = int(arg)
+		elif opt == '--parameters':
+			parameters = json.loads(arg)
+		elif opt == '--output':
+			output = arg
+		elif opt == '--help':
+			for o in options:
+				print(f"--{o}")
+			print(f"layouts: {', '.join(LAYOUTS)}")
+			sys.exit(0)
 
+	mesh = generate_topology(layout, nodes, roles = roles, lora_mode = lora_mode, text_interval = text_interval,
+		node_spacing = node_spacing, seed = seed, **parameters)
+	if output is None:
+		print(json.dumps(scenario_records(mesh), indent = 4))
+	else:
+		write_scenario(output, mesh)
@@ -1,16 +1,18 @@
-import random
 import enum
 import math
 import queue
-import copy
 import os
+from collections import deque
 import numpy.random
 from functools import cache
 from kssmlib.MeshMessage import MeshMessage, MessageType
-from kssmlib import MeshConfig
 from kssmlib.LoRaConstants import *
 from kssmlib.MeshLogger import MeshLogger
 from kssmlib.MeshPropagation import MeshPropagation
+from kssmlib.MeshEventQueue import EventType
+from kssmlib.MeshContext import MeshContext
+from kssmlib.MeshPacketHistory import MeshPacketHistory
+from kssmlib.MeshCheckpoint import instance_state
 
 
 class NodeState(enum.Enum):
@@ -22,6 +24,58 @@ class NodeState(enum.Enum):
 	def __str__(self):
 		return self.name
 
+STATE_COLORS = {
+	NodeState.IDLE: 'green',
+	NodeState.WAITING_TO_TX: 'orange',
+	NodeState.RX_BUSY: '#aaaaff',
+	NodeState.TX_BUSY: 'red',
+}
+
+def node_description(long_name, node_id, state, tx_message_id, queue_len, known_nodes, rx_success, rx_fail, rx_dups, tx_done, tx_cancelled, forwarded, collisions_caused):
+	"""Node description used by str(node) and the network plots, tx_message_id is None if the node has no message to send"""
+	ret = "{}\n0x{:08x} - {}".format(long_name, node_id, state)
+	if tx_message_id is not None:
+		ret += f" msg: {tx_message_id:08x}"
+	ret += "\nin queue: {} ".format(queue_len)
+	ret += f"known_nodes: {known_nodes}\n"
+	ret += f"rx_success: {rx_success}, rx_fail: {rx_fail}, rx_dups: {rx_dups}\ntx_done: {tx_done}, tx_cancelled: {tx_cancelled}, forwarded: {forwarded}, collisions_caused: {collisions_caused}"
+	return ret
+
+class MessageQueue:
+	"""
+	The subset of queue.Queue used by the nodes (non-blocking put() and get(), qsize()) without its locks,
+	the simulation runs in one thread and creating three conditions per node dominated the creation of large meshes
+	"""
+	def __init__(self, maxsize = 0):
+		self.maxsize = maxsize
+		self.queue = deque()
+
+	def qsize(self):
+		return len(self.queue)
+
+	def put(self, item, block = False):
+		if 0 < self.maxsize <= len(self.queue):
+			raise queue.Full
+		self.queue.append(item)
+
+	def get(self, block = False):
+		if not self.queue:
+			raise queue.Empty
+		return self.queue.popleft()
+
+@cache
+def theoretical_range(tx_power, frequency, minimal_rx_rssi = -120):
+	"""Free space distance in meters at which the signal drops to minimal_rx_rssi"""
+	exponent = (tx_power - minimal_rx_rssi + 147.56 - 20 * math.log10(frequency)) / 30
+	distance = 10 ** exponent
+	return distance
+
+@cache
+def slot_time(SF, BW):
+	"""Slot time of the contention window in µs, cached by the modulation, not by the node, so the cache holds no nodes"""
+	symbol_time = 1000000 * (2**SF/BW)
+	return 4 * symbol_time
+
 class BasicMeshNode:
 	def __init__(self, node_id: int = None,
 				long_name: str = None,
@@ -38,7 +92,9 @@ class BasicMeshNode:
 				debug = False,
 				messages_csv_name = 'messages.csv',
 				nodes_csv_name = 'nodes.csv',
-				backoff_csv_name = 'backoff.csv'):
+				backoff_csv_name = 'backoff.csv',
+				logger = None,
+				context = None):
 		"""
 		Initialize a basic network node
 		The basic mode is similar to Meshtastic but less complex. It uses flood routing,
@@ -56,10 +112,15 @@ class BasicMeshNode:
 		:param text_message_min_interval: minimal time before new text message is generated in µs
 		:param text_message_max_interval: maximal time before new text message is generated in µs
 		:param neighbors: List of other nodes in the simulated environment
+		:param logger: MeshLogger shared by all nodes of the simulation, if None the node creates its own one using *_csv_name files
+		:param context: MeshContext of the simulation (random number generator and constants), if None the node creates its own one
 		"""
+		self.context = context if context is not None else MeshContext(config_file = None)
+		self.constants = self.context.constants
+
 		# Generate random 32-bit node ID if not provided
 		if node_id is None:
-			self.node_id = random.randint(0, 0xFFFFFFFF)
+			self.node_id = self.context.random_id()
 		else:
 			self.node_id = node_id & 0xFFFFFFFF  # Ensure 32-bit value
 
@@ -94,7 +155,7 @@ class BasicMeshNode:
 		self.state = NodeState.IDLE
 		self.state_changed = False
 
-		self.message_queue = queue.Queue(maxsize = 20)
+		self.message_queue = MessageQueue(maxsize = 20)
 
 		self.neighbors = neighbors
 
@@ -104,8 +165,8 @@ class BasicMeshNode:
 		self.tx_time = 0
 
 		self.currently_receiving = {}
-		self.messages_heard = {}	#list of received messages, with counter of duplicates
-		self.known_nodes = []		#list of unique message.sender_addr in received frames
+		self.messages_heard = MeshPacketHistory(self.constants.PACKET_HISTORY_SIZE, self.constants.PACKET_HISTORY_EXPIRE)	#recently received messages, with counter of duplicates
+		self.known_nodes = set()	#unique message.sender_addr in received frames
 		self.rx_success = 0			#successfuly received messages
 		self.rx_fail = 0			#messages failed during receiving
 		self.rx_dups = 0			#received duplicates
@@ -118,7 +179,8 @@ class BasicMeshNode:
 		self.rx_time_sum = 0 		#time spent on rx
 		self.backoff_time_sum = 0	#time spent on backoff
 		self.tx_origin = 0			#number of messages generated by this node
-		self.tx_origin_list = []	#list of message id generated by this node
+		self.delivery_index = None	# MeshDeliveryIndex of the simulation, set by MeshSim
+		self.metrics = None			# MeshMetrics of the simulation, set by MeshSim
 		self.messages_confirmed = 0	#when the other node receives our message it will notify this object about the message (excluding duplicates), in the ideal network this should be equal to tx_origin*(len(neighbors)-1)
 
 		self.tx_util = 0.0			# tx_time_sum / current_time
@@ -128,7 +190,31 @@ class BasicMeshNode:
 		self.rx_start_time = None
 		self.backoff_start_time = None
 
-		self.logger = MeshLogger(message_file_path = messages_csv_name, nodes_file_path = nodes_csv_name, backoff_file_path = backoff_csv_name)
+		if logger is None:
+			self.logger = MeshLogger(message_file_path = messages_csv_name, nodes_file_path = nodes_csv_name, backoff_file_path = backoff_csv_name)
+		else:
+			self.logger = logger
+
+		self.index = None			#position of the node in the simulation's list of nodes
+		self.link_table = None		#MeshLinkTable with precomputed RSSI/SNR, if None the propagation model is used directly
+		self.reception_model = 'tick'	#'tick' - informed by the transmitter every step, 'interval' - see announce_transmission()
+		self.active_transmissions = {}	#node_id -> node, transmissions in progress, shared by all nodes of the simulation
+		self.event_queue = None		#MeshEventQueue, set only when the discrete-event engine is used
+		self.pending_events = {}	#EventType -> time of the scheduled event
+		self.last_event_state = None	#(current_time, tx_util, air_util) of the last event, saved by finish_events()
+		self.tx_end_time = None
+
+	def __getstate__(self):
+		"""Checkpoint state (see MeshCheckpoint.py), the message queue is stored as a list"""
+		state = instance_state(self)
+		state['message_queue'] = (self.message_queue.maxsize, list(self.message_queue.queue))
+		return state
+
+	def __setstate__(self, state):
+		maxsize, messages = state['message_queue']
+		self.__dict__.update(state)
+		self.message_queue = MessageQueue(maxsize)
+		self.message_queue.queue.extend(messages)
 
 	def find_node_by_id(self, node_id):
 		for n in self.neighbors:
@@ -143,10 +229,8 @@ class BasicMeshNode:
 			value = istart
 		return int(round(ostart + (ostop - ostart) * ((value - istart) / (istop - istart)), 0))
 
-	@cache
 	def calculate_slot_time(self):
-		symbol_time = 1000000 * (2**self.ModemPreset["SF"]/self.ModemPreset["BW"])
-		return 4 * symbol_time;
+		return slot_time(self.ModemPreset["SF"], self.ModemPreset["BW"])
 
 	def calculate_backoff_time(self, rebroadcast = True, SNR = 0):
 		"""
@@ -154,7 +238,7 @@ class BasicMeshNode:
 		"""
 		slot_time = self.calculate_slot_time()
 		CWsize = 1
-		bt = random.randint(CWsize * slot_time, 50*slot_time)
+		bt = self.context.randint(CWsize * slot_time, 50*slot_time)
 		self.logger.log_backoff(self, rebroadcast, SNR, CWsize, bt)
 		return bt
 
@@ -164,6 +248,8 @@ class BasicMeshNode:
 
 	def set_lora_config(self, mode: LoRaMode):
 		self.lora_mode = mode
+		self.ModemPreset = ModemPreset.params[int(self.lora_mode)]
+		self.minimal_snr = (-1) * self.ModemPreset['PG']
 
 	def set_node_id(self, new_id: int):
 		self.node_id = new_id & 0xFFFFFFFF  # Ensure 32-bit value
@@ -195,6 +281,8 @@ class BasicMeshNode:
 			self.state_changed = True
 		elif self.state == NodeState.TX_BUSY and new_state == NodeState.IDLE:
 			self.tx_time_sum += self.current_time - self.tx_start_time
+			if self.metrics is not None:
+				self.metrics.airtime('tx_airtime', self.index, self.tx_start_time, self.current_time)
 			self.state = new_state
 			self.state_changed = True
 		elif self.state == NodeState.WAITING_TO_TX and new_state == NodeState.RX_BUSY:
@@ -210,6 +298,8 @@ class BasicMeshNode:
 			self.state_changed = True
 		elif self.state == NodeState.RX_BUSY and (new_state == NodeState.IDLE or new_state == NodeState.WAITING_TO_TX):
 			self.rx_time_sum += self.current_time - self.rx_time_start
+			if self.metrics is not None:
+				self.metrics.airtime('rx_airtime', self.index, self.rx_time_start, self.current_time)
 			if new_state == NodeState.WAITING_TO_TX:
 				self.backoff_start_time = self.current_time
 			self.state = new_state
@@ -223,25 +313,61 @@ class BasicMeshNode:
 			return True
 		else:
 			return False
-	@cache
 	def calculate_theoretical_range(self, minimal_rx_rssi = -120):
-		exponent = (self.tx_power - minimal_rx_rssi + 147.56 - 20 * math.log10(self.frequency)) / 30
-		distance = 10 ** exponent
-		return distance
+		return theoretical_range(self.tx_power, self.frequency, minimal_rx_rssi)
 
 	def message_received(self):
 		self.messages_confirmed += 1
 
+	def message_originated(self, message):
+		"""Counts a message generated by this node and queued for transmission"""
+		self.tx_origin += 1
+		if self.delivery_index is not None:
+			self.delivery_index.originated(message.message_id, self.index, self.current_time)
+
+	def register_delivery(self, message):
+		"""
+		Records the first reception of the message by this node and confirms it to the origin
+		A message heard again after the packet history forgot it is forwarded again, but not counted again.
+		:return: False if the message was heard before
+		"""
+		if self.delivery_index is not None and not self.delivery_index.delivered(message.message_id, self.index,
+				message.hop_start - message.hop_limit, self.messages_heard.forgotten_time):
+			return False
+		if self.metrics is not None:
+			self.metrics.count('deliveries', self.index, self.current_time)
+		self.find_node_by_id(message.sender_addr).message_received()
+		return True
+
+	def enqueue_message(self, message):
+		"""Puts the message to the tx queue, raises queue.Full if the queue is full"""
+		self.message_queue.put(message, block = False)
+		if self.metrics is not None:
+			self.metrics.queue(self.index, self.current_time, self.message_queue.qsize())
+
+	def link_budget(self, informing_node):
+		"""(signal_rssi, signal_snr) of the informing_node's signal received by this node"""
+		if self.link_table is not None:
+			link = self.link_table.link(informing_node.index, self.index)
+			if link is not None:
+				return link
+			return float('-inf'), float('-inf') # not stored in the sparse table, never heard
+		signal_rssi = informing_node.tx_power - self.propagation_model.calculate_path_loss(informing_node, self)
+		return signal_rssi, signal_rssi - self.noise_level
+
 	def inform_neighbors(self, step_interval):
 		if self.state == NodeState.TX_BUSY and self.msg_tx_buffer is not None:
-			for n in self.neighbors:
-				if n.node_id != self.node_id:
-					n.inform(self, self.msg_tx_buffer, step_interval)
+			if self.link_table is not None: # only the nodes able to hear us
+				for n, signal_rssi, signal_snr in self.link_table.receivers[self.index]:
+					n.inform(self, self.msg_tx_buffer, step_interval, signal_rssi, signal_snr)
+			else:
+				for n in self.neighbors:
+					if n.node_id != self.node_id:
+						n.inform(self, self.msg_tx_buffer, step_interval)
 
-	def inform(self, informing_node, message, step_interval):
-		distance = self.propagation_model.calculate_distance(informing_node, self)
-		signal_rssi = informing_node.tx_power - self.propagation_model.calculate_path_loss(informing_node, self)
-		signal_snr = signal_rssi - self.noise_level
+	def inform(self, informing_node, message, step_interval, signal_rssi = None, signal_snr = None):
+		if signal_rssi is None:
+			signal_rssi, signal_snr = self.link_budget(informing_node)
 		#self.debug(f"inform distance: {distance}\tsignal_rssi: {signal_rssi}\tsignal_snr: {signal_snr}")
 		if self.state == NodeState.IDLE or self.state == NodeState.WAITING_TO_TX or self.state == NodeState.RX_BUSY:
 			if signal_snr > self.minimal_snr: # I am in the range of the transmitted message
@@ -266,10 +392,9 @@ class BasicMeshNode:
 					self.debug("RX end node: {:8x} message_id: {:8x}".format(informing_node.node_id, message.message_id))
 					if self.currently_receiving[informing_node.node_id]["collision"] == 0: # the message was successfuly received
 						self.rx_success += 1
-						if self.currently_receiving[informing_node.node_id]["message"].sender_addr not in self.known_nodes: #new node to the list of known nodes
-							self.known_nodes.append(self.currently_receiving[informing_node.node_id]["message"].sender_addr)
+						self.known_nodes.add(self.currently_receiving[informing_node.node_id]["message"].sender_addr)
 						self.logger.log_message(self.currently_receiving[informing_node.node_id]["message"], informing_node.node_id, self.node_id, self.current_time, signal_rssi, signal_snr, 0, 1)
-						self.process_received_message(copy.deepcopy(self.currently_receiving[informing_node.node_id]["message"]), signal_rssi, signal_snr)
+						self.process_received_message(self.currently_receiving[informing_node.node_id]["message"].copy(), signal_rssi, signal_snr)
 					else: # the collision happened during message receiving
 						self.logger.log_message(self.currently_receiving[informing_node.node_id]["message"], informing_node.node_id, self.node_id, self.current_time, signal_rssi, signal_snr, 1, 1)
 						self.rx_fail += 1
@@ -283,26 +408,28 @@ class BasicMeshNode:
 			#self.debug("during TX, informed by {:08x} about msg {:08x} distance: {:.2f} rssi {:.2f}".format(informing_node.node_id, message.message_id, distance, signal_rssi))
 			pass
 		else:
-			self.debug("unknown state, informed by {:08x} about msg {:08x} distance: {:.2f} rssi {:.2f}".format(informing_node.node_id, message.message_id, distance, signal_rssi))
+			self.debug("unknown state, informed by {:08x} about msg {:08x} distance: {:.2f} rssi {:.2f}".format(informing_node.node_id, message.message_id, self.propagation_model.calculate_distance(informing_node, self), signal_rssi))
 
 	def blame_collision(self):
 		self.collisions_caused += 1
+		if self.metrics is not None:
+			self.metrics.count('collisions', self.index, self.current_time)
 
 	def process_received_message(self, message, rssi = 0, snr = 0):
 		if message.sender_addr == self.node_id: #ignore echo of my own message
 			pass
-		elif message.message_id in self.messages_heard: #duplicate
+		elif self.messages_heard.seen(message.message_id, self.current_time) is not None: #duplicate
 			self.rx_dups += 1
 		else: # heard for the first time
-			self.messages_heard[message.message_id] = {"count": 1, "rssi": rssi, "snr": snr, "sender_addr": message.sender_addr, "hops_away": message.hop_start - message.hop_limit}
-			self.find_node_by_id(message.sender_addr).message_received()
+			new = self.register_delivery(message)
+			self.messages_heard.add(message.message_id, {"count": 1, "rssi": rssi, "snr": snr, "sender_addr": message.sender_addr, "hops_away": message.hop_start - message.hop_limit}, self.current_time, new)
 			if message.dest_addr == self.node_id: # we are the destination
 				self.rx_unicast += 1
 			else:
 				if message.hop_limit > 0:
 					message.hop_limit -= 1
 					try:
-						self.message_queue.put(message, block = False)
+						self.enqueue_message(message)
 						self.debug(f"message {message.message_id:08x} put to the tx queue with hop_limit {message.hop_limit}")
 					except:
 						self.debug("queue full, message dropped instead of forwarding")
@@ -313,38 +440,60 @@ class BasicMeshNode:
 		#Generate text messages only if text_message_min_interval < text_message_max_interval and text_message_max_interval != 0
 		if self.text_message_min_interval < self.text_message_max_interval and self.text_message_max_interval != 0:
 			if self.last_text_time == 0:
-				self.last_text_time = random.randint(self.text_message_min_interval, self.text_message_max_interval)
+				self.last_text_time = self.context.randint(self.text_message_min_interval, self.text_message_max_interval)
 			if self.current_time > self.last_text_time:
-				message = MeshMessage(random.randint(MeshConfig.TEXT_MIN_LEN, MeshConfig.TEXT_MAX_LEN), message_type = MessageType.TEXT, sender_addr = self.node_id, ModemPreset = self.ModemPreset, hop_start = self.hop_start)
-				self.last_text_time += random.randint(self.text_message_min_interval,self.text_message_max_interval)
+				message = MeshMessage(self.context.randint(self.constants.TEXT_MIN_LEN, self.constants.TEXT_MAX_LEN), message_type = MessageType.TEXT, sender_addr = self.node_id, ModemPreset = self.ModemPreset, hop_start = self.hop_start, context = self.context)
+				self.last_text_time += self.context.randint(self.text_message_min_interval,self.text_message_max_interval)
 				self.debug("TEXT generated")
 				try:
-					self.message_queue.put(message, block = False)
-					self.tx_origin += 1
-					self.tx_origin_list.append(message.message_id)
+					self.enqueue_message(message)
+					self.message_originated(message)
 					self.debug("message {:08x} added to the queue".format(message.message_id))
 				except:
 					self.debug("queue full, message dropped")
 
+	def check_rx_timeouts(self, step_interval):
+		"""Removes partially received messages that were not heard for RX_TIMEOUT steps"""
+		r_id = []
+		for n_id in self.currently_receiving:
+			if self.currently_receiving[n_id]["last_heard"] < self.current_time - (self.constants.RX_TIMEOUT * step_interval):
+				self.debug("Removing rx message from the queue after timeout; from 0x{:08x}".format(n_id))
+				self.logger.log_message(self.currently_receiving[n_id]["message"], n_id, self.node_id, self.current_time, 0, 0, int(self.currently_receiving[n_id]["collision"] > 0), 0)
+				r_id.append(n_id)
+				self.rx_fail += 1
+		for n_id in r_id:
+			del self.currently_receiving[n_id]
+		if len(self.currently_receiving) == 0:
+			if self.backoff_time > 0:
+				self.change_state(NodeState.WAITING_TO_TX)
+			else:
+				self.change_state(NodeState.IDLE)
+
+	def dequeue_message(self):
+		try:
+			self.msg_tx_buffer = self.message_queue.get(block=False)
+			if self.metrics is not None:
+				self.metrics.queue(self.index, self.current_time, self.message_queue.qsize())
+			rebroadcast = (self.msg_tx_buffer.sender_addr != self.node_id)
+			r_snr = 0
+			heard = self.messages_heard.get(self.msg_tx_buffer.message_id)
+			if heard is not None:
+				r_snr = heard["snr"]
+			if self.msg_tx_buffer.sender_addr != self.node_id:
+				self.forwarded += 1
+			self.backoff_time = self.calculate_backoff_time(rebroadcast = rebroadcast, SNR = r_snr)
+			self.change_state(NodeState.WAITING_TO_TX)
+			self.debug(f"Backoff: {self.backoff_time} µs")
+		except queue.Empty:
+			pass
+
 	def time_advance(self, step_interval = 1): #step interval in microseconds
 		self.current_time += step_interval
 
 		self.message_generator()
 
 		if self.state == NodeState.IDLE and self.msg_tx_buffer is None:
-			try:
-				self.msg_tx_buffer = self.message_queue.get(block=False)
-				rebroadcast = (self.msg_tx_buffer.sender_addr != self.node_id)
-				r_snr = 0
-				if self.msg_tx_buffer.message_id in self.messages_heard:
-					r_snr = self.messages_heard[self.msg_tx_buffer.message_id]["snr"]
-				if self.msg_tx_buffer.sender_addr != self.node_id:
-					self.forwarded += 1
-				self.backoff_time = self.calculate_backoff_time(rebroadcast = rebroadcast, SNR = r_snr)
-				self.change_state(NodeState.WAITING_TO_TX)
-				self.debug(f"Backoff: {self.backoff_time} µs")
-			except queue.Empty:
-				pass
+			self.dequeue_message()
 		elif self.state == NodeState.WAITING_TO_TX and self.msg_tx_buffer is not None:
 			self.backoff_time -= step_interval
 			if self.backoff_time <= 0:
@@ -352,29 +501,23 @@ class BasicMeshNode:
 				if len(self.currently_receiving) == 0:
 					self.tx_time = self.msg_tx_buffer.tx_time
 					self.change_state(NodeState.TX_BUSY)
+					if self.reception_model == 'interval':
+						self.announce_transmission()
 		elif self.state == NodeState.TX_BUSY:
 			self.tx_time -= step_interval
-			self.inform_neighbors(step_interval)
+			if self.reception_model == 'tick':
+				self.inform_neighbors(step_interval)
 			if self.tx_time <= 0:
+				message = self.msg_tx_buffer
 				self.change_state(NodeState.IDLE)
 				#self.debug("TX end,   msg_id = {:8x}".format(self.msg_tx_buffer.message_id))
 				self.msg_tx_buffer = None
 				self.tx_done += 1
-		elif self.state == NodeState.RX_BUSY: # Check if we have any partially received messages that could be removed from the queue after a timeout
-			r_id = []
-			for n_id in self.currently_receiving:
-				if self.currently_receiving[n_id]["last_heard"] < self.current_time - (MeshConfig.RX_TIMEOUT * step_interval):
-					self.debug("Removing rx message from the queue after timeout; from 0x{:08x}".format(n_id))
-					self.logger.log_message(self.currently_receiving[n_id]["message"], n_id, self.node_id, self.current_time, 0, 0, int(self.currently_receiving[n_id]["collision"] > 0), 0)
-					r_id.append(n_id)
-					self.rx_fail += 1
-			for n_id in r_id:
-				del self.currently_receiving[n_id]
-			if len(self.currently_receiving) == 0:
-				if self.backoff_time > 0:
-					self.change_state(NodeState.WAITING_TO_TX)
-				else:
-					self.change_state(NodeState.IDLE)
+				if self.reception_model == 'interval':
+					self.conclude_transmission(message)
+		elif self.state == NodeState.RX_BUSY:
+			if self.reception_model == 'tick': # interval receptions are resolved by the transmitter at the end of its transmission
+				self.check_rx_timeouts(step_interval)
 		else:
 			self.debug("state unknown")
 
@@ -384,28 +527,248 @@ class BasicMeshNode:
 		if self.state_changed:
 			self.logger.log_node(self)
 
+	def idle_steps(self, step_interval):
+		"""
+		Adaptive stepping: number of steps of step_interval before the step in which time_advance() does more
+		than counting the timers down (a message is due, the backoff or the transmission ends), the steps up to
+		and including that one can be taken as a single step; 1 - the next step is needed, None - no timer
+		"""
+		if self.state_changed:
+			return 1
+		if self.state == NodeState.IDLE:
+			if self.msg_tx_buffer is not None or self.message_queue.qsize() > 0:
+				return 1
+			steps = None
+		elif self.state == NodeState.WAITING_TO_TX and self.msg_tx_buffer is not None:
+			steps = max(math.ceil(self.backoff_time / step_interval), 1)
+		elif self.state == NodeState.TX_BUSY and self.reception_model == 'interval':
+			steps = max(math.ceil(self.tx_time / step_interval), 1)
+		elif self.state == NodeState.RX_BUSY and self.reception_model == 'interval':
+			steps = None	# resolved by the transmitter
+		elif self.state == NodeState.RX_BUSY and self.currently_receiving:	# the first step after the RX timeout of a reception
+			last_heard = min(r["last_heard"] for r in self.currently_receiving.values())
+			steps = max((last_heard + self.constants.RX_TIMEOUT * step_interval - self.current_time) // step_interval + 1, 1)
+		else:
+			return 1	# the tick reception model informs the receivers every step
+		due = self.next_generation_time()
+		if due is not None:
+			due_steps = max(-(-(due - self.current_time) // step_interval), 1)
+			steps = due_steps if steps is None else min(steps, due_steps)
+		return steps
+
+	"""
+	Discrete-event engine
+
+	Instead of being stepped every time_resolution, the node schedules its own events
+	(message generation, end of backoff, end of transmission) in the MeshEventQueue.
+	Receptions always use the interval model (see announce_transmission).
+	"""
+	def attach_event_queue(self, event_queue):
+		self.event_queue = event_queue
+		self.reception_model = 'interval'
+		self.message_generator()
+		self.event_done()
+
+	def handle_event(self, event_type, time):
+		self.current_time = time
+		if event_type == EventType.MESSAGE_GENERATION:
+			self.message_generator()
+		elif event_type == EventType.BACKOFF_END:
+			self.backoff_time = 0
+			self.start_transmission()
+		elif event_type == EventType.TX_END:
+			self.end_transmission()
+		self.event_done()
+
+	def event_done(self):
+		"""
+		Common tail of every event: take the next message from the queue when idle,
+		(re)schedule the pending timers and update the statistics
+		"""
+		if self.state == NodeState.IDLE and self.msg_tx_buffer is None:
+			self.dequeue_message()
+
+		if self.state == NodeState.WAITING_TO_TX and EventType.BACKOFF_END not in self.pending_events:
+			self.event_queue.schedule(self, EventType.BACKOFF_END, self.current_time + math.ceil(self.backoff_time))
+
+		self.schedule_generation()
+
+		self.update_utilization()
+
+		if self.state_changed:
+			self.logger.log_node(self)
+
+	def schedule_generation(self):
+		"""(Re)schedules the MESSAGE_GENERATION event at next_generation_time(), e.g. after the message intervals were changed"""
+		generation_time = self.next_generation_time()
+		if generation_time is None:
+			self.event_queue.cancel(self, EventType.MESSAGE_GENERATION)
+		else:
+			generation_time = max(generation_time, self.current_time + 1)
+			if self.pending_events.get(EventType.MESSAGE_GENERATION) != generation_time:
+				self.event_queue.schedule(self, EventType.MESSAGE_GENERATION, generation_time)
+
+	def next_generation_time(self):
+		"""Time of the next message_generator() call that may produce a message, None if no message will be generated"""
+		if self.text_message_min_interval < self.text_message_max_interval and self.text_message_max_interval != 0:
+			return self.last_text_time + 1 # message_generator() requires current_time > last_text_time
+		return None
+
+	def update_utilization(self):
+		if self.current_time > 0:
+			self.tx_util = self.tx_time_sum / self.current_time
+			self.air_util = (self.rx_time_sum + self.tx_time_sum) / self.current_time
+
+	def finish_events(self, time):
+		"""End of an event engine run: the statistics are brought up to time, resume_events() undoes it if the run continues"""
+		self.last_event_state = (self.current_time, self.tx_util, self.air_util)
+		self.current_time = time
+		self.update_utilization()
+
+	def resume_events(self):
+		"""Restores the state of the last event (air_util decides the next backoffs), a continued run goes on exactly like an uninterrupted one"""
+		if self.last_event_state is not None:
+			self.current_time, self.tx_util, self.air_util = self.last_event_state
+			self.last_event_state = None
+
+	def drop_before_tx(self):
+		"""Called when the backoff expires, returns True if the frame was dropped instead of being transmitted"""
+		return False
+
+	def start_transmission(self):
+		if self.msg_tx_buffer is None or self.drop_before_tx():
+			return
+		self.tx_time = self.msg_tx_buffer.tx_time
+		self.change_state(NodeState.TX_BUSY)
+		self.announce_transmission()
+		self.event_queue.schedule(self, EventType.TX_END, self.tx_end_time)
+
+	def end_transmission(self):
+		message = self.msg_tx_buffer
+		self.tx_time = 0
+		self.change_state(NodeState.IDLE)
+		self.msg_tx_buffer = None
+		self.tx_done += 1
+		self.transmission_finished(message)
+		self.conclude_transmission(message)
+
+	def transmission_finished(self, message):
+		pass
+
+	"""
+	Interval reception model
+
+	A transmission is registered once, as the interval [start, start + tx_time), on every
+	node able to hear it (announce_transmission -> begin_reception) and resolved once,
+	when the transmission ends (conclude_transmission -> end_reception). Collisions are
+	decided by the overlap of the intervals, so the collision time is exact regardless
+	of time_resolution and the cost does not depend on the number of ticks.
+	"""
+	def receivers(self):
+		"""List of (node, signal_rssi, signal_snr) of the nodes that may hear our transmission"""
+		if self.link_table is not None:
+			return self.link_table.receivers[self.index]
+		return [(n, None, None) for n in self.neighbors if n is not self]
+
+	def announce_transmission(self):
+		self.tx_end_time = self.current_time + self.tx_time
+		self.active_transmissions[self.node_id] = self
+		for n, signal_rssi, signal_snr in self.receivers():
+			n.begin_reception(self, self.msg_tx_buffer, signal_rssi = signal_rssi, signal_snr = signal_snr)
+
+	def conclude_transmission(self, message):
+		del self.active_transmissions[self.node_id]
+		for n, _, _ in self.receivers():
+			n.end_reception(self, message)
+		# transmissions started during our TX are heard only partially
+		for n in list(self.active_transmissions.values()):
+			self.begin_reception(n, n.msg_tx_buffer, complete = False)
+
+	def begin_reception(self, informing_node, message, complete = True, signal_rssi = None, signal_snr = None):
+		if self.state == NodeState.TX_BUSY:
+			return
+		if signal_rssi is None:
+			signal_rssi, signal_snr = self.link_budget(informing_node)
+		if signal_snr <= self.minimal_snr:
+			return
+		now = informing_node.current_time
+		if self.event_queue is not None:
+			self.current_time = now
+		if self.state == NodeState.WAITING_TO_TX: # backoff is suspended during RX
+			if self.event_queue is not None:
+				self.backoff_time = self.pending_events[EventType.BACKOFF_END] - now
+				self.event_queue.cancel(self, EventType.BACKOFF_END)
+			self.backoff_time = max(self.backoff_time, 1)
+		rx = {"rx_time": 0, "message": message, "last_heard": now, "collision": 0, "collision_until": now, "signal_rssi": signal_rssi, "signal_snr": signal_snr, "rx_start": now, "rx_end": informing_node.tx_end_time, "complete": complete}
+		if len(self.currently_receiving) != 0: # new message, but still during receiving another one
+			informing_node.blame_collision()
+			for other in self.currently_receiving.values():
+				overlap_end = min(other["rx_end"], rx["rx_end"])
+				self.add_collision(other, now, overlap_end)
+				self.add_collision(rx, now, overlap_end)
+			self.debug("collision of rx from: {}".format(list(self.currently_receiving.keys()) + [informing_node.node_id]))
+		self.currently_receiving[informing_node.node_id] = rx
+		self.change_state(NodeState.RX_BUSY)
+		if self.event_queue is not None:
+			self.event_done()
+
+	def add_collision(self, rx, start, end):
+		"""
+		Adds the overlap [start, end) to the collision time of the reception.
+		Overlaps are registered in non-decreasing order of start, so the union can be kept incrementally.
+		"""
+		if end > rx["collision_until"]:
+			rx["collision"] += end - max(start, rx["collision_until"])
+			rx["collision_until"] = end
+
+	def end_reception(self, informing_node, message):
+		rx = self.currently_receiving.get(informing_node.node_id)
+		if rx is None or rx["message"] is not message:
+			return
+		now = informing_node.current_time
+		if self.event_queue is not None:
+			self.current_time = now
+		rx["rx_time"] = now - rx["rx_start"]
+		rx["last_heard"] = now
+		signal_rssi, signal_snr = rx["signal_rssi"], rx["signal_snr"]
+		if not rx["complete"]: # only the tail of the transmission was heard, equivalent of the RX timeout
+			self.debug("Removing partially received message from 0x{:08x}".format(informing_node.node_id))
+			self.logger.log_message(message, informing_node.node_id, self.node_id, self.current_time, 0, 0, int(rx["collision"] > 0), 0)
+			self.rx_fail += 1
+		elif rx["collision"] == 0: # the message was successfuly received
+			self.debug("RX end node: {:8x} message_id: {:8x}".format(informing_node.node_id, message.message_id))
+			self.rx_success += 1
+			self.known_nodes.add(message.sender_addr)
+			self.logger.log_message(message, informing_node.node_id, self.node_id, self.current_time, signal_rssi, signal_snr, 0, 1)
+			self.process_received_message(message.copy(), signal_rssi, signal_snr)
+		else: # the collision happened during message receiving
+			self.logger.log_message(message, informing_node.node_id, self.node_id, self.current_time, signal_rssi, signal_snr, 1, 1)
+			self.rx_fail += 1
+		del self.currently_receiving[informing_node.node_id]
+		if len(self.currently_receiving) == 0:
+			if self.backoff_time > 0: #RX happened during backoff
+				self.change_state(NodeState.WAITING_TO_TX)
+			else:
+				self.change_state(NodeState.IDLE)
+		if self.event_queue is not None:
+			self.event_done()
+
 	def debug(self, log):
 		if self.debugMask:
 			print("T: {:9d}\tS: {:10s} N: {:08x}\t{}".format(self.current_time, self.state, self.node_id, log))
 
-	def __str__(self):
-		ret = "{}\n0x{:08x} - {}".format(self.long_name, self.node_id, self.state)
+	def tx_message_id(self):
+		"""ID of the message being sent or waiting for transmission, None if there is none"""
 		if (self.state == NodeState.TX_BUSY or self.state == NodeState.WAITING_TO_TX) and self.msg_tx_buffer is not None:
-			ret += f" msg: {self.msg_tx_buffer.message_id:08x}"
-		ret += "\nin queue: {} ".format(self.message_queue.qsize())
-		ret += f"known_nodes: {len(self.known_nodes)}\n"
-		ret += f"rx_success: {self.rx_success}, rx_fail: {self.rx_fail}, rx_dups: {self.rx_dups}\ntx_done: {self.tx_done}, tx_cancelled: {self.tx_cancelled}, forwarded: {self.forwarded}, collisions_caused: {self.collisions_caused}"
-		return ret
+			return self.msg_tx_buffer.message_id
+		return None
+
+	def __str__(self):
+		return node_description(self.long_name, self.node_id, self.state, self.tx_message_id(), self.message_queue.qsize(), len(self.known_nodes),
+			self.rx_success, self.rx_fail, self.rx_dups, self.tx_done, self.tx_cancelled, self.forwarded, self.collisions_caused)
 
 	def summarize(self):
 		return str(self) + f"\nrx_time_sum = {self.rx_time_sum}\ntx_time_sum = {self.tx_time_sum}\nbackoff_time_sum = {self.backoff_time_sum}\ntx_origin = {self.tx_origin}\ntx_util = {self.tx_util:.4f}\nair_util = {self.air_util:.4f}\n"
 
 	def color_from_state(self):
-		if self.state == NodeState.IDLE:
-			return 'green'
-		elif self.state == NodeState.WAITING_TO_TX:
-			return 'orange'
-		elif self.state == NodeState.RX_BUSY:
-			return '#aaaaff'
-		elif self.state == NodeState.TX_BUSY:
-			return 'red'
+		return STATE_COLORS.get(self.state)
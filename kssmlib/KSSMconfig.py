@@ -1,13 +1,9 @@
 import json
 
 class KSSMconfig:
-	_instance = None
-	
-	def __new__(cls):
-		if cls._instance is None:
-			cls._instance = super().__new__(cls)
-			cls._instance.load_config()
-		return cls._instance
+	"""Settings read from the KSSM configuration file (kssm.json), one instance per simulation"""
+	def __init__(self, config = 'kssm.json'):
+		self.load_config(config)
 	
 	def load_config(self, config = 'kssm.json'):
 		with open(config, 'r') as config_file:
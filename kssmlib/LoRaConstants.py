@@ -1,4 +1,5 @@
 import enum
+import re
 """
 LoRaMode is equal to ModemPreset in Meshtastic's protobufs
 Values taken from:
@@ -18,6 +19,13 @@ class LoRaMode(enum.IntEnum):
 	SHORT_TURBO = 8
 	CUSTOM_FASTEST  = 9 #theoretical fastest mode in sub-GHz LoRa
 
+def lora_mode_by_name(name):
+	"""LoRaMode of a name used in the JSON description of the map: 'LongFast' -> LoRaMode.LONG_FAST"""
+	try:
+		return LoRaMode[re.sub(r'(?<!^)(?=[A-Z])', '_', name).upper()]
+	except KeyError:
+		raise ValueError(f"Unknown LoRa mode: {name}") from None
+
 """
 PG - Processing Gain, calculated for every modem preset and corrected by coding rate value:
 PG = 10*log10(2^SF/SF) - 10*log10(CR/4)
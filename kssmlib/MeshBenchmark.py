@@ -0,0 +1,153 @@
+import csv
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import multiprocessing as mp
+from datetime import datetime, timezone
+import numpy as np
+from kssmlib import MeshConfig
+from kssmlib.MeshSweep import expand_grid
+from kssmlib.MeshTopology import generate_topology
+
+"""
+Scaling benchmark of the simulator core
+
+A benchmark file is a JSON object mapping the benchmark parameters (BENCHMARK_PARAMETERS) to lists of
+values, like a sweep file, e.g.
+	{"nodes": [10, 100, 1000, 5000], "lora_mode": ["LongFast", "ShortFast"], "text_interval": [10, 60], "time_resolution": [1000, 10000]}
+Every combination is one case: a random mesh of the given size is generated (the uniform layout of
+MeshTopology.py) and simulated headless in a fresh process, one case at a time, so the timings and the
+peak memory usage of the cases do not influence each other. The results are written to <results_dir>/benchmark.csv
+and, together with the environment (Python and NumPy versions, CPU, git revision), to benchmark.json.
+"""
+
+BENCHMARK_PARAMETERS = {
+	'nodes': 100,
+	'lora_mode': 'MediumFast',
+	'text_interval': 10,		# mean time between text messages of a node, s
+	'node_spacing': 1500,		# mean distance between neighboring nodes, m
+	'time_resolution': MeshConfig.SIMULATION_INTERVAL,
+	'simulation_time': 30,
+	'engine': 'tick',
+	'reception': 'tick',
+	'log_format': 'csv',
+	'seed': 1,
+}
+
+def _count_calls(cls, name, counter):
+	"""Replaces the method defined in cls by a wrapper counting its calls in counter[0]"""
+	method = cls.__dict__.get(name)
+	if method is None:
+		return
+	def counted(*args, **kwargs):
+		counter[0] += 1
+		return method(*args, **kwargs)
+	setattr(cls, name, counted)
+
+def _directory_size(path):
+	size = 0
+	for root, _, files in os.walk(path):
+		for f in files:
+			size += os.path.getsize(os.path.join(root, f))
+	return size
+
+def run_case(task):
+	"""Runs one benchmark case in a worker process and returns its row of the benchmark table"""
+	from kssmlib.BasicMeshNode import BasicMeshNode
+	from kssmlib.MeshtasticNode import MeshtasticNode
+	from kssmlib.MeshSim import MeshSim
+	case, parameters, results_dir, config_file = task
+	run_dir = os.path.join(results_dir, 'runs', f"{case:04d}")
+	os.makedirs(run_dir, exist_ok = True)
+
+	# signal deliveries from a transmitter to a receiver: inform() in the tick reception model, begin_reception() in the interval one
+	inform_calls = [0]
+	for cls in (BasicMeshNode, MeshtasticNode):
+		_count_calls(cls, 'inform', inform_calls)
+		_count_calls(cls, 'begin_reception', inform_calls)
+
+	nodes_data = generate_topology('uniform', parameters['nodes'], lora_mode = parameters['lora_mode'], text_interval = parameters['text_interval'],
+		node_spacing = parameters['node_spacing'], seed = parameters['seed'])
+	rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	start = time.perf_counter()
+	mesh_sim = MeshSim(nodes_data, config_file = config_file, results_dir = run_dir, engine = parameters['engine'],
+		reception_model = parameters['reception'], log_format = parameters['log_format'], verbose = False, plot_map = False,
+		seed = parameters['seed'])
+	setup_time = time.perf_counter() - start
+	start = time.perf_counter()
+	mesh_sim.run(int(parameters['simulation_time'] * 1000000), parameters['time_resolution'])
+	mesh_sim.close()
+	run_time = time.perf_counter() - start
+	metrics = mesh_sim.summary_metrics()
+
+	row = {'case': case}
+	row.update(parameters)
+	row.update({
+		'setup_time': round(setup_time, 4),
+		'run_time': round(run_time, 4),
+		'sim_s_per_wall_s': round(parameters['simulation_time'] / run_time, 4) if run_time > 0 else 0,
+		'inform_calls': inform_calls[0],
+		'inform_per_s': round(inform_calls[0] / run_time) if run_time > 0 else 0,
+		'tx_done': metrics['tx_done'],
+		'rx_success': metrics['rx_success'],
+		'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),	# ru_maxrss is in KiB on Linux
+		'start_rss_mb': round(rss_start / 1024, 1),
+		'output_bytes': _directory_size(run_dir),
+	})
+	return row
+
+def environment():
+	"""Description of the machine and the code the benchmark was run on"""
+	try:
+		revision = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+	except OSError:
+		revision = ''
+	return {
+		'date': datetime.now(timezone.utc).isoformat(),
+		'git_revision': revision,
+		'python': sys.version.split()[0],
+		'numpy': np.__version__,
+		'platform': platform.platform(),
+		'processor': platform.processor(),
+		'cpu_count': os.cpu_count(),
+	}
+
+def run_benchmark(grid, results_dir, config_file = 'kssm.json', processes = 1):
+	"""
+	Runs every case of the grid, each in a new process
+
+	:param grid: benchmark parameter name -> list of values, missing parameters use BENCHMARK_PARAMETERS
+	:param processes: number of cases run at the same time, 1 (default) gives comparable timings
+	:return: list of result rows, also written to <results_dir>/benchmark.csv and benchmark.json
+	"""
+	unknown = [k for k in grid if k not in BENCHMARK_PARAMETERS]
+	if unknown:
+		raise ValueError(f"Unknown benchmark parameters: {', '.join(unknown)}")
+	cases = []
+	for variant in expand_grid(grid):
+		parameters = dict(BENCHMARK_PARAMETERS)
+		parameters.update(variant)
+		cases.append(parameters)
+	tasks = [(case, parameters, results_dir, config_file) for case, parameters in enumerate(cases)]
+
+	results = []
+	# spawn: every case starts from a clean interpreter, so peak_rss_mb is the memory usage of that case only
+	with mp.get_context('spawn').Pool(max(1, processes or 1), maxtasksperchild = 1) as pool:
+		for row in pool.imap_unordered(run_case, tasks):
+			results.append(row)
+			print(f"benchmark: {len(results)}/{len(tasks)} case {row['case']:04d} nodes = {row['nodes']} {row['lora_mode']} "
+				f"{row['sim_s_per_wall_s']} sim s/s, {row['inform_per_s']} inform/s, {row['peak_rss_mb']} MB")
+	results.sort(key = lambda row: row['case'])
+
+	fields = list(results[0].keys()) if results else []
+	with open(os.path.join(results_dir, 'benchmark.csv'), 'w', newline='') as f:
+		writer = csv.DictWriter(f, fieldnames = fields)
+		writer.writeheader()
+		writer.writerows(results)
+	with open(os.path.join(results_dir, 'benchmark.json'), 'w') as f:
+		json.dump({'environment': environment(), 'grid': grid, 'results': results}, f, indent = 1)
+	return results
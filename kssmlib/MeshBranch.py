@@ -0,0 +1,140 @@
+import os
+import time
+import multiprocessing as mp
+from kssmlib.LoRaConstants import lora_mode_by_name
+from kssmlib.MeshtasticNode import MeshtasticNode, Role
+from kssmlib.MeshSweep import expand_grid, write_results
+from kssmlib.MeshScenario import role_by_name
+
+"""
+Scenario branching from a warm simulation
+
+run_branches() takes a MeshSim that has already run for a while (a warm-up, possibly resumed from a
+checkpoint) and forks one child process per variant. A forked child starts with a copy-on-write copy
+of the whole simulation, so the warm-up is simulated once, not once per variant. The child applies its
+variant to the running nodes, continues the simulation and returns its summary metrics.
+
+A variant is a dict like a row of a parameter sweep (MeshSweep.py):
+	- node parameters (BRANCH_PARAMETERS) are set on every node,
+	  "<node_id or long_name>.<parameter>" sets the parameter of a single node,
+	- "seed" gives the branch a new random number generator; without it all branches continue with
+	  the same random numbers, so they differ only by the effect of their variant.
+The values are given as in the --nodes_data file: role and lora_mode names, intervals in seconds.
+A grid (parameter name -> list of values) is expanded to all its combinations.
+
+The logs of branch N (including a copy of the warm-up part) are written to <results_dir>/branches/N/,
+the summary metrics of all the branches to <results_dir>/branches.csv, the first row (run "warmup")
+are the metrics of the simulation at the fork. The metrics of a branch cover only the time after the
+fork, so the ratios and peaks of the variants are not diluted by the common warm-up. Forking requires the 'fork' start method (Linux, macOS).
+"""
+
+BRANCH_PARAMETERS = ['role', 'hop_start', 'lora_mode', 'tx_power', 'noise_level', 'frequency', 'nodeinfo_interval',
+	'position_interval', 'text_message_min_interval', 'text_message_max_interval']
+LINK_PARAMETERS = ['lora_mode', 'tx_power', 'noise_level', 'frequency']	# the link table has to be rebuilt
+INTERVAL_PARAMETERS = ['nodeinfo_interval', 'position_interval', 'text_message_min_interval', 'text_message_max_interval']
+
+_warm_sim = None	# simulation inherited by the forked workers
+
+def find_nodes(sim, name):
+	"""Nodes of sim with the long_name or the hexadecimal node_id name"""
+	try:
+		node_id = int(name, 16)
+	except ValueError:
+		node_id = None
+	return [n for n in sim.nodes if n.long_name == name or n.node_id == node_id]
+
+def set_node_parameter(node, parameter, value):
+	if parameter == 'role':
+		if not isinstance(node, MeshtasticNode):
+			raise ValueError(f"Node {node.long_name} has no role")
+		if value not in Role.__members__:
+			raise ValueError(f"Unknown role: {value}")
+		node.set_role(role_by_name(value))
+	elif parameter == 'lora_mode':
+		node.set_lora_config(lora_mode_by_name(value))
+	elif parameter in INTERVAL_PARAMETERS:
+		if not hasattr(node, parameter):
+			raise ValueError(f"Node {node.long_name} has no {parameter}")
+		setattr(node, parameter, value * 1000000)
+	else:
+		setattr(node, parameter, value)
+
+def apply_branch(sim, variant):
+	"""Applies the variant to the nodes of the running simulation"""
+	rebuild = False
+	for key, value in variant.items():
+		if key == 'seed':
+			sim.context.reseed(value)
+			continue
+		name, parameter = key.rsplit('.', 1) if '.' in key else (None, key)
+		if parameter not in BRANCH_PARAMETERS:
+			raise ValueError(f"Branch parameter {key}: unknown parameter")
+		nodes = sim.nodes if name is None else find_nodes(sim, name)
+		if not nodes:
+			raise ValueError(f"Branch parameter {key}: node {name} not found")
+		for n in nodes:
+			set_node_parameter(n, parameter, value)
+		rebuild = rebuild or parameter in LINK_PARAMETERS
+	if rebuild:
+		sim.link_table.rebuild()
+	sim.refresh_schedules()	# the engines keep the next timer of every node, e.g. of a changed interval
+
+def run_branch(task):
+	"""Runs one branch in a process forked from the warm simulation and returns its row of the branch table"""
+	run, variant, simulation_time, results_dir = task
+	run_dir = os.path.join(results_dir, 'branches', f"{run:04d}")
+	os.makedirs(run_dir, exist_ok = True)
+
+	start = time.perf_counter()
+	sim = _warm_sim
+	sim.fork(run_dir)
+	fork_metrics = sim.metrics_snapshot()
+	apply_branch(sim, variant)
+	sim.run(simulation_time, sim.time_resolution)
+	sim.close()
+	row = {'run': run}
+	row.update(variant)
+	row.update(sim.summary_metrics(fork_metrics))
+	row['wall_time'] = round(time.perf_counter() - start, 3)
+	return row
+
+def run_branches(sim, variants, simulation_time, results_dir = None, processes = None):
+	"""
+	Continues the warm simulation once per variant in forked processes, sim itself is not changed
+
+	:param sim: MeshSim after its warm-up run()
+	:param variants: list of variants or a grid (parameter name -> list of values)
+	:param simulation_time: µs simulated by every branch
+	:param results_dir: directory of the branch results, the one of sim by default
+	:param processes: number of processes running at the same time, all cores by default
+	:return: list of result rows, also written to <results_dir>/branches.csv
+	"""
+	global _warm_sim
+	if isinstance(variants, dict):
+		variants = expand_grid(variants)
+	if results_dir is None:
+		results_dir = sim.results_dir
+	tasks = [(run, variant, simulation_time, results_dir) for run, variant in enumerate(variants)]
+	if processes is None:
+		processes = os.cpu_count() or 1
+	processes = max(1, min(processes, len(tasks)))
+
+	sim.prepare_fork()
+	results = []
+	_warm_sim = sim
+	try:
+		# every branch gets a fresh worker forked from the untouched warm simulation
+		with mp.get_context('fork').Pool(processes, maxtasksperchild = 1) as pool:
+			for row in pool.imap_unordered(run_branch, tasks):
+				results.append(row)
+				print(f"branch: {len(results)}/{len(tasks)} run {row['run']:04d} success_rate = {row['success_rate']:.4f} ({row['wall_time']} s)")
+	finally:
+		_warm_sim = None
+	results.sort(key = lambda row: row['run'])
+
+	warmup = {'run': 'warmup'}
+	for variant in variants:	# empty variant columns, the branch columns come before the metrics
+		warmup.update(dict.fromkeys(key for key in variant if key not in warmup))
+	warmup.update(sim.summary_metrics())
+	write_results(os.path.join(results_dir, 'branches.csv'), [warmup] + results)
+	return results
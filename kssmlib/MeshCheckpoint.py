@@ -0,0 +1,84 @@
+import os
+import pickle
+import types
+
+"""
+Checkpoints of a running simulation
+
+A checkpoint is a pickle of the whole MeshSim: nodes with their queues, backoffs and receptions in
+progress, the event queue, the random number generator, the statistics and the logger state with the
+size of every log file. A simulation loaded from a checkpoint continues exactly as the original one
+would have, its logs are truncated to (or copied up to) the sizes stored in the checkpoint.
+
+The nodes reference each other (neighbors, link table, transmissions in progress), pickling them
+recursively would nest one node in another. The nodes are therefore stored first, one by one, and
+every reference to a node is stored as its index (pickle persistent IDs).
+
+Objects that cannot be pickled are left out and set up again after the restore: the per-instance
+method wrappers (phase timers, vector and wheel engines), open files, the frame rendering pool.
+"""
+
+CHECKPOINT_NAME = 'checkpoint.pkl'
+CHECKPOINT_VERSION = 1
+
+def instance_state(obj, drop = ()):
+	"""obj.__dict__ for pickling without the method wrappers set on the instance and the attributes in drop"""
+	return {k: v for k, v in obj.__dict__.items() if not isinstance(v, types.FunctionType) and k not in drop}
+
+class _CheckpointPickler(pickle.Pickler):
+	def __init__(self, file, nodes):
+		super().__init__(file, protocol = pickle.HIGHEST_PROTOCOL)
+		self.node_indexes = {id(n): i for i, n in enumerate(nodes)}
+
+	def persistent_id(self, obj):
+		return self.node_indexes.get(id(obj))
+
+class _CheckpointUnpickler(pickle.Unpickler):
+	def __init__(self, file):
+		super().__init__(file)
+		self.nodes = []
+
+	def persistent_load(self, index):
+		return self.nodes[index]
+
+def save_checkpoint(sim, file_path):
+	"""Writes the checkpoint of sim, the file is replaced only when the new checkpoint is complete"""
+	temp_path = file_path + '.tmp'
+	with open(temp_path, 'wb') as f:
+		pickler = _CheckpointPickler(f, sim.nodes)
+		pickler.dump({'version': CHECKPOINT_VERSION, 'time': sim.current_time, 'node_classes': [type(n) for n in sim.nodes]})
+		pickler.dump([n.__getstate__() for n in sim.nodes])
+		pickler.dump(sim)
+	os.replace(temp_path, file_path)
+
+def load_checkpoint(file_path):
+	"""MeshSim stored by save_checkpoint()"""
+	with open(file_path, 'rb') as f:
+		unpickler = _CheckpointUnpickler(f)
+		header = unpickler.load()
+		if header.get('version') != CHECKPOINT_VERSION:
+			raise ValueError(f"Unsupported checkpoint version: {header.get('version')}")
+		unpickler.nodes = [cls.__new__(cls) for cls in header['node_classes']]
+		for node, state in zip(unpickler.nodes, unpickler.load()):
+			node.__setstate__(state)
+		return unpickler.load()
+
+def resume_file(old_path, new_path, offset):
+	"""
+	Prepares a log file for appending after a restore: the part written after the checkpoint is cut off,
+	if the results directory changed, the file is copied to new_path first. offset None - nothing was written.
+	"""
+	if offset is None:
+		if os.path.exists(new_path):
+			os.remove(new_path)
+		return
+	if os.path.abspath(old_path) != os.path.abspath(new_path):
+		with open(old_path, 'rb') as src, open(new_path, 'wb') as dst:
+			remaining = offset
+			while remaining > 0:
+				chunk = src.read(min(remaining, 1 << 20))
+				if not chunk:
+					break
+				dst.write(chunk)
+				remaining -= len(chunk)
+	os.truncate(new_path, offset)
@@ -15,3 +15,20 @@ POSITION_MAX_LEN = 70
 
 TEXT_MIN_LEN = 20
 TEXT_MAX_LEN = 100
+
+LINK_TABLE_DENSE_MAX_NODES = 2000 # above this number of nodes only the pairs in range are stored in the link table
+LINK_TABLE_BLOCK_ROWS = 256 # number of transmitters processed at once while building a sparse link table
+
+LOGGER_BUFFER_ROWS = 65536 # number of rows of every log file kept in memory before writing them to the disk
+
+RENDER_PROCESSES = 0 # number of processes rendering the PNG frames, 0 - number of CPU cores
+RENDER_QUEUE_SIZE = 32 # maximal number of frames waiting for rendering, the simulation is paused when the queue is full
+VIDEO_FPS = 25 # frame rate of the MP4 streamed to ffmpeg (--mp4_mode=stream)
+
+SUCCESS_RATE_MAX_CELLS = 270 # above this number of nodes the success rate heatmap shows blocks of nodes, so the matrices do not grow as N^2
+SUCCESS_RATE_MAX_INCHES = 27 # maximal size of the success rate heatmap, without the labels
+
+METRICS_WINDOW = 10000000 # µs, length of the time window of the streaming metrics (metrics.csv, metrics.png)
+
+PACKET_HISTORY_SIZE = 1024 # maximal number of message IDs a node remembers for the duplicate detection, the least recently heard is forgotten first
+PACKET_HISTORY_EXPIRE = 600000000 # µs, a message not heard for this time is forgotten (FLOOD_EXPIRE_TIME of the firmware), 0 - never
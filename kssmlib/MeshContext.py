@@ -0,0 +1,51 @@
+import numpy as np
+from kssmlib import MeshConfig
+from kssmlib.KSSMconfig import KSSMconfig
+
+class MeshConstants:
+	"""Simulation constants, initialized from the MeshConfig module and overridable per simulation"""
+	def __init__(self, overrides = None):
+		for name in dir(MeshConfig):
+			if not name.startswith('_'):
+				setattr(self, name, getattr(MeshConfig, name))
+		if overrides is not None:
+			for name, value in overrides.items():
+				if not hasattr(self, name):
+					raise ValueError(f"Unknown constant: {name}")
+				setattr(self, name, value)
+
+class MeshContext:
+	"""
+	State of one simulation shared by its nodes and messages: configuration, random number generator
+	and constants. Simulations with separate contexts do not share any state, so they can run side by side
+	in one process and each of them is reproducible from its seed.
+	"""
+	def __init__(self, config_file = 'kssm.json', seed = None, config_overrides = None, constants = None):
+		"""
+		:param config_file: KSSM configuration file, None for no configuration (nodes used outside MeshSim)
+		:param seed: seed of the random number generator, a random one is drawn (and stored in self.seed) if None
+		:param config_overrides: dict of configuration values replacing the ones read from config_file
+		:param constants: dict of MeshConfig constants overridden in this simulation
+		"""
+		self.config = KSSMconfig(config_file) if config_file is not None else None
+		if config_overrides is not None:
+			for key, value in config_overrides.items():
+				setattr(self.config, key, value)
+		seed_sequence = np.random.SeedSequence(seed)
+		self.seed = seed_sequence.entropy
+		self.rng = np.random.default_rng(seed_sequence)
+		self.constants = MeshConstants(constants)
+
+	def reseed(self, seed):
+		"""Continues with a new random number generator, e.g. in a branch of a running simulation"""
+		seed_sequence = np.random.SeedSequence(seed)
+		self.seed = seed_sequence.entropy
+		self.rng = np.random.default_rng(seed_sequence)
+
+	def randint(self, low, high):
+		"""Random integer N such that low <= N <= high (like random.randint)"""
+		return int(self.rng.integers(low, high, endpoint = True))
+
+	def random_id(self):
+		"""Random 32-bit node or message identifier"""
+		return int(self.rng.integers(0, 0x100000000))
@@ -0,0 +1,88 @@
+import numpy as np
+
+class MeshDeliveryIndex:
+	"""
+	Delivery records of all messages generated in the simulation: the origin node of every
+	message and (message, receiver, hops) of every first reception, kept in growable NumPy arrays.
+	Delivery-rate and mean-hops matrices are computed from them with vectorized reductions.
+	"""
+	def __init__(self, nodes_count, capacity = 1024):
+		self.nodes_count = nodes_count
+		self.message_rows = {}	# message_id -> row of origin
+		self.origin = np.empty(capacity, dtype=np.int32)
+		self.origin_time = np.empty(capacity)
+		self.first_delivery = np.empty(capacity, dtype=np.int64)	# deliveries recorded before the message was generated
+		self.messages = 0
+		self.delivery_message = np.empty(capacity, dtype=np.int32)
+		self.delivery_receiver = np.empty(capacity, dtype=np.int32)
+		self.delivery_hops = np.empty(capacity, dtype=np.int16)
+		self.deliveries = 0
+
+	def originated(self, message_id, origin_index, time):
+		"""A message generated by the node origin_index was queued for transmission at time"""
+		if self.messages == len(self.origin):
+			size = 2 * len(self.origin)
+			self.origin = np.resize(self.origin, size)
+			self.origin_time = np.resize(self.origin_time, size)
+			self.first_delivery = np.resize(self.first_delivery, size)
+		self.origin[self.messages] = origin_index
+		self.origin_time[self.messages] = time
+		self.first_delivery[self.messages] = self.deliveries
+		self.message_rows[message_id] = self.messages
+		self.messages += 1
+
+	def delivered(self, message_id, receiver_index, hops, forgotten_time = -1):
+		"""
+		The node receiver_index heard the message for the first time, hops away from its origin
+		:param forgotten_time: MeshPacketHistory.forgotten_time of the receiver; only if it forgot a message first heard
+			after this one was generated, the deliveries of this message are searched for receiver_index
+		:return: False if the delivery of the message to receiver_index is already recorded (the message was
+			forgotten by the packet history of the node and heard again), True otherwise
+		"""
+		row = self.message_rows.get(message_id)
+		if row is None:
+			return True
+		if forgotten_time >= self.origin_time[row]:
+			start = self.first_delivery[row]
+			d = self.deliveries
+			if np.any((self.delivery_message[start:d] == row) & (self.delivery_receiver[start:d] == receiver_index)):
+				return False
+		if self.deliveries == len(self.delivery_message):
+			size = 2 * len(self.delivery_message)
+			self.delivery_message = np.resize(self.delivery_message, size)
+			self.delivery_receiver = np.resize(self.delivery_receiver, size)
+			self.delivery_hops = np.resize(self.delivery_hops, size)
+		i = self.deliveries
+		self.delivery_message[i] = row
+		self.delivery_receiver[i] = receiver_index
+		self.delivery_hops[i] = hops
+		self.deliveries += 1
+		return True
+
+	def sent(self):
+		"""Number of messages generated by every node"""
+		return np.bincount(self.origin[:self.messages], minlength=self.nodes_count)
+
+	def matrices(self, block = 1):
+		"""
+		:param block: number of consecutive nodes aggregated into one row and column, so the matrices of a large mesh
+			are (N / block)^2 instead of N^2; the rate of a block pair is the delivered count divided by the number of
+			(message, receiver other than the origin) pairs of the block
+		:return: (delivered, delivery_rate, mean_hops) matrices indexed [origin, receiver],
+			NaN where the origin sent nothing (or origin = receiver) or nothing was delivered
+		"""
+		n = self.nodes_count
+		m = -(-n // block)
+		d = self.deliveries
+		keys = (self.origin[self.delivery_message[:d]].astype(np.int64) // block) * m + self.delivery_receiver[:d] // block
+		delivered = np.bincount(keys, minlength=m*m).reshape(m, m)
+		hops = np.bincount(keys, weights=self.delivery_hops[:d], minlength=m*m).reshape(m, m)
+		sent = self.sent()
+		blocks = np.arange(n) // block
+		block_sent = np.bincount(blocks, weights=sent, minlength=m)
+		pairs = block_sent[:, None] * np.bincount(blocks, minlength=m)[None, :]
+		pairs[np.diag_indices(m)] -= block_sent	# the origin does not receive its own messages
+		with np.errstate(divide='ignore', invalid='ignore'):
+			delivery_rate = np.where(pairs > 0, delivered / pairs, np.nan)
+			mean_hops = np.where(delivered > 0, hops / delivered, np.nan)
+		return delivered, delivery_rate, mean_hops
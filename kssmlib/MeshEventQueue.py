@@ -0,0 +1,55 @@
+import enum
+import heapq
+
+class EventType(enum.IntEnum):
+	MESSAGE_GENERATION = 0
+	BACKOFF_END = 1
+	TX_END = 2
+
+	def __str__(self):
+		return self.name
+
+class MeshEventQueue:
+	"""
+	Heap of timestamped node events used by the discrete-event engine.
+
+	Every node keeps at most one pending event of each EventType (node.pending_events).
+	Rescheduling an event only overwrites the pending time; the old heap entry stays
+	in the heap and is dropped when popped (lazy invalidation), so cancelling or moving
+	a timer costs O(log n) and never requires searching the heap.
+	"""
+	def __init__(self):
+		self._heap = []
+		self._seq = 0
+		self.events_processed = 0
+
+	def __len__(self):
+		return len(self._heap)
+
+	def schedule(self, node, event_type, time):
+		time = int(time)
+		node.pending_events[event_type] = time
+		heapq.heappush(self._heap, (time, self._seq, event_type, node))
+		self._seq += 1
+
+	def cancel(self, node, event_type):
+		node.pending_events.pop(event_type, None)
+
+	def next_time(self):
+		"""Time of the earliest valid event or None if the queue is empty"""
+		while self._heap:
+			time, _, event_type, node = self._heap[0]
+			if node.pending_events.get(event_type) == time:
+				return time
+			heapq.heappop(self._heap)
+		return None
+
+	def pop(self):
+		"""Removes and returns the earliest valid event as (time, event_type, node)"""
+		while self._heap:
+			time, _, event_type, node = heapq.heappop(self._heap)
+			if node.pending_events.get(event_type) == time:
+				del node.pending_events[event_type]
+				self.events_processed += 1
+				return time, event_type, node
+		return None
@@ -1,134 +1,217 @@
 import csv
 import os
-from kssmlib.MeshMessage import MeshMessage
+from kssmlib import MeshConfig
+from kssmlib.MeshCheckpoint import instance_state, resume_file
+from kssmlib.MeshTrace import MeshTraceIndex, MeshTraceSink, TRACE_INDEX_NAME, MESSAGE_TYPES, NODE_TYPES, BACKOFF_TYPES
+
+def _hex32(value):
+	return f"0x{value:08x}"
+
+def _hex32_short(value):
+	return f"{value:08x}"
+
+def _util(value):
+	return f"{value:.4f}"
+
+class MeshCSVSink:
+	"""Writes flushed MeshLogTable columns to a CSV file, opened on the first write and kept open until close()"""
+	def __init__(self, file_path, formatters = None):
+		self.file_path = file_path
+		self.formatters = formatters if formatters is not None else {}
+		self.file_descriptor = None
+		self.file_writer = None
+		self.offset = None	# size of the file at the last checkpoint
+
+	def __getstate__(self):
+		return instance_state(self, drop = ('file_descriptor', 'file_writer'))
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.file_descriptor = None
+		self.file_writer = None
+
+	def checkpoint(self):
+		self.offset = os.path.getsize(self.file_path) if os.path.isfile(self.file_path) else None
+
+	def resume(self, file_path):
+		resume_file(self.file_path, file_path, self.offset)
+		self.file_path = file_path
+
+	def detach(self):
+		"""Forgets the open file without closing it, it belongs to the parent of a forked process"""
+		self.file_descriptor = None
+		self.file_writer = None
+
+	def write(self, fields, columns, size):
+		if self.file_descriptor is None:
+			file_exists = os.path.isfile(self.file_path)
+			self.file_descriptor = open(self.file_path, mode='a', newline='')
+			self.file_writer = csv.writer(self.file_descriptor)
+			if not file_exists:
+				self.file_writer.writerow(fields)
+		formatted = []
+		for name, column in zip(fields, columns):
+			values = column[:size]
+			if name in self.formatters:
+				values = list(map(self.formatters[name], values))
+			formatted.append(values)
+		self.file_writer.writerows(zip(*formatted))
+		self.file_descriptor.flush()
+
+	def close(self):
+		if self.file_descriptor is not None:
+			self.file_descriptor.close()
+			self.file_descriptor = None
+			self.file_writer = None
+
+class MeshLogTable:
+	"""
+	One log table with preallocated in-memory column buffers.
+	Rows are stored as raw values and handed to the sink (CSV or binary trace) in one batch
+	when the buffer is full or on flush().
+	"""
+	def __init__(self, fields, sink, capacity = MeshConfig.LOGGER_BUFFER_ROWS):
+		self.fields = list(fields)
+		self.sink = sink
+		self.capacity = capacity
+		self.columns = [[None] * capacity for _ in self.fields]
+		self.size = 0
+		self.rows_written = 0
+
+	def __getstate__(self):
+		return instance_state(self)
+
+	def append(self, *values):
+		i = self.size
+		for column, value in zip(self.columns, values):
+			column[i] = value
+		self.size = i + 1
+		if self.size == self.capacity:
+			self.flush()
+
+	def flush(self):
+		if self.size == 0:
+			return
+		self.sink.write(self.fields, self.columns, self.size)
+		self.rows_written += self.size
+		self.size = 0
+
+	def close(self):
+		self.flush()
+		self.sink.close()
 
 class MeshLogger:
-	def __init__(self, message_file_path="message.csv", nodes_file_path="nodes.csv", backoff_file_path = "backoff.csv"):
+	"""
+	Simulation-wide logger of messages, node states and backoff calculations.
+	One instance is owned by MeshSim and shared by all nodes, call close() at the end of the run.
+	"""
+	MESSAGE_FIELDS = ['timestamp', 'message_id', 'sender_addr', 'dest_addr', 'message_type', 'message_length', 'message_tx_time',
+		'hop_start', 'hop_limit', 'tx_node', 'rx_node', 'rssi', 'snr', 'collision', 'complete_reception']
+	NODE_FIELDS = ['time', 'node_id', 'long_name', 'role', 'position', 'tx_power', 'noise_level', 'frequency', 'lora_mode', 'state',
+		'backoff_time', 'message_queue_len', 'messages_heard', 'known_nodes', 'rx_success', 'rx_fail', 'rx_dups', 'rx_unicast',
+		'tx_done', 'forwarded', 'tx_cancelled', 'collisions_caused', 'tx_origin', 'messages_confirmed', 'tx_sime_sum', 'rx_time_sum',
+		'backoff_time_sum', 'tx_util', 'air_util']
+	BACKOFF_FIELDS = ['time', 'node_id', 'long_name', 'role', 'tx_util', 'air_util', 'rebroadcast', 'SNR', 'CWsize', 'calculated_backoff']
+
+	def __init__(self, message_file_path="message.csv", nodes_file_path="nodes.csv", backoff_file_path = "backoff.csv", buffer_rows = MeshConfig.LOGGER_BUFFER_ROWS, log_format = 'csv'):
+		"""
+		:param log_format: 'csv' - text files, 'binary' - binary columnar trace (see MeshTrace.py),
+			the *.csv names are then used with the .bin extension
+		"""
 		self.message_file_path = message_file_path
 		self.nodes_file_path = nodes_file_path
 		self.backoff_file_path = backoff_file_path
-		
-		self.message_file_path_descriptor = None
-		self.nodes_file_path_descriptor = None
-		self.backoff_file_path_descriptor = None
-		
-		self.message_file_writer = None
-		self.nodes_file_writer = None
-		self.backoff_file_writer = None
-	
+		self.log_format = log_format
+
+		if log_format == 'csv':
+			message_sink = MeshCSVSink(message_file_path, {
+				'message_id': _hex32, 'sender_addr': _hex32, 'dest_addr': _hex32, 'tx_node': _hex32, 'rx_node': _hex32,
+			})
+			nodes_sink = MeshCSVSink(nodes_file_path, {'node_id': _hex32_short, 'tx_util': _util, 'air_util': _util})
+			backoff_sink = MeshCSVSink(backoff_file_path, {'node_id': _hex32_short, 'tx_util': _util, 'air_util': _util, 'rebroadcast': int})
+		elif log_format == 'binary':
+			self.trace_index = MeshTraceIndex(os.path.join(os.path.dirname(nodes_file_path), TRACE_INDEX_NAME))
+			message_sink = MeshTraceSink(self.trace_index, 'messages', os.path.splitext(message_file_path)[0] + '.bin', MESSAGE_TYPES)
+			nodes_sink = MeshTraceSink(self.trace_index, 'nodes', os.path.splitext(nodes_file_path)[0] + '.bin', NODE_TYPES)
+			backoff_sink = MeshTraceSink(self.trace_index, 'backoff', os.path.splitext(backoff_file_path)[0] + '.bin', BACKOFF_TYPES)
+		else:
+			raise ValueError(f"Unknown log format: {log_format}")
+
+		self.messages = MeshLogTable(self.MESSAGE_FIELDS, message_sink, buffer_rows)
+		self.nodes = MeshLogTable(self.NODE_FIELDS, nodes_sink, buffer_rows)
+		self.backoffs = MeshLogTable(self.BACKOFF_FIELDS, backoff_sink, buffer_rows)
+		self.tables = [self.messages, self.nodes, self.backoffs]
+		self.last_node_values = {}	# node_id -> values of the last log_node() row
+		self.closed = False
+
 	def __del__(self):
-		if self.message_file_path_descriptor is not None:
-			self.message_file_path_descriptor.close()
-		if self.nodes_file_path_descriptor is not None:
-			self.nodes_file_path_descriptor.close()
-		if self.backoff_file_path_descriptor is not None:
-			self.backoff_file_path_descriptor.close()
-		
+		if hasattr(self, 'tables'):
+			self.close()
+
+	def __getstate__(self):
+		return instance_state(self)
+
+	def checkpoint(self):
+		"""Writes the buffered rows and remembers the size of every log file"""
+		for t in self.tables:
+			t.flush()
+			t.sink.checkpoint()
+		if self.log_format == 'binary':
+			self.trace_index.write()
+
+	def resume(self, results_dir):
+		"""Continues the logs of a simulation restored from a checkpoint in results_dir, see MeshCheckpoint.resume_file()"""
+		for t in self.tables:
+			t.sink.resume(os.path.join(results_dir, os.path.basename(t.sink.file_path)))
+		self.message_file_path = os.path.join(results_dir, os.path.basename(self.message_file_path))
+		self.nodes_file_path = os.path.join(results_dir, os.path.basename(self.nodes_file_path))
+		self.backoff_file_path = os.path.join(results_dir, os.path.basename(self.backoff_file_path))
+		if self.log_format == 'binary':
+			self.trace_index.index_path = os.path.join(results_dir, TRACE_INDEX_NAME)
+			self.trace_index.write()
+
+	def fork(self, results_dir):
+		"""Continues the logs in results_dir in a forked process, the parent has to call checkpoint() before the fork"""
+		for t in self.tables:
+			t.sink.detach()
+		self.resume(results_dir)
+
+	def flush(self):
+		for t in self.tables:
+			t.flush()
+
+	def close(self):
+		if self.closed:
+			return
+		for t in self.tables:
+			t.close()
+		self.closed = True
+
 	def log_message(self, mesh_message, tx_node, rx_node, timestamp, rssi, snr, collision, complete_reception):
-		message_id = mesh_message.message_id
-		sender_addr = mesh_message.sender_addr
-		dest_addr = mesh_message.dest_addr
-		message_type = mesh_message.message_type
-		hop_start = mesh_message.hop_start
-		hop_limit = mesh_message.hop_limit
-
-		message_id_hex = f"0x{message_id:08x}"
-		sender_addr_hex = f"0x{sender_addr:08x}"
-		dest_addr_hex = f"0x{dest_addr:08x}"
-
-		log_data = {
-			'timestamp': timestamp,
-			'message_id': message_id_hex,
-			'sender_addr': sender_addr_hex,
-			'dest_addr': dest_addr_hex,
-			'message_type': message_type,
-			'message_length': mesh_message.length,
-			'message_tx_time': mesh_message.tx_time,
-			'hop_start': hop_start,
-			'hop_limit': hop_limit,
-			'tx_node': f"0x{tx_node:08x}",
-			'rx_node': f"0x{rx_node:08x}",
-			'rssi': rssi,
-			'snr': snr,
-			'collision': collision,
-			'complete_reception': complete_reception
-		}
-
-		if self.message_file_path_descriptor is None:
-			file_exists = os.path.isfile(self.message_file_path)
-			self.message_file_path_descriptor = open(self.message_file_path, mode='a', newline='')
-			fieldnames = log_data.keys()
-			self.message_file_writer = csv.DictWriter(self.message_file_path_descriptor, fieldnames=fieldnames)
-			if not file_exists:
-				self.message_file_writer.writeheader()
-				self.message_file_path_descriptor.flush()
-		
-		self.message_file_writer.writerow(log_data)
-		
-	
+		self.messages.append(timestamp, mesh_message.message_id, mesh_message.sender_addr, mesh_message.dest_addr, mesh_message.message_type,
+			mesh_message.length, mesh_message.tx_time, mesh_message.hop_start, mesh_message.hop_limit, tx_node, rx_node,
+			rssi, snr, collision, complete_reception)
+
 	def log_node(self, node):
-		log_data = {
-			'time': node.current_time,
-			'node_id': f"{node.node_id:08x}",
-			'long_name': node.long_name,
-			'role': node.role,
-			'position': node.position,
-			'tx_power': node.tx_power,
-			'noise_level': node.noise_level,
-			'frequency': node.frequency,
-			'lora_mode': node.lora_mode,
-			'state': node.state,
-			'backoff_time': node.backoff_time,
-			'message_queue_len': node.message_queue.qsize(),
-			'messages_heard': len(node.messages_heard),
-			'known_nodes': len(node.known_nodes),
-			'rx_success': node.rx_success,
-			'rx_fail': node.rx_fail,
-			'rx_dups': node.rx_dups,
-			'rx_unicast': node.rx_unicast,
-			'tx_done': node.tx_done,
-			'forwarded': node.forwarded,
-			'tx_cancelled': node.tx_cancelled,
-			'collisions_caused': node.collisions_caused,
-			'tx_origin': node.tx_origin,
-			'messages_confirmed': node.messages_confirmed,
-			'tx_sime_sum': node.tx_time_sum,
-			'rx_time_sum': node.rx_time_sum,
-			'backoff_time_sum': node.backoff_time_sum,
-			'tx_util': f"{node.tx_util:.4f}",
-			'air_util': f"{node.air_util:.4f}",
-		}
-		file_exists = os.path.isfile(self.nodes_file_path)
-
-		if self.nodes_file_path_descriptor is None:
-			self.nodes_file_path_descriptor = open(self.nodes_file_path, mode='a', newline='')
-			fieldnames = log_data.keys()
-			self.nodes_file_writer = csv.DictWriter(self.nodes_file_path_descriptor, fieldnames=fieldnames)
-			if not file_exists:
-				self.nodes_file_writer.writeheader()
-				self.nodes_file_path_descriptor.flush()
-		self.nodes_file_writer.writerow(log_data)
-	
+		values = (node.current_time, node.node_id, node.long_name, node.role, node.position, node.tx_power, node.noise_level,
+			node.frequency, node.lora_mode, node.state, node.backoff_time, node.message_queue.qsize(), node.messages_heard.heard,
+			len(node.known_nodes), node.rx_success, node.rx_fail, node.rx_dups, node.rx_unicast, node.tx_done, node.forwarded,
+			node.tx_cancelled, node.collisions_caused, node.tx_origin, node.messages_confirmed, node.tx_time_sum, node.rx_time_sum,
+			node.backoff_time_sum, node.tx_util, node.air_util)
+		self.last_node_values[node.node_id] = values
+		self.nodes.append(*values)
+
+	def last_node_rows(self):
+		"""The last logged row of every node, sorted by node_id, formatted like nodes.csv"""
+		rows = []
+		for node_id in sorted(self.last_node_values):
+			row = dict(zip(self.NODE_FIELDS, self.last_node_values[node_id]))
+			row['node_id'] = _hex32_short(row['node_id'])
+			row['tx_util'] = _util(row['tx_util'])
+			row['air_util'] = _util(row['air_util'])
+			rows.append(row)
+		return rows
+
 	def log_backoff(self, node, rebroadcast, SNR, CWsize, calculated_backoff):
-		log_data = {
-			'time': node.current_time,
-			'node_id': f"{node.node_id:08x}",
-			'long_name': node.long_name,
-			'role': node.role,
-			'tx_util': f"{node.tx_util:.4f}",
-			'air_util': f"{node.air_util:.4f}",
-			'rebroadcast': int(rebroadcast),
-			'SNR': SNR,
-			'CWsize': CWsize,
-			'calculated_backoff': calculated_backoff,
-		}
-		file_exists = os.path.isfile(self.backoff_file_path)
-
-		if self.backoff_file_path_descriptor is None:
-			self.backoff_file_path_descriptor = open(self.backoff_file_path, mode='a', newline='')
-			fieldnames = log_data.keys()
-			self.backoff_file_writer = csv.DictWriter(self.backoff_file_path_descriptor, fieldnames=fieldnames)
-			if not file_exists:
-				self.backoff_file_writer.writeheader()
-				self.backoff_file_path_descriptor.flush()
-		self.backoff_file_writer.writerow(log_data)
+		self.backoffs.append(node.current_time, node.node_id, node.long_name, node.role, node.tx_util, node.air_util, rebroadcast,
+			SNR, CWsize, calculated_backoff)
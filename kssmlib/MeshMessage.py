@@ -1,4 +1,5 @@
 import random
+from functools import cache
 from math import ceil
 from enum import Enum
 from kssmlib.LoRaConstants import *
@@ -10,15 +11,58 @@ class MessageType(Enum):
 	NODEINFO = 3
 	TELEMETRY = 4
 
+MAX_LENGTH = 250
+
+def calculate_tx_time(SF, BW, CR, length):
+	"""Time on air of a LoRa frame in µs"""
+	# https://github.com/meshtastic/meshtastic/blob/master/static/documents/LoRa_Design_Guide.pdf
+	# 4 The LoRa Packet Format & Time On Air
+
+	symbol_length = 1000000*(2**SF / BW)
+	low_data_rate_optimization = 1 if symbol_length > 16000 else 0 #when symbol_length > 16 ms
+	header_disabled = 0 #header is always added
+	cr = CR - 4
+	
+	preamble_time = (16 + 4.25) * symbol_length
+	
+	payload_symbols = 8 + max(ceil(((8.0 * length - 4 * SF + 28 + 16 - 20 * header_disabled) / (4 * (SF - 2 * low_data_rate_optimization))) * cr), 0.0)
+	
+	return int(preamble_time + (payload_symbols * symbol_length))
+
+@cache
+def tx_time_table(SF, BW, CR):
+	"""Time on air of the frames of every length (0 - MAX_LENGTH bytes) of the modulation, indexed by the length"""
+	return tuple(calculate_tx_time(SF, BW, CR, length) for length in range(MAX_LENGTH + 1))
+
+class MeshPayload:
+	"""
+	The part of a message that does not change on the way through the mesh, shared by all the copies
+	of the message (the one in the tx queue of every forwarding node, the ones being received)
+	"""
+	__slots__ = ('message_id', 'message_type', 'length', 'sender_addr', 'dest_addr', 'hop_start', 'ModemPreset', 'tx_time')
+
+	def __init__(self, message_id, message_type, length, sender_addr, dest_addr, hop_start, ModemPreset):
+		self.message_id = message_id
+		self.message_type = message_type
+		self.length = length
+		self.sender_addr = sender_addr
+		self.dest_addr = dest_addr
+		self.hop_start = hop_start
+		self.ModemPreset = ModemPreset
+		self.tx_time = tx_time_table(ModemPreset["SF"], ModemPreset["BW"], ModemPreset["CR"])[length]
+
 class MeshMessage:
 	"""
 	A class representing a message in Meshtastic protocol.
+	A message is a small per-hop header (hop_limit) pointing to the shared MeshPayload, copy() makes
+	the receiver's own header without copying the payload.
 	"""
+	__slots__ = ('payload', 'hop_limit')
 	
 	# Broadcast address
 	BROADCAST_ADDR = 0xffffffff
 	
-	def __init__(self, length, message_type=MessageType.TEXT, message_id=None, hop_start=3, sender_addr=None, dest_addr=BROADCAST_ADDR, ModemPreset = ModemPreset.params[int(LoRaMode.MEDIUM_FAST)]):
+	def __init__(self, length, message_type=MessageType.TEXT, message_id=None, hop_start=3, sender_addr=None, dest_addr=BROADCAST_ADDR, ModemPreset = ModemPreset.params[int(LoRaMode.MEDIUM_FAST)], context=None):
 		"""
 		Initialize a MeshMessage object.
 		
@@ -29,47 +73,57 @@ class MeshMessage:
 			hop_start (int): Starting hop count (0-7)
 			sender_addr (int): 32-bit integer address of the sender
 			dest_addr (int): 32-bit integer address of the recipient
+			context (MeshContext): simulation context used to draw the random message_id
 		"""
 		# Validate length
-		if not isinstance(length, int) or length <= 0 or length > 250:
+		if not isinstance(length, int) or length <= 0 or length > MAX_LENGTH:
 			raise ValueError("Message length must be between 1 and 250 bytes")
-		self.length = length
 		
 		# Validate message type
 		if not isinstance(message_type, MessageType):
 			raise ValueError("Invalid message type, must be a MessageType enum")
-		self.message_type = message_type
 		
 		# Generate random ID if not provided
 		if message_id is None:
-			self.message_id = random.randint(0, 0xFFFFFFFF)
-		else:
-			if not isinstance(message_id, int) or message_id < 0 or message_id > 0xFFFFFFFF:
-				raise ValueError("Message ID must be a 32-bit integer (0 to 4294967295)")
-			self.message_id = message_id
+			message_id = context.random_id() if context is not None else random.randint(0, 0xFFFFFFFF)
+		elif not isinstance(message_id, int) or message_id < 0 or message_id > 0xFFFFFFFF:
+			raise ValueError("Message ID must be a 32-bit integer (0 to 4294967295)")
 		
 		# Validate hop_start
 		if not isinstance(hop_start, int) or hop_start < 0 or hop_start > 7:
 			raise ValueError("hop_start must be between 0 and 7")
-		self.hop_start = hop_start
-		
-		self.hop_limit = hop_start
 		
 		# Validate sender address
 		if sender_addr is None:
 			raise ValueError("Sender address must be provided")
 		if not isinstance(sender_addr, int) or sender_addr < 0 or sender_addr > 0xFFFFFFFF:
 			raise ValueError("Sender address must be a 32-bit integer (0 to 4294967295)")
-		self.sender_addr = sender_addr
 		
 		# Validate destination address
 		if not isinstance(dest_addr, int) or dest_addr < 0 or dest_addr > 0xFFFFFFFF:
 			raise ValueError("Destination address must be a 32-bit integer (0 to 4294967295)")
-		self.dest_addr = dest_addr
-		
-		self.ModemPreset = ModemPreset
 		
-		self.calculate_tx_time()
+		self.payload = MeshPayload(message_id, message_type, length, sender_addr, dest_addr, hop_start, ModemPreset)
+		self.hop_limit = hop_start
+	
+	def copy(self):
+		"""New header with the same hop_limit and payload, e.g. for the node that received the message"""
+		message = MeshMessage.__new__(MeshMessage)
+		message.payload = self.payload
+		message.hop_limit = self.hop_limit
+		return message
+	
+	def __deepcopy__(self, memo):
+		return self.copy()	# the payload is immutable
+	
+	message_id = property(lambda self: self.payload.message_id)
+	message_type = property(lambda self: self.payload.message_type)
+	length = property(lambda self: self.payload.length)
+	sender_addr = property(lambda self: self.payload.sender_addr)
+	dest_addr = property(lambda self: self.payload.dest_addr)
+	hop_start = property(lambda self: self.payload.hop_start)
+	ModemPreset = property(lambda self: self.payload.ModemPreset)
+	tx_time = property(lambda self: self.payload.tx_time)
 	
 	def __str__(self):
 		"""Return a string representation of the message."""
@@ -83,18 +137,3 @@ class MeshMessage:
 	def is_broadcast(self):
 		"""Check if the message is a broadcast message."""
 		return self.dest_addr == self.BROADCAST_ADDR
-	
-	def calculate_tx_time(self):
-		# https://github.com/meshtastic/meshtastic/blob/master/static/documents/LoRa_Design_Guide.pdf
-		# 4 The LoRa Packet Format & Time On Air
-
-		symbol_length = 1000000*(2**self.ModemPreset["SF"] / self.ModemPreset["BW"])
-		low_data_rate_optimization = 1 if symbol_length > 16000 else 0 #when symbol_length > 16 ms
-		header_disabled = 0 #header is always added
-		cr = self.ModemPreset["CR"] - 4
-		
-		preamble_time = (16 + 4.25) * symbol_length
-		
-		payload_symbols = 8 + max(ceil(((8.0 * self.length - 4 * self.ModemPreset["SF"] + 28 + 16 - 20 * header_disabled) / (4 * (self.ModemPreset["SF"] - 2 * low_data_rate_optimization))) * cr), 0.0)
-		
-		self.tx_time = int(preamble_time + (payload_symbols * symbol_length))
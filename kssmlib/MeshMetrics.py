@@ -0,0 +1,133 @@
+import csv
+import numpy as np
+from kssmlib import MeshConfig
+
+"""
+Streaming metrics
+
+Nodes push their events (end of a transmission or reception, collision, first reception of a message,
+queue length change) to the MeshMetrics of the simulation while it runs. Every event updates a constant
+number of counters of the (window, node) cell, so the per-window time series and the totals are ready
+as soon as the simulation ends, without reading the logs back.
+"""
+
+# field -> NumPy type of the per-window, per-node counters
+METRIC_TYPES = {
+	'tx_airtime': 'i8',		# µs of transmission
+	'rx_airtime': 'i8',		# µs of reception
+	'collisions': 'i4',		# collisions caused by the node's transmissions
+	'deliveries': 'i4',		# messages heard for the first time
+	'queue_max': 'i4',		# maximal tx queue length
+	'queue_sum': 'i8',		# sum and number of the queue length samples, for the mean queue length
+	'queue_samples': 'i4',
+}
+
+class MeshMetrics:
+	"""Per-node, per-window running counters of one simulation, see METRIC_TYPES"""
+	def __init__(self, nodes_count, window = MeshConfig.METRICS_WINDOW, capacity = 64):
+		"""
+		:param nodes_count: number of nodes of the simulation, events are identified by the node index
+		:param window: window length in µs
+		:param capacity: number of windows allocated up front, the arrays grow when the simulation gets longer
+		"""
+		self.nodes_count = nodes_count
+		self.window = window
+		self.windows = 0	# number of windows with any event
+		self.counters = {f: np.zeros((capacity, nodes_count), dtype=t) for f, t in METRIC_TYPES.items()}
+
+	def _window(self, time):
+		w = int(time // self.window)
+		if w >= self.windows:
+			capacity = len(self.counters['tx_airtime'])
+			if w >= capacity:
+				size = max(2 * capacity, w + 1)
+				for f, c in self.counters.items():
+					grown = np.zeros((size, self.nodes_count), dtype=c.dtype)
+					grown[:capacity] = c
+					self.counters[f] = grown
+			self.windows = w + 1
+		return w
+
+	def airtime(self, field, node, start, end):
+		"""Adds the [start, end) interval of 'tx_airtime' or 'rx_airtime' of the node, split between the windows it spans"""
+		while start < end:
+			w = self._window(start)
+			counter = self.counters[field]
+			window_end = min(end, (w + 1) * self.window)
+			counter[w, node] += window_end - start
+			start = window_end
+
+	def count(self, field, node, time, value = 1):
+		w = self._window(time)	# before looking the array up, _window() may replace it with a bigger one
+		self.counters[field][w, node] += value
+
+	def queue(self, node, time, length):
+		w = self._window(time)
+		if length > self.counters['queue_max'][w, node]:
+			self.counters['queue_max'][w, node] = length
+		self.counters['queue_sum'][w, node] += length
+		self.counters['queue_samples'][w, node] += 1
+
+	def series(self, field):
+		"""windows x nodes array of the counter"""
+		return self.counters[field][:self.windows]
+
+	def window_lengths(self, end_time):
+		"""Length of every window in µs, the last one ends at end_time"""
+		lengths = np.full(self.windows, self.window, dtype=np.int64)
+		if self.windows > 0:
+			lengths[-1] = max(1, min(self.window, end_time - (self.windows - 1) * self.window))
+		return lengths
+
+	def utilization(self, end_time):
+		"""windows x nodes arrays of (tx_util, air_util) of every window"""
+		lengths = self.window_lengths(end_time)[:, None]
+		tx = self.series('tx_airtime')
+		return tx / lengths, (tx + self.series('rx_airtime')) / lengths
+
+	def mean_queue(self):
+		samples = self.series('queue_samples')
+		with np.errstate(divide='ignore', invalid='ignore'):
+			return np.where(samples > 0, self.series('queue_sum') / samples, 0)
+
+	def snapshot(self, time):
+		"""(time, counters of the window containing time), summary() subtracts them to cover only the part of the window after time"""
+		w = int(time // self.window)
+		return time, {f: c[w].copy() if w < self.windows else np.zeros(self.nodes_count, dtype=c.dtype) for f, c in self.counters.items()}
+
+	def summary(self, end_time, start = None):
+		"""
+		Peak values over the windows, complementing the totals of MeshSim.summary_metrics()
+		:param start: snapshot() taken at the start of the summarized interval, None - from the start of the simulation;
+			queue_max of the window containing the start may include the time before it
+		"""
+		first = 0 if start is None else int(start[0] // self.window)
+		if self.windows <= first:
+			return {'air_util_peak': 0, 'channel_util_peak': 0, 'collisions_peak': 0, 'queue_max': 0}
+		lengths = self.window_lengths(end_time)[first:, None]
+		series = {f: self.series(f)[first:].copy() for f in ('tx_airtime', 'rx_airtime', 'collisions')}
+		if start is not None:
+			start_time, counters = start
+			lengths[0] = max(1, lengths[0, 0] - (start_time - first * self.window))
+			for f, c in series.items():
+				c[0] -= counters[f]
+		air_util = (series['tx_airtime'] + series['rx_airtime']) / lengths
+		return {
+			'air_util_peak': float(air_util.max()),
+			'channel_util_peak': float(air_util.mean(axis=1).max()),
+			'collisions_peak': int(series['collisions'].sum(axis=1).max()),
+			'queue_max': int(self.series('queue_max')[first:].max()),
+		}
+
+	def write_csv(self, file_path, node_ids, end_time):
+		"""One row per window and node: window start time, node_id, counters, utilization and mean queue length"""
+		tx_util, air_util = self.utilization(end_time)
+		mean_queue = self.mean_queue()
+		fields = list(METRIC_TYPES.keys())
+		with open(file_path, 'w', newline='') as f:
+			writer = csv.writer(f)
+			writer.writerow(['time', 'node_id'] + fields + ['tx_util', 'air_util', 'queue_mean'])
+			for w in range(self.windows):
+				for i, node_id in enumerate(node_ids):
+					writer.writerow([w * self.window, f"{node_id:08x}"] + [int(self.counters[f][w, i]) for f in fields] +
+						[f"{tx_util[w, i]:.4f}", f"{air_util[w, i]:.4f}", f"{mean_queue[w, i]:.2f}"])
@@ -0,0 +1,194 @@
+import heapq
+import numpy as np
+from kssmlib.BasicMeshNode import NodeState
+
+"""
+Struct-of-arrays node engine (--engine=vector)
+
+The tick engine calls time_advance() of every node every step, although most nodes have nothing to do
+but count their backoff or transmission down. MeshNodeArrays keeps the part of the node state that decides
+whether a step does anything in NumPy arrays (state, countdowns, time of the next message generation,
+queue and buffer flags) and every step:
+- selects the nodes that need their Python step: a message is due, the queue is not empty, the backoff or
+  the transmission ends in this step, a reception is in progress (tick reception model), the state changed,
+- counts the backoffs and transmissions of all the other nodes down as array operations,
+- calls time_advance() of the selected nodes only, in the order of the tick engine.
+
+The skipped nodes are brought up to date (current_time, countdowns, utilization) only when they are
+used: when another node informs them or starts/ends a reception on them, and at the end of the run.
+A node is then synchronized to its last step, the one of this tick if the tick engine would have stepped
+it already, otherwise the one of the previous tick. The results are identical to the tick engine.
+"""
+
+IDLE = NodeState.IDLE.value
+RX_BUSY = NodeState.RX_BUSY.value
+WAITING_TO_TX = NodeState.WAITING_TO_TX.value
+TX_BUSY = NodeState.TX_BUSY.value
+
+# node methods called by the transmitting node on the receivers, the receiver is synchronized before the call
+RECEIVER_METHODS = ['inform', 'begin_reception', 'end_reception']
+
+class MeshNodeArrays:
+	"""Node state arrays of the vector engine, indexed by the node index"""
+	def __init__(self, nodes, reception_model, current_time = 0):
+		self.nodes = nodes
+		self.interval = reception_model == 'interval'
+		self.time = current_time
+		self.step_interval = 0
+		self.position = len(nodes)	# index of the node being stepped, len(nodes) between the ticks
+		count = len(nodes)
+		self.state = np.zeros(count, dtype=np.int8)
+		self.changed = np.zeros(count, dtype=bool)	# state_changed, the change has to be logged by the node's step
+		self.buffered = np.zeros(count, dtype=bool)	# msg_tx_buffer is not None
+		self.queued = np.zeros(count, dtype=bool)	# message queue is not empty
+		self.next_due = np.zeros(count)		# next_generation_time(), inf - never
+		self.backoff = np.zeros(count)		# backoff_time, counted down here for the skipped nodes
+		self.backoff_float = np.zeros(count, dtype=bool)	# backoff_time is a float, not an int
+		self.tx = np.zeros(count)			# tx_time
+		self.tx_float = np.zeros(count, dtype=bool)
+		self.backoff_prev = np.zeros(count)	# countdowns before the current tick
+		self.tx_prev = np.zeros(count)
+		self.synced = np.full(count, current_time, dtype=np.int64)	# time of the step the node object is up to date with
+		self.scheduled = np.zeros(count, dtype=bool)	# stepped in Python in the current tick
+		self.pending = []	# heap of the indexes still to be stepped in the current tick
+		for i in range(count):
+			self.refresh(i)
+			self.wrap(i)
+		self.skipped_steps = 0
+		self.python_steps = 0
+
+	def wrap(self, i):
+		"""Replaces the receiver methods of node i by wrappers synchronizing the node before and refreshing its arrays after the call"""
+		node = self.nodes[i]
+		touch = self.touch
+		refresh = self.refresh
+		for name in RECEIVER_METHODS:
+			method = getattr(node, name)
+			def synchronized(*args, method = method, **kwargs):
+				touch(i)
+				result = method(*args, **kwargs)
+				refresh(i)
+				return result
+			setattr(node, name, synchronized)
+
+	def refresh(self, i):
+		"""Copies the state of node i to the arrays"""
+		node = self.nodes[i]
+		state = node.state._value_
+		self.state[i] = state
+		self.changed[i] = node.state_changed
+		if node.state_changed or not self.interval and (state == RX_BUSY or state == TX_BUSY):
+			return	# stepped in the next tick anyway, the rest is refreshed after that step
+		self.buffered[i] = node.msg_tx_buffer is not None
+		self.queued[i] = len(node.message_queue.queue) > 0
+		due = node.next_generation_time()
+		self.next_due[i] = np.inf if due is None else due
+		self.backoff[i] = node.backoff_time
+		self.backoff_float[i] = isinstance(node.backoff_time, float)
+		self.tx[i] = node.tx_time
+		self.tx_float[i] = isinstance(node.tx_time, float)
+
+	def sync(self, i, time):
+		"""Brings node i, skipped since its last Python step, to its state after the step at time"""
+		if self.synced[i] >= time:
+			return
+		node = self.nodes[i]
+		if time == self.time:
+			backoff, tx = self.backoff[i], self.tx[i]
+		else:
+			backoff, tx = self.backoff_prev[i], self.tx_prev[i]
+		node.current_time = time
+		node.backoff_time = float(backoff) if self.backoff_float[i] else int(backoff)
+		node.tx_time = float(tx) if self.tx_float[i] else int(tx)
+		node.tx_util = node.tx_time_sum / time
+		node.air_util = (node.rx_time_sum + node.tx_time_sum) / time
+		self.synced[i] = time
+
+	def touch(self, i):
+		"""Node i is about to be used by the node being stepped, it gets its own Python step if it has not had it yet in this tick"""
+		if i > self.position:
+			self.sync(i, self.time - self.step_interval)
+			if not self.scheduled[i]:
+				self.scheduled[i] = True
+				heapq.heappush(self.pending, i)
+				self.python_steps += 1
+				self.skipped_steps -= 1
+		else:
+			self.sync(i, self.time)
+
+	def skippable(self, time, step_interval):
+		"""Mask of the nodes whose step at time would only count down and update the utilization"""
+		state = self.state
+		idle = (state == IDLE) & ~self.buffered & ~self.queued
+		waiting = (state == WAITING_TO_TX) & self.buffered & (self.backoff - step_interval > 0)
+		skip = idle | waiting
+		if self.interval:	# the tick reception model informs the receivers and checks the RX timeouts every step
+			skip |= (state == TX_BUSY) & (self.tx - step_interval > 0)
+			skip |= state == RX_BUSY
+		return skip & ~self.changed & (self.next_due > time)
+
+	def idle_steps(self, step_interval):
+		"""Adaptive stepping: number of steps of step_interval the next step may span, see BasicMeshNode.idle_steps(); None - no timer"""
+		if self.changed.any():
+			return 1
+		state = self.state
+		steps = np.full(len(self.nodes), np.inf)
+		idle = state == IDLE
+		steps[idle & (self.buffered | self.queued)] = 1
+		waiting = state == WAITING_TO_TX
+		steps[waiting & ~self.buffered] = 1
+		counting = waiting & self.buffered
+		steps[counting] = np.ceil(self.backoff[counting] / step_interval)
+		if self.interval:
+			tx = state == TX_BUSY
+			steps[tx] = np.ceil(self.tx[tx] / step_interval)
+		else:
+			steps[(state == TX_BUSY) | (state == RX_BUSY)] = 1
+		np.minimum(steps, np.ceil((self.next_due - self.time) / step_interval), out=steps)
+		result = steps.min() if len(steps) else np.inf
+		return None if result == np.inf else max(int(result), 1)
+
+	def step(self, step_interval):
+		"""
+		One tick of all the nodes
+		:return: True if the state of any node changed (state_was_changed() of the tick engine)
+		"""
+		self.step_interval = step_interval
+		self.time += step_interval
+		skip = self.skippable(self.time, step_interval)
+		np.copyto(self.backoff_prev, self.backoff)
+		np.copyto(self.tx_prev, self.tx)
+		np.subtract(self.backoff, step_interval, out=self.backoff, where=skip & (self.state == WAITING_TO_TX))
+		if self.interval:
+			np.subtract(self.tx, step_interval, out=self.tx, where=skip & (self.state == TX_BUSY))
+		np.logical_not(skip, out=self.scheduled)
+		self.pending = np.flatnonzero(self.scheduled).tolist()	# sorted, a valid heap
+		self.python_steps += len(self.pending)
+		self.skipped_steps += len(self.nodes) - len(self.pending)
+
+		changed = False
+		previous = self.time - step_interval
+		pending = self.pending
+		nodes = self.nodes
+		while pending:
+			i = heapq.heappop(pending)
+			self.position = i
+			node = nodes[i]
+			self.sync(i, previous)
+			self.synced[i] = self.time
+			node.time_advance(step_interval)
+			if node.state_was_changed():
+				changed = True
+			self.refresh(i)
+		self.position = len(nodes)
+		return changed
+
+	def refresh_all(self):
+		"""Copies the state of all the nodes to the arrays, after their parameters were changed outside of a step"""
+		for i in range(len(self.nodes)):
+			self.refresh(i)
+
+	def sync_all(self):
+		"""Brings all the nodes up to date, e.g. at the end of the run, before their statistics are read"""
+		for i in np.flatnonzero(self.synced < self.time):
+			self.sync(int(i), self.time)
@@ -0,0 +1,270 @@
+import heapq
+from kssmlib.BasicMeshNode import NodeState
+from kssmlib.MeshNodeArrays import RECEIVER_METHODS
+
+"""
+Activity-driven node scheduler (--engine=wheel)
+
+The vector engine still looks at every node in every tick, although in NumPy. The scheduler keeps only
+the nodes that have something to do:
+- the active set - nodes stepped in every tick: the state changed, the queue is not empty, a transmission
+  or reception is in progress in the tick reception model (the receivers are informed every tick),
+- a hierarchical timing wheel with the tick of the next step of every other node (BasicMeshNode.idle_steps()):
+  message generation, end of the backoff, end of a transmission in the interval reception model,
+  RX timeout in the tick reception model. Nodes without a timer are not in the wheel at all.
+In every tick only the active nodes and the ones whose tick came are stepped, in the order of the tick
+engine, so the cost of a tick grows with the number of active nodes, not with the size of the mesh.
+
+The skipped nodes are brought up to date (current_time, countdowns, utilization) only when they are used,
+like in the vector engine (see MeshNodeArrays.py). The results are identical to the tick engine.
+"""
+
+IDLE = NodeState.IDLE
+WAITING_TO_TX = NodeState.WAITING_TO_TX
+TX_BUSY = NodeState.TX_BUSY
+RX_BUSY = NodeState.RX_BUSY
+
+class MeshTimingWheel:
+	"""
+	Hierarchical timing wheel of (tick, item) entries: LEVELS wheels of 2**SLOT_BITS slots, a slot of level L
+	spans 2**(SLOT_BITS*L) ticks. An entry is added to the lowest level able to hold it and moved one level down
+	every time the lower wheel turns around, entries further than all the levels wait in the overflow list.
+	Adding and taking an entry cost O(1) regardless of the number of entries. The occupied slots of every level
+	are kept as a bitmap, so advance() jumps straight to the next occupied slot or cascade of an occupied slot,
+	a long adaptive step over empty slots costs a few operations, not one per tick.
+	"""
+	SLOT_BITS = 8
+	LEVELS = 4
+	SLOTS = 1 << SLOT_BITS
+	MASK = SLOTS - 1
+	FULL = (1 << SLOTS) - 1
+
+	def __init__(self, tick = 0):
+		self.tick = tick
+		self.wheels = [[[] for _ in range(self.SLOTS)] for _ in range(self.LEVELS)]
+		self.occupied = [0] * self.LEVELS	# bitmap of the non-empty slots of every level
+		self.overflow = []
+
+	def add(self, tick, item):
+		"""Adds an entry due at tick, after the current tick (an earlier one is returned at the next turn of the lowest wheel)"""
+		delta = tick - self.tick
+		for level in range(self.LEVELS):
+			shift = self.SLOT_BITS * level
+			if delta < 1 << (shift + self.SLOT_BITS):
+				index = (tick >> shift) & self.MASK
+				self.wheels[level][index].append((tick, item))
+				self.occupied[level] |= 1 << index
+				return
+		self.overflow.append((tick, item))
+
+	def take(self, level, index):
+		"""Removes and returns the entries of a slot"""
+		entries = self.wheels[level][index]
+		if entries:
+			self.wheels[level][index] = []
+			self.occupied[level] &= ~(1 << index)
+		return entries
+
+	def occupied_slots(self, level, current):
+		"""Bitmap of the occupied slots of the level rotated so that bit k - 1 is the k-th slot after the slot current (k = 1 - SLOTS)"""
+		occupied = self.occupied[level]
+		return ((occupied >> (current + 1)) | (occupied << (self.SLOTS - current - 1))) & self.FULL
+
+	def next_stop(self):
+		"""First tick after the current one at which a slot of the lowest level is due or a cascade moves entries, None if the wheel is empty"""
+		stops = []
+		for level in range(self.LEVELS):
+			shift = self.SLOT_BITS * level
+			current = self.tick >> shift
+			occupied = self.occupied_slots(level, current & self.MASK)
+			if occupied:
+				stops.append((current + (occupied & -occupied).bit_length()) << shift)
+		if self.overflow:
+			shift = self.SLOT_BITS * self.LEVELS
+			stops.append(((self.tick >> shift) + 1) << shift)
+		return min(stops) if stops else None
+
+	def advance(self, tick):
+		"""Turns the wheel to tick, returns the entries due at the ticks passed"""
+		due = []
+		while self.tick < tick:
+			stop = self.next_stop() if tick - self.tick > 1 else None	# no entry is due and no cascade moves one before it
+			self.tick = tick if stop is None else min(tick, stop)
+			if self.tick & self.MASK == 0:
+				self.cascade()
+			due += self.take(0, self.tick & self.MASK)
+		return due
+
+	def cascade(self):
+		"""The lowest wheel turned around, the entries of the next slots of the higher levels move down"""
+		for level in range(1, self.LEVELS):
+			shift = self.SLOT_BITS * level
+			index = (self.tick >> shift) & self.MASK
+			for tick, item in self.take(level, index):
+				self.add(tick, item)
+			if index != 0:
+				return
+		entries, self.overflow = self.overflow, []
+		for tick, item in entries:
+			self.add(tick, item)
+
+	def next_tick(self, valid):
+		"""Tick of the earliest entry for which valid(tick, item) is True, None if there is none"""
+		ticks = []
+		for level in range(self.LEVELS):
+			shift = self.SLOT_BITS * level
+			wheel = self.wheels[level]
+			current = self.tick >> shift
+			occupied = self.occupied_slots(level, current & self.MASK)
+			while occupied:	# the occupied slots of a level in the order of time
+				lowest = occupied & -occupied
+				occupied ^= lowest
+				entries = [tick for tick, item in wheel[(current + lowest.bit_length()) & self.MASK] if valid(tick, item)]
+				if entries:
+					ticks.append(min(entries))
+					break
+		ticks += [tick for tick, item in self.overflow if valid(tick, item)]
+		return min(ticks) if ticks else None
+
+class MeshNodeScheduler:
+	"""Active set and timing wheel of the wheel engine, indexed by the node index"""
+	def __init__(self, nodes, reception_model, current_time = 0, resolution = 1000):
+		self.nodes = nodes
+		self.interval = reception_model == 'interval'
+		self.time = current_time
+		self.step_interval = 0
+		self.position = len(nodes)	# index of the node being stepped, len(nodes) between the ticks
+		self.synced = [current_time] * len(nodes)	# time of the step the node object is up to date with
+		self.pending = []	# heap of the indexes still to be stepped in the current tick
+		self.scheduled = set()	# stepped in the current tick
+		self.skipped_steps = 0
+		self.python_steps = 0
+		self.set_resolution(resolution)
+		for i in range(len(nodes)):
+			self.wrap(i)
+
+	def set_resolution(self, resolution):
+		"""Tick of the wheel in µs, the time_resolution of run(); the schedule is rebuilt if it changes"""
+		if getattr(self, 'resolution', None) == resolution:
+			return
+		self.sync_all()
+		self.resolution = resolution
+		self.wheel = MeshTimingWheel(self.time // resolution)
+		self.wake = [None] * len(self.nodes)	# time of the next step of the nodes in the wheel
+		self.active = set()
+		for i in range(len(self.nodes)):
+			self.refresh(i)
+
+	def wrap(self, i):
+		"""Replaces the receiver methods of node i by wrappers synchronizing the node before and rescheduling it after the call"""
+		node = self.nodes[i]
+		touch = self.touch
+		refresh = self.refresh
+		for name in RECEIVER_METHODS:
+			method = getattr(node, name)
+			def synchronized(*args, method = method, **kwargs):
+				touch(i)
+				result = method(*args, **kwargs)
+				refresh(i)
+				return result
+			setattr(node, name, synchronized)
+
+	def refresh(self, i):
+		"""Puts node i to the active set or to the wheel at the tick of its next timer"""
+		node = self.nodes[i]
+		if node.state == RX_BUSY and not self.interval and not node.state_changed and (self.wake[i] is not None or i in self.active):
+			return	# informed during a reception, the RX timeout only moves later; a step earlier than needed is harmless
+		steps = node.idle_steps(self.resolution)
+		if steps == 1:
+			self.active.add(i)
+			self.wake[i] = None
+			return
+		self.active.discard(i)
+		if steps is None:
+			self.wake[i] = None
+			return
+		wake = self.synced[i] + steps * self.resolution
+		if wake != self.wake[i]:
+			self.wake[i] = wake
+			self.wheel.add(wake // self.resolution, i)
+
+	def sync(self, i, time):
+		"""Brings node i, skipped since its last step, to its state after the step at time"""
+		elapsed = time - self.synced[i]
+		if elapsed <= 0:
+			return
+		node = self.nodes[i]
+		if node.state == WAITING_TO_TX and node.msg_tx_buffer is not None:
+			node.backoff_time -= elapsed
+		elif node.state == TX_BUSY:	# interval reception model, in the tick one a transmitting node is active
+			node.tx_time -= elapsed
+		node.current_time = time
+		node.tx_util = node.tx_time_sum / time
+		node.air_util = (node.rx_time_sum + node.tx_time_sum) / time
+		self.synced[i] = time
+
+	def touch(self, i):
+		"""Node i is about to be used by the node being stepped, it gets its own step if it has not had it yet in this tick"""
+		if i > self.position:
+			self.sync(i, self.time - self.step_interval)
+			if i not in self.scheduled:
+				self.scheduled.add(i)
+				heapq.heappush(self.pending, i)
+				self.python_steps += 1
+				self.skipped_steps -= 1
+		else:
+			self.sync(i, self.time)
+
+	def idle_steps(self, step_interval):
+		"""Adaptive stepping: number of steps of step_interval the next step may span, see BasicMeshNode.idle_steps(); None - no timer"""
+		if self.active:
+			return 1
+		resolution = self.resolution
+		tick = self.wheel.next_tick(lambda tick, i: self.wake[i] == tick * resolution)
+		if tick is None:
+			return None
+		return max((tick * resolution - self.time) // step_interval, 1)
+
+	def step(self, step_interval):
+		"""
+		One tick of the active nodes and of the nodes whose timer is due
+		:return: True if the state of any node changed (state_was_changed() of the tick engine)
+		"""
+		self.step_interval = step_interval
+		self.time += step_interval
+		wake = self.wake
+		due = [i for tick, i in self.wheel.advance(self.time // self.resolution) if wake[i] == tick * self.resolution]
+		for i in due:
+			wake[i] = None
+		self.scheduled = self.active.union(due)
+		pending = self.pending = sorted(self.scheduled)	# a valid heap
+		self.python_steps += len(pending)
+		self.skipped_steps += len(self.nodes) - len(pending)
+
+		changed = False
+		previous = self.time - step_interval
+		nodes = self.nodes
+		while pending:
+			i = heapq.heappop(pending)
+			self.position = i
+			node = nodes[i]
+			self.sync(i, previous)
+			self.synced[i] = self.time
+			node.time_advance(step_interval)
+			if node.state_was_changed():
+				changed = True
+			self.refresh(i)
+		self.position = len(nodes)
+		return changed
+
+	def refresh_all(self):
+		"""Reschedules all the nodes, after their parameters were changed outside of a step; their old wheel entries become stale"""
+		self.active = set()
+		for i in range(len(self.nodes)):
+			self.wake[i] = None
+			self.refresh(i)
+
+	def sync_all(self):
+		"""Brings all the nodes up to date, e.g. at the end of the run, before their statistics are read"""
+		for i in range(len(self.nodes)):
+			self.sync(i, self.time)
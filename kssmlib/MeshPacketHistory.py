@@ -0,0 +1,80 @@
+from collections import OrderedDict
+
+"""
+Bounded packet history of a node
+
+Like the PacketHistory of the Meshtastic firmware, a node remembers the recently heard message IDs
+for the duplicate detection only for a limited time (expire) and up to a fixed number of messages
+(capacity); the least recently heard message is forgotten first. The memory used by a node therefore
+does not grow with the length of the simulation. A message heard again after it was forgotten is
+handled as a new one, as it would be by the firmware.
+
+The number of messages heard for the first time (heard) and of the forgotten ones (evicted, expired)
+are kept as counters for the logs and the summary. A forgotten message heard again is not counted in
+heard when the caller knows it was heard before (see MeshDeliveryIndex.delivered()), forgotten_time
+tells whether it may have been: no message first heard after it was forgotten.
+"""
+
+class MeshPacketHistory:
+	"""message_id -> record of the first reception ({"count", "rssi", "snr", "sender_addr", "hops_away"}), in the order of the last reception"""
+	def __init__(self, capacity, expire):
+		"""
+		:param capacity: maximal number of remembered messages
+		:param expire: µs after the last reception of a message it is forgotten, 0 - never
+		"""
+		self.capacity = capacity
+		self.expire = expire
+		self.entries = OrderedDict()	# message_id -> [time of the last reception, record, time of the first reception]
+		self.heard = 0		# messages heard for the first time
+		self.evicted = 0	# messages forgotten because the history was full
+		self.expired = 0	# messages forgotten because they were not heard for expire µs
+		self.forgotten_time = -1	# latest time of the first reception of a forgotten message, -1 - nothing forgotten
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, message_id):
+		return message_id in self.entries
+
+	def get(self, message_id):
+		"""Record of the message, None if it is not remembered"""
+		entry = self.entries.get(message_id)
+		return None if entry is None else entry[1]
+
+	def remove_expired(self, time):
+		if self.expire > 0:
+			entries = self.entries
+			while entries:
+				entry = next(iter(entries.values()))
+				if entry[0] > time - self.expire:
+					break
+				self.forget()
+				self.expired += 1
+
+	def seen(self, message_id, time):
+		"""Record of a remembered message, which is marked as heard at time, None for a new message"""
+		self.remove_expired(time)
+		entry = self.entries.get(message_id)
+		if entry is None:
+			return None
+		entry[0] = time
+		self.entries.move_to_end(message_id)
+		return entry[1]
+
+	def forget(self):
+		"""Forgets the least recently heard message"""
+		entry = self.entries.popitem(last = False)[1]
+		self.forgotten_time = max(self.forgotten_time, entry[2])
+
+	def add(self, message_id, record, time, new = True):
+		"""
+		Remembers a message not remembered now
+		:param new: False - the message was heard before it was forgotten, it is not counted in heard again
+		"""
+		self.remove_expired(time)
+		self.entries[message_id] = [time, record, time]
+		if new:
+			self.heard += 1
+		if len(self.entries) > self.capacity:
+			self.forget()
+			self.evicted += 1
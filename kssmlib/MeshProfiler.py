@@ -0,0 +1,155 @@
+import cProfile
+import csv
+import functools
+import pstats
+import time
+
+"""
+Simulation instrumentation
+
+MeshPhaseTimers accumulates the wall time and the number of calls of named phases of the simulation.
+MeshSim always times the coarse phases (node steps, event handling, console output, plotting,
+log writes); with phase_timers it also wraps the per-node methods (message generation, informing
+the neighbors, receptions, logging calls), which costs a few hundred nanoseconds per call.
+Phase times are inclusive: 'inform_neighbors' contains the 'inform' calls it makes.
+
+profile_call() runs a function under cProfile and writes the statistics in the pstats format
+and as collapsed stacks ("a;b;c <µs>" lines) for flame graph tools (flamegraph.pl, speedscope).
+"""
+
+PROFILE_STATS_NAME = 'profile.pstats'
+PROFILE_COLLAPSED_NAME = 'profile.collapsed'
+
+class MeshPhaseTimers:
+	"""Wall time and number of calls of the simulation phases"""
+	def __init__(self):
+		self.phases = {}	# name -> [time in ns, calls]
+
+	def add(self, name, start):
+		"""Adds the time elapsed since start (a time.perf_counter_ns() value) to the phase"""
+		elapsed = time.perf_counter_ns() - start
+		phase = self.phases.get(name)
+		if phase is None:
+			self.phases[name] = [elapsed, 1]
+		else:
+			phase[0] += elapsed
+			phase[1] += 1
+
+	def wrap(self, obj, method_name, name = None):
+		"""Times every call of obj.method_name (the wrapper is set as an attribute of obj, other instances are not affected)"""
+		method = getattr(obj, method_name)
+		name = method_name if name is None else name
+		add = self.add
+		clock = time.perf_counter_ns
+		@functools.wraps(method)
+		def timed(*args, **kwargs):
+			start = clock()
+			try:
+				return method(*args, **kwargs)
+			finally:
+				add(name, start)
+		setattr(obj, method_name, timed)
+
+	def rows(self, total = None):
+		"""
+		Phases sorted by time: phase, calls, time [s], mean time per call [µs] and share of total
+		:param total: phase the shares are relative to (e.g. 'run'), None - no shares
+		"""
+		total_ns = self.phases[total][0] if total in self.phases else 0
+		rows = []
+		for name, (ns, calls) in sorted(self.phases.items(), key = lambda p: -p[1][0]):
+			rows.append({
+				'phase': name,
+				'calls': calls,
+				'time': round(ns / 1e9, 6),
+				'mean_us': round(ns / calls / 1000, 3),
+				'share': round(ns / total_ns, 4) if total_ns > 0 else None,
+			})
+		return rows
+
+def cache_rows(caches):
+	"""Rows of the cache table from name -> (hits, misses, entries)"""
+	rows = []
+	for name, (hits, misses, entries) in caches.items():
+		lookups = hits + misses
+		rows.append({'cache': name, 'hits': hits, 'misses': misses, 'hit_ratio': round(hits / lookups, 4) if lookups > 0 else None, 'entries': entries})
+	return rows
+
+def function_cache_stats(functions):
+	"""name -> (hits, misses, entries) of functools.cache decorated functions"""
+	stats = {}
+	for name, f in functions.items():
+		info = f.cache_info()
+		stats[name] = (info.hits, info.misses, info.currsize)
+	return stats
+
+def write_rows(file_path, rows):
+	if not rows:
+		return
+	with open(file_path, 'w', newline='') as f:
+		writer = csv.DictWriter(f, fieldnames = list(rows[0].keys()))
+		writer.writeheader()
+		writer.writerows(rows)
+
+def profile_call(function, pstats_path, collapsed_path = None):
+	"""Calls function() under cProfile, writes the statistics and returns the function's result"""
+	profiler = cProfile.Profile()
+	profiler.enable()
+	try:
+		return function()
+	finally:
+		profiler.disable()
+		profiler.dump_stats(pstats_path)
+		if collapsed_path is not None:
+			write_collapsed(pstats.Stats(profiler), collapsed_path)
+
+def top_functions(pstats_path, limit = 25):
+	"""Rows of the functions with the longest own time: function, calls, own and cumulative time [s]"""
+	stats = pstats.Stats(pstats_path).stats
+	rows = []
+	for func, (_, calls, total_time, cumulative_time, _) in sorted(stats.items(), key = lambda s: -s[1][2])[:limit]:
+		rows.append({'function': _function_name(func), 'calls': calls, 'own_time': round(total_time, 6), 'cumulative_time': round(cumulative_time, 6)})
+	return rows
+
+def _function_name(func):
+	file_name, line, name = func
+	if file_name == '~':
+		return name	# built-in
+	return f"{name} ({file_name.rsplit('/', 1)[-1]}:{line})"
+
+def write_collapsed(stats, file_path, min_time = 1e-5):
+	"""
+	Collapsed stacks from the cProfile call graph. cProfile does not record whole stacks, only the
+	caller -> callee edges with their times, so the time of every edge is split between the callee's
+	callees in proportion to their cumulative times (the approach of flameprof). Recursive calls are cut.
+
+	:param min_time: paths shorter than this (in seconds) are skipped
+	"""
+	entries = stats.stats	# func -> (primitive calls, calls, total time, cumulative time, callers)
+	callees = {}
+	for func, (_, _, _, _, callers) in entries.items():
+		for caller, edge in callers.items():
+			callees.setdefault(caller, []).append((func, edge[3]))
+	lines = {}
+
+	def walk(func, stack, cumulative, path):
+		_, _, total_time, cumulative_time, _ = entries[func]
+		scale = cumulative / cumulative_time if cumulative_time > 0 else 0
+		stack = stack + [_function_name(func)]
+		key = ';'.join(stack)
+		lines[key] = lines.get(key, 0) + total_time * scale
+		for callee, edge_time in callees.get(func, []):
+			if callee in path or edge_time * scale < min_time:
+				continue
+			path.add(callee)
+			walk(callee, stack, edge_time * scale, path)
+			path.discard(callee)
+
+	roots = [func for func, entry in entries.items() if not entry[4]]
+	for root in roots:
+		walk(root, [], entries[root][3], {root})
+	with open(file_path, 'w') as f:
+		for key, seconds in lines.items():
+			us = int(round(seconds * 1000000))
+			if us > 0:
+				f.write(f"{key} {us}\n")
@@ -0,0 +1,74 @@
+import sys
+import time
+
+def format_duration(seconds):
+	seconds = int(round(seconds))
+	return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+class MeshProgress:
+	"""
+	Progress of a running simulation: simulated time, simulated to wall time ratio, logged events
+	per second and the estimated time to the end, printed every interval seconds of wall time.
+	Every report_interval seconds MeshSim.make_progress_html() rewrites index.html from the online
+	statistics. update() is called after every tick or event, it only reads the clock between reports.
+	"""
+	def __init__(self, sim, start_time, end_time, interval = 10, report_interval = 0, stream = sys.stderr):
+		"""
+		:param start_time, end_time: simulated time range of the run in µs
+		:param interval: wall seconds between the progress lines, 0 - no progress lines
+		:param report_interval: wall seconds between the rewrites of the partial index.html, 0 - no partial report
+		"""
+		self.sim = sim
+		self.start_time = start_time
+		self.end_time = end_time
+		self.interval = interval
+		self.report_interval = report_interval
+		self.stream = stream
+		self.wall_start = time.monotonic()
+		self.next_line = self.wall_start + interval if interval > 0 else None
+		self.next_report = self.wall_start + report_interval if report_interval > 0 else None
+		self.events_start = self.events()
+		self.calls = 0
+
+	def events(self):
+		"""Number of log records (messages, node state changes, backoffs) written so far"""
+		return sum(t.rows_written + t.size for t in self.sim.logger.tables)
+
+	def status(self):
+		"""Dict of the current progress values"""
+		wall = time.monotonic() - self.wall_start
+		simulated = self.sim.current_time - self.start_time
+		total = self.end_time - self.start_time
+		ratio = simulated / 1000000 / wall if wall > 0 else 0
+		remaining = (total - simulated) / 1000000 / ratio if ratio > 0 else None
+		return {
+			'simulated_time': self.sim.current_time / 1000000,
+			'end_time': self.end_time / 1000000,
+			'done': simulated / total if total > 0 else 1,
+			'wall_time': wall,
+			'sim_to_wall': ratio,
+			'events_per_s': (self.events() - self.events_start) / wall if wall > 0 else 0,
+			'eta': remaining,
+		}
+
+	def line(self, status):
+		eta = format_duration(status['eta']) if status['eta'] is not None else '?'
+		return (f"progress: {status['simulated_time']:.3f} s / {status['end_time']:.3f} s ({status['done']*100:.1f}%), "
+			f"{status['sim_to_wall']:.3f}x real time, {status['events_per_s']:.0f} events/s, "
+			f"elapsed {format_duration(status['wall_time'])}, ETA {eta}")
+
+	def update(self):
+		self.calls += 1
+		if self.calls & 63:	# the clock is read every 64 ticks or events
+			return
+		now = time.monotonic()
+		if self.next_line is not None and now >= self.next_line:
+			print(self.line(self.status()), file = self.stream, flush = True)
+			self.next_line = now + self.interval
+		if self.next_report is not None and now >= self.next_report:
+			self.sim.make_progress_html(self.status())
+			self.next_report = time.monotonic() + self.report_interval
+
+	def finish(self):
+		if self.interval > 0:
+			print(self.line(self.status()), file = self.stream, flush = True)
@@ -1,4 +1,6 @@
 import math
+import numpy as np
+from kssmlib import MeshConfig
 
 class MeshPropagation:
 	"""
@@ -12,11 +14,24 @@ class MeshPropagation:
 		self.model = model
 		self._path_loss_cache = {}
 		self._distance_cache = {}
+		self.distance_cache_hits = 0
+		self.distance_cache_misses = 0
+		self.path_loss_cache_hits = 0
+		self.path_loss_cache_misses = 0
+
+	def cache_stats(self):
+		"""name -> (hits, misses, entries) of the distance and path loss caches"""
+		return {
+			'distance': (self.distance_cache_hits, self.distance_cache_misses, len(self._distance_cache)),
+			'path_loss': (self.path_loss_cache_hits, self.path_loss_cache_misses, len(self._path_loss_cache)),
+		}
 
 	def calculate_distance(self, node_tx, node_rx):
-		cache_key = (node_tx.node_id, node_rx.node_id)
+		cache_key = (node_tx.node_id, node_rx.node_id, tuple(node_tx.position), tuple(node_rx.position))
 		if cache_key in self._distance_cache:
+			self.distance_cache_hits += 1
 			return self._distance_cache[cache_key]
+		self.distance_cache_misses += 1
 		pos_a = node_tx.position
 		pos_b = node_rx.position
 		distance = math.sqrt((pos_b[0] - pos_a[0])**2 + (pos_b[1] - pos_a[1])**2 + (pos_b[2] - pos_a[2])**2)
@@ -24,49 +39,51 @@ class MeshPropagation:
 		return distance
 
 	def calculate_path_loss(self, node_tx, node_rx):
-		cache_key = (node_tx.node_id, node_rx.node_id)
+		cache_key = (node_tx.node_id, node_rx.node_id, node_tx.frequency, tuple(node_tx.position), tuple(node_rx.position))
 		if cache_key in self._path_loss_cache:
+			self.path_loss_cache_hits += 1
 			return self._path_loss_cache[cache_key]
+		self.path_loss_cache_misses += 1
 		distance = self.calculate_distance(node_tx, node_rx)
 
 		if distance == 0:
 			return 0.0
 
-		path_loss = None
-		frequency = node_tx.frequency
-		
+		path_loss = float(self.path_loss(distance, node_tx.frequency, node_tx.position[2], node_rx.position[2]))
+		self._path_loss_cache[cache_key] = path_loss
+		return path_loss
+
+	def path_loss(self, distance, frequency, h_tx, h_rx):
 		"""
+		Path loss for the selected model. distance, h_tx and h_rx may be scalars or NumPy arrays
+		(broadcast against each other), frequency has to be a scalar.
+
 		The Okumura-Hata model is specifically designed for mobile devices and elevated base stations. 
 		The height of the transmitting antenna in the model has a greater impact than the height of 
 		the receiving antenna. In the context of a mesh network, such a comparison is not suitable, 
 		so the average attenuation in both directions is calculated.
 		"""
-		path_loss = -1
 		if self.model == 'OpenTerrain':
-			path_loss1 = self.model_okumura_hata_open(distance, frequency, node_tx.position[2], node_rx.position[2])
-			path_loss2 = self.model_okumura_hata_open(distance, frequency, node_rx.position[2], node_tx.position[2])
+			model = self.model_okumura_hata_open
 		elif self.model == 'Suburban':
-			path_loss1 = self.model_okumura_hata_suburban(distance, frequency, node_tx.position[2], node_rx.position[2])
-			path_loss2 = self.model_okumura_hata_suburban(distance, frequency, node_rx.position[2], node_tx.position[2])
+			model = self.model_okumura_hata_suburban
 		elif self.model == 'City':
-			path_loss1 = self.model_okumura_hata_large_city(distance, frequency, node_tx.position[2], node_rx.position[2])
-			path_loss2 = self.model_okumura_hata_large_city(distance, frequency, node_rx.position[2], node_tx.position[2])
+			model = self.model_okumura_hata_large_city
 		else: #every other option is FSPL
-			path_loss = self.model_fspl(distance, frequency, node_tx.position[2], node_rx.position[2])
-		if path_loss == -1:
-			path_loss = (path_loss1 + path_loss2) / 2.0
+			return self.model_fspl(distance, frequency, h_tx, h_rx)
+		return (model(distance, frequency, h_tx, h_rx) + model(distance, frequency, h_rx, h_tx)) / 2.0
 
-		if path_loss is not None:
-			self._path_loss_cache[cache_key] = path_loss
-		return path_loss
+	def build_link_table(self, nodes, dense = None, constants = MeshConfig):
+		return MeshLinkTable(self, nodes, dense, constants)
 
 	def model_fspl(self, d, f, h_tx, h_rx):
 		d_km = d / 1000.0
 		f_ghz = f / 1000000000.0
-		if d_km <= 0 or f_ghz <= 0:
-			return float('inf')
-		fspl_db = 32.44 + 20 * math.log10(d_km) + 20 * math.log10(f_ghz)
-		return fspl_db
+		if f_ghz <= 0:
+			return np.inf
+		with np.errstate(divide='ignore'):
+			fspl_db = 32.44 + 20 * np.log10(d_km) + 20 * np.log10(f_ghz)
+		return np.where(d_km <= 0, np.inf, fspl_db)
 
 	def model_okumura_hata_open(self, d, f, h_tx, h_rx):
 		"""
@@ -75,9 +92,9 @@ class MeshPropagation:
 		d_km = d / 1000.0
 		f_mhz = f / 1000000.0
 
-		c_h = (1.1 * math.log10(f_mhz) - 0.7) * h_rx - (1.56 * math.log10(f_mhz) - 0.8)
-		l_u = (69.55 + 26.16 * math.log10(f_mhz) - 13.82 * math.log10(h_tx) - c_h + (44.9 - 6.55 * math.log10(h_tx)) * math.log10(d_km))
-		l_open = l_u - 4.78 * (math.log10(f_mhz) ** 2) + 18.33 * math.log10(f_mhz) - 40.94
+		c_h = (1.1 * np.log10(f_mhz) - 0.7) * h_rx - (1.56 * np.log10(f_mhz) - 0.8)
+		l_u = (69.55 + 26.16 * np.log10(f_mhz) - 13.82 * np.log10(h_tx) - c_h + (44.9 - 6.55 * np.log10(h_tx)) * np.log10(d_km))
+		l_open = l_u - 4.78 * (np.log10(f_mhz) ** 2) + 18.33 * np.log10(f_mhz) - 40.94
 
 		return l_open
 
@@ -88,9 +105,9 @@ class MeshPropagation:
 		d_km = d / 1000.0
 		f_mhz = f / 1000000.0
 
-		c_h = (1.1 * math.log10(f_mhz) - 0.7) * h_rx - (1.56 * math.log10(f_mhz) - 0.8)
-		l_u = (69.55 + 26.16 * math.log10(f_mhz) - 13.82 * math.log10(h_tx) - c_h + (44.9 - 6.55 * math.log10(h_tx)) * math.log10(d_km))
-		l_suburban = l_u - 2 * ((math.log10(f_mhz / 28.0)) ** 2) - 5.4
+		c_h = (1.1 * np.log10(f_mhz) - 0.7) * h_rx - (1.56 * np.log10(f_mhz) - 0.8)
+		l_u = (69.55 + 26.16 * np.log10(f_mhz) - 13.82 * np.log10(h_tx) - c_h + (44.9 - 6.55 * np.log10(h_tx)) * np.log10(d_km))
+		l_suburban = l_u - 2 * ((np.log10(f_mhz / 28.0)) ** 2) - 5.4
 
 		return l_suburban
 
@@ -102,11 +119,80 @@ class MeshPropagation:
 		f_mhz = f / 1000000.0
 
 		if f_mhz <= 200:
-			c_h = 8.29 * (math.log10(1.54 * h_rx) ** 2) - 1.1
+			c_h = 8.29 * (np.log10(1.54 * h_rx) ** 2) - 1.1
 		elif f_mhz >= 400:
-			c_h = 3.2 * (math.log10(11.75 * h_rx) ** 2) - 4.97
+			c_h = 3.2 * (np.log10(11.75 * h_rx) ** 2) - 4.97
 		else:
 			raise ValueError("This model can't be used for 200 < f < 400 MHz.")
-		l_large_city = (69.55 + 26.16 * math.log10(f_mhz) - 13.82 * math.log10(h_tx) - c_h + (44.9 - 6.55 * math.log10(h_tx)) * math.log10(d_km))
+		l_large_city = (69.55 + 26.16 * np.log10(f_mhz) - 13.82 * np.log10(h_tx) - c_h + (44.9 - 6.55 * np.log10(h_tx)) * np.log10(d_km))
 
 		return l_large_city
+
+class MeshLinkTable:
+	"""
+	Link budget (distance, path loss, RSSI and SNR) for every pair of nodes, computed once per scenario.
+
+	For up to MeshConfig.LINK_TABLE_DENSE_MAX_NODES nodes the full N x N matrices are kept,
+	for larger meshes only the pairs that can hear each other (SNR above the receiver's
+	minimal_snr) are stored, row by row, so memory grows with the number of links, not N².
+	In both cases receivers[tx_index] lists (node, rssi, snr) of the nodes able to hear tx_index,
+	pairs that can never hear each other are not visited at all.
+	"""
+	def __init__(self, propagation_model, nodes, dense = None, constants = MeshConfig):
+		self.propagation_model = propagation_model
+		self.nodes = nodes
+		self.constants = constants
+		self.dense = len(nodes) <= constants.LINK_TABLE_DENSE_MAX_NODES if dense is None else dense
+		self.rebuild()
+
+	def rebuild(self):
+		"""Recalculates the table, required after a change of position, frequency, tx_power, noise level or LoRa mode"""
+		nodes = self.nodes
+		n = len(nodes)
+		self.positions = np.array([node.position for node in nodes], dtype=float).reshape(n, 3)
+		self.frequency = np.array([node.frequency for node in nodes], dtype=float)
+		self.tx_power = np.array([node.tx_power for node in nodes], dtype=float)
+		self.noise_level = np.array([node.noise_level for node in nodes], dtype=float)
+		self.minimal_snr = np.array([node.minimal_snr for node in nodes], dtype=float)
+
+		self.receivers = []
+		self._links = []
+		if self.dense:
+			self.distance, self.path_loss, self.rssi, self.snr, in_range = self._calculate_rows(np.arange(n))
+			for i in range(n):
+				self._add_receivers(i, np.nonzero(in_range[i])[0], self.rssi[i], self.snr[i])
+		else:
+			self.distance = self.path_loss = self.rssi = self.snr = None
+			block_rows = self.constants.LINK_TABLE_BLOCK_ROWS
+			for start in range(0, n, block_rows):
+				rows = np.arange(start, min(start + block_rows, n))
+				_, _, rssi, snr, in_range = self._calculate_rows(rows)
+				for k, i in enumerate(rows):
+					self._add_receivers(i, np.nonzero(in_range[k])[0], rssi[k], snr[k])
+
+	def _calculate_rows(self, rows):
+		delta = self.positions[rows, None, :] - self.positions[None, :, :]
+		distance = np.sqrt(np.sum(delta**2, axis=-1))
+		path_loss = np.empty_like(distance)
+		h_tx = self.positions[rows, 2][:, None]
+		h_rx = self.positions[None, :, 2]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			for f in np.unique(self.frequency[rows]):
+				mask = self.frequency[rows] == f
+				path_loss[mask] = self.propagation_model.path_loss(distance[mask], float(f), h_tx[mask], h_rx)
+		path_loss[distance == 0] = 0.0
+		rssi = self.tx_power[rows, None] - path_loss
+		snr = rssi - self.noise_level[None, :]
+		in_range = snr > self.minimal_snr[None, :]
+		in_range[np.arange(len(rows)), rows] = False
+		return distance, path_loss, rssi, snr, in_range
+
+	def _add_receivers(self, tx_index, rx_indexes, rssi_row, snr_row):
+		rssi = rssi_row[rx_indexes].tolist()
+		snr = snr_row[rx_indexes].tolist()
+		self.receivers.append([(self.nodes[j], rssi[k], snr[k]) for k, j in enumerate(rx_indexes.tolist())])
+		self._links.append({j: (rssi[k], snr[k]) for k, j in enumerate(rx_indexes.tolist())})
+
+	def link(self, tx_index, rx_index):
+		"""(rssi, snr) of the tx_index -> rx_index link, None if rx_index can't hear tx_index"""
+		return self._links[tx_index].get(rx_index)
@@ -0,0 +1,490 @@
+import collections
+import json
+import os
+import subprocess
+import multiprocessing as mp
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from kssmlib.MeshCheckpoint import resume_file
+from kssmlib.BasicMeshNode import NodeState, STATE_COLORS, node_description, theoretical_range
+
+"""
+Rendering of the network state plots
+
+A frame is described by a MeshFrame - a compact snapshot of what changes between frames:
+one fixed-width record per node (state, message being sent, counters shown in the label)
+and one record per reception in progress (transmitter, receiver, SNR). Everything that
+stays the same for the whole run (node names, positions, tx power, plot bounds and settings)
+is kept in a MeshPlotLayout, which is sent to the rendering processes only once, when
+MeshFramePool starts them. Every rendering process draws its frames on one persistent
+MeshPlotRenderer figure.
+
+Frames can also be recorded to frames.bin (MeshFrameRecorder) and rendered later, with
+different plot settings, by render_recording().
+"""
+
+FRAMES_FILE_NAME = 'frames.bin'
+FRAMES_INDEX_NAME = 'frames.json'
+
+FRAME_HEADER_DTYPE = np.dtype([('time', '<i8'), ('links', '<u4')])
+FRAME_NODE_DTYPE = np.dtype([('state', 'u1'), ('tx_message', '<i8'), ('queue', '<i4'), ('known_nodes', '<i4'), ('rx_success', '<i4'),
+	('rx_fail', '<i4'), ('rx_dups', '<i4'), ('tx_done', '<i4'), ('tx_cancelled', '<i4'), ('forwarded', '<i4'), ('collisions_caused', '<i4')])
+FRAME_LINK_DTYPE = np.dtype([('tx', '<u4'), ('rx', '<u4'), ('snr', '<f4')])
+
+def node_info(node):
+	"""Static data of the node needed to plot it"""
+	return {'node_id': node.node_id, 'long_name': node.long_name, 'position': list(node.position), 'tx_power': node.tx_power, 'frequency': node.frequency}
+
+def plot_settings(config):
+	"""Plot settings of the KSSM configuration, as MeshPlotLayout arguments"""
+	return {
+		'font_size': config.plot_node_font_size,
+		'range_circles': config.plot_range_circles,
+		'range_circles_minimal_rssi': config.plot_range_circles_minimal_rssi,
+		'range_circles_color_from_message_id': config.plot_range_circles_color_from_message_id,
+	}
+
+class MeshPlotLayout:
+	"""Static part of the network plot"""
+	def __init__(self, nodes_info, size, dpi = 200, font_size = 8, range_circles = True, range_circles_minimal_rssi = -120, range_circles_color_from_message_id = True):
+		"""
+		:param nodes_info: list of node_info() dicts in the node order
+		:param size: x_min, x_max, y_min, y_max
+		"""
+		self.nodes_info = nodes_info
+		self.positions = [(n['position'][0], n['position'][1]) for n in nodes_info]
+		self.marker_sizes = [(n['tx_power'] + 10)**2 for n in nodes_info]
+		self.size = size
+		self.dpi = dpi
+		self.font_size = font_size
+		self.range_circles = range_circles
+		self.range_circles_color_from_message_id = range_circles_color_from_message_id
+		self.ranges = [theoretical_range(n['tx_power'], n['frequency'], range_circles_minimal_rssi) for n in nodes_info]
+
+	@classmethod
+	def from_nodes(cls, nodes, size, dpi, config):
+		return cls([node_info(n) for n in nodes], size, dpi, **plot_settings(config))
+
+class MeshFrame:
+	"""State of the network at one point of time"""
+	def __init__(self, time, nodes, links):
+		self.time = time
+		self.nodes = nodes	# FRAME_NODE_DTYPE record of every node
+		self.links = links	# FRAME_LINK_DTYPE record of every reception in progress
+
+	@classmethod
+	def from_nodes(cls, nodes, nodes_by_id, time):
+		rows = []
+		links = []
+		for node in nodes:
+			tx_message = node.tx_message_id()
+			rows.append((node.state.value, -1 if tx_message is None else tx_message, node.message_queue.qsize(), len(node.known_nodes),
+				node.rx_success, node.rx_fail, node.rx_dups, node.tx_done, node.tx_cancelled, node.forwarded, node.collisions_caused))
+			if node.state == NodeState.RX_BUSY:
+				for n_id, rx in node.currently_receiving.items():
+					links.append((nodes_by_id[n_id].index, node.index, rx["signal_snr"]))
+		return cls(time, np.array(rows, dtype=FRAME_NODE_DTYPE), np.array(links, dtype=FRAME_LINK_DTYPE))
+
+class MeshFrameRecorder:
+	"""Appends frames to <results_dir>/frames.bin, the static data needed to render them is stored in frames.json"""
+	def __init__(self, results_dir, nodes_info, size):
+		self.index_path = os.path.join(results_dir, FRAMES_INDEX_NAME)
+		self.index = {'size': list(size), 'nodes': nodes_info, 'frames': 0}
+		self.file_path = os.path.join(results_dir, FRAMES_FILE_NAME)
+		self.file = open(self.file_path, 'wb')
+		self.offset = 0	# size of frames.bin at the last checkpoint
+		self.write_index()
+
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		state['file'] = None
+		return state
+
+	def checkpoint(self):
+		self.file.flush()
+		self.offset = self.file.tell()
+		self.write_index()
+
+	def resume(self, results_dir):
+		file_path = os.path.join(results_dir, FRAMES_FILE_NAME)
+		resume_file(self.file_path, file_path, self.offset)
+		self.file_path = file_path
+		self.file = open(file_path, 'ab')
+		self.index_path = os.path.join(results_dir, FRAMES_INDEX_NAME)
+		self.write_index()
+
+	def write(self, frame):
+		self.file.write(np.array([(frame.time, len(frame.links))], dtype=FRAME_HEADER_DTYPE).tobytes())
+		self.file.write(frame.nodes.tobytes())
+		self.file.write(frame.links.tobytes())
+		self.index['frames'] += 1
+
+	def write_index(self):
+		with open(self.index_path, 'w') as f:
+			json.dump(self.index, f, indent=1)
+
+	def close(self, end_time = None):
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+			self.index['end_time'] = end_time
+			self.write_index()
+
+class MeshFrameReader:
+	"""Iterates over the MeshFrames recorded in results_dir"""
+	def __init__(self, results_dir):
+		with open(os.path.join(results_dir, FRAMES_INDEX_NAME), 'r') as f:
+			self.index = json.load(f)
+		path = os.path.join(results_dir, FRAMES_FILE_NAME)
+		self.data = np.memmap(path, dtype='u1', mode='r') if os.path.getsize(path) > 0 else np.zeros(0, dtype='u1')
+		self.nodes_info = self.index['nodes']
+		self.size = tuple(self.index['size'])
+
+	def __len__(self):
+		return self.index['frames']
+
+	def __iter__(self):
+		nodes_count = len(self.nodes_info)
+		offset = 0
+		while offset < len(self.data):
+			header = np.frombuffer(self.data, FRAME_HEADER_DTYPE, 1, offset)[0]
+			offset += FRAME_HEADER_DTYPE.itemsize
+			nodes = np.frombuffer(self.data, FRAME_NODE_DTYPE, nodes_count, offset).copy()
+			offset += FRAME_NODE_DTYPE.itemsize * nodes_count
+			links = np.frombuffer(self.data, FRAME_LINK_DTYPE, int(header['links']), offset).copy()
+			offset += FRAME_LINK_DTYPE.itemsize * int(header['links'])
+			yield MeshFrame(int(header['time']), nodes, links)
+
+	def layout(self, dpi, config):
+		return MeshPlotLayout(self.nodes_info, self.size, dpi, **plot_settings(config))
+
+def frame_duration(time_delta, slowmo_factor):
+	"""Video duration in µs of a frame shown for time_delta µs of the simulation (at least 1 ms)"""
+	return max(time_delta * slowmo_factor, 1000)
+
+class MeshFramePolicy:
+	"""
+	Decides which state changes produce an animation frame:
+	- min_interval - minimal simulated time between two frames, a change coming earlier is shown
+	  by a frame taken min_interval after the previous one,
+	- coalesce_window - a change opens a window and all the changes inside it are shown
+	  by a single frame taken at its end,
+	- max_frames - maximal number of frames of the run, plan() spreads them over the simulation time.
+	All times in µs, 0 turns the limit off.
+	"""
+	def __init__(self, min_interval = 0, coalesce_window = 0, max_frames = 0):
+		self.min_interval = min_interval
+		self.coalesce_window = coalesce_window
+		self.max_frames = max_frames
+		self.pending = None	# time the frame of the already requested changes is due
+		self.last_frame = None
+		self.frames = 0
+		self.requests = 0
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(getattr(config, 'plot_min_frame_interval', 0), getattr(config, 'plot_coalesce_window', 0), getattr(config, 'plot_max_frames', 0))
+
+	def plan(self, simulation_time):
+		"""Raises min_interval so that max_frames frames cover simulation_time µs"""
+		if self.max_frames > 0:
+			self.min_interval = max(self.min_interval, simulation_time // self.max_frames)
+
+	def request(self, time):
+		"""A state change at time, returns True if the frame should be taken now"""
+		self.requests += 1
+		if self.pending is None:
+			due = time + self.coalesce_window
+			if self.last_frame is not None:
+				due = max(due, self.last_frame + self.min_interval)
+			self.pending = due
+		return self.due(time)
+
+	def due(self, time):
+		"""True if the frame of the requested changes should be taken at time"""
+		if self.pending is None or time < self.pending:
+			return False
+		self.pending = None
+		return self.max_frames == 0 or self.frames < self.max_frames
+
+	def frame_taken(self, time):
+		self.last_frame = time
+		self.frames += 1
+
+class MeshPlotRenderer:
+	"""
+	One figure kept alive for all frames. update() only changes the artists that differ from
+	the previous frame: node colors and the title are set in place, labels are replaced when
+	the node record changes and arrows, collision marks and range circles are added or removed
+	per reception/transmission, so the cost of a frame grows with the activity, not with the number of nodes.
+	"""
+	def __init__(self, layout):
+		self.layout = layout
+		size = layout.size
+		self.fig, self.ax = plt.subplots(figsize=((size[1]-size[0])/1000, (size[3]-size[2])/1000))
+		ax = self.ax
+		xs = [p[0] for p in layout.positions]
+		ys = [p[1] for p in layout.positions]
+		# Draw nodes and ranges
+		self.node_records = None
+		self.nodes = ax.scatter(xs, ys, c = ['green'] * len(xs), s = layout.marker_sizes)
+		self.labels = [ax.annotate('', (x, y-200), fontsize=layout.font_size) for x, y in layout.positions]
+		self.links = {}	# (tx_index, rx_index) -> (snr, annotation)
+		self.collisions = {}	# index -> text
+		self.circles = {}	# index -> ((range, color), circle)
+		ax.set_xlim(size[0], size[1])
+		ax.set_ylim(size[2], size[3])
+		self.title = ax.set_title('')
+		ax.set_xlabel('X [m]')
+		ax.set_ylabel('Y [m]')
+		ax.grid(True)
+
+	def update(self, frame):
+		layout = self.layout
+		ax = self.ax
+		records = frame.nodes
+		if self.node_records is None:
+			changed = range(len(records))
+		else:
+			changed = np.nonzero(records != self.node_records)[0]
+		if len(changed) > 0:
+			colors = [STATE_COLORS[NodeState(state)] for state in records['state'].tolist()]
+			self.nodes.set_facecolors(colors)
+			self.nodes.set_edgecolors(colors)
+			for i in changed:
+				self.labels[i].set_text(self.describe(i, records[i]))
+			self.node_records = records.copy()
+
+		links = {(int(tx_index), int(rx_index)): float(snr) for tx_index, rx_index, snr in frame.links.tolist()}
+		for key in list(self.links):
+			if links.get(key) != self.links[key][0]:
+				self.links.pop(key)[1].remove()
+		for (tx_index, rx_index), snr in links.items():
+			if (tx_index, rx_index) in self.links:
+				continue
+			l_width = 1 + int(((snr + 20) / 30) * 4)
+
+			if snr > 0:
+				l_color='#00ff00'
+			elif snr > -10:
+				l_color='#a3a300'
+			else:
+				l_color='#ff0000'
+
+			arrow = ax.annotate(
+				'',
+				xy=layout.positions[rx_index],
+				xytext=layout.positions[tx_index],
+				color='gray',
+				arrowprops=dict(
+					color=l_color,
+					shrink=0.05,
+					width=l_width,
+					headwidth=5,
+					headlength=5
+				)
+			)
+			arrow.set_zorder(self._zorder(3, rx_index, tx_index))
+			self.links[(tx_index, rx_index)] = (snr, arrow)
+
+		receptions = collections.Counter(rx_index for _, rx_index in links)
+		collisions = set(rx_index for rx_index, count in receptions.items() if count > 1)
+		for index in list(self.collisions):
+			if index not in collisions:
+				self.collisions.pop(index).remove()
+		for index in collisions:
+			if index not in self.collisions:
+				x, y = layout.positions[index]
+				self.collisions[index] = ax.text(x, y, 'x', color='red', fontsize=20, ha='center', va='center',
+					zorder = self._zorder(3, index, len(layout.positions)))
+
+		circles = {}
+		if layout.range_circles:
+			for index in np.nonzero(records['state'] == NodeState.TX_BUSY.value)[0].tolist():
+				color = 'red'
+				tx_message = int(records[index]['tx_message'])
+				if layout.range_circles_color_from_message_id and tx_message >= 0:
+					color = "#{:06x}".format(tx_message & 0x00ffffff)
+				circles[index] = (layout.ranges[index], color)
+		for index in list(self.circles):
+			if circles.get(index) != self.circles[index][0]:
+				self.circles.pop(index)[1].remove()
+		for index, (distance, color) in circles.items():
+			if index in self.circles:
+				continue
+			circle = plt.Circle(layout.positions[index], distance,
+				color=color,
+				fill=True,
+				facecolor='blue',
+				alpha=0.3,
+				linestyle='--',
+				linewidth=1)
+			circle.set_zorder(self._zorder(1, index))
+			ax.add_artist(circle)
+			self.circles[index] = ((distance, color), circle)
+
+		self.title.set_text(f't = {(frame.time/1000000):.06f} s')
+
+	def describe(self, index, record):
+		info = self.layout.nodes_info[index]
+		tx_message = int(record['tx_message'])
+		return node_description(info['long_name'], info['node_id'], NodeState(int(record['state'])), tx_message if tx_message >= 0 else None,
+			int(record['queue']), int(record['known_nodes']), int(record['rx_success']), int(record['rx_fail']), int(record['rx_dups']),
+			int(record['tx_done']), int(record['tx_cancelled']), int(record['forwarded']), int(record['collisions_caused']))
+
+	def _zorder(self, base, index, subindex = 0):
+		# artists are added in the order of activity, keep them stacked in the node order
+		n = len(self.layout.positions) + 1
+		return base + 0.4 * (index * n + subindex) / (n * n)
+
+	def save(self, file_name):
+		self.fig.savefig(file_name, dpi=self.layout.dpi, bbox_inches='tight')
+
+	def rgb(self):
+		"""(width, height, raw RGB24 bytes) of the figure rendered at layout.dpi"""
+		self.fig.set_dpi(self.layout.dpi)
+		self.fig.canvas.draw()
+		width, height = self.fig.canvas.get_width_height()
+		rgb = np.asarray(self.fig.canvas.buffer_rgba())[:, :, :3]
+		return width, height, rgb.tobytes()
+
+	def close(self):
+		plt.close(self.fig)
+
+def render_frame(layout, frame, file_name):
+	"""Draws a single frame and saves it as file_name"""
+	renderer = MeshPlotRenderer(layout)
+	renderer.update(frame)
+	renderer.save(file_name)
+	renderer.close()
+
+_worker_renderer = None
+
+def _init_worker(layout):
+	global _worker_renderer
+	_worker_renderer = MeshPlotRenderer(layout)
+
+def _render_job(frame, file_name, rgb):
+	_worker_renderer.update(frame)
+	if file_name is not None:
+		_worker_renderer.save(file_name)
+	return _worker_renderer.rgb() if rgb else None
+
+class MeshVideoStream:
+	"""
+	MP4 file encoded by a single ffmpeg process fed with raw RGB frames through its stdin.
+	The video has a constant frame rate, a frame lasting longer than one video frame
+	is repeated and frames shorter than one video frame are skipped.
+	"""
+	def __init__(self, file_name, slowmo_factor, fps = 25):
+		self.file_name = file_name
+		self.end_time = None	# end of the simulation, the last frame lasts until it
+		self.slowmo_factor = slowmo_factor
+		self.fps = fps
+		self.process = None
+		self.last_frame = None	# (time, width, height, rgb) waiting for the next frame to know its duration
+		self.video_time = 0	# µs
+		self.frames_written = 0
+
+	def add_frame(self, time, width, height, rgb):
+		if self.last_frame is not None:
+			self._write(self.last_frame, frame_duration(time - self.last_frame[0], self.slowmo_factor))
+		self.last_frame = (time, width, height, rgb)
+
+	def _write(self, frame, duration, minimal_count = 0):
+		_, width, height, rgb = frame
+		if self.process is None:
+			self.size = (width, height)
+			self.process = subprocess.Popen([
+				"ffmpeg", "-y", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(self.fps), "-i", "-",
+				"-vf", 'pad=width=ceil(iw/2)*2:height=ceil(ih/2)*2',
+				"-pix_fmt", "yuv420p", "-hide_banner", "-loglevel", "error", self.file_name
+			], stdin = subprocess.PIPE)
+		if (width, height) != self.size:
+			raise ValueError(f"Frame size {width}x{height} differs from the video size {self.size[0]}x{self.size[1]}")
+		self.video_time += duration
+		count = max(round(self.video_time * self.fps / 1000000) - self.frames_written, minimal_count)
+		for i in range(count):
+			self.process.stdin.write(rgb)
+		self.frames_written += count
+
+	def close(self):
+		"""Writes the last frame and waits for ffmpeg to finish the file"""
+		if self.last_frame is not None:
+			last_time = self.last_frame[0]
+			end_time = self.end_time if self.end_time is not None else last_time
+			self._write(self.last_frame, frame_duration(end_time - last_time, self.slowmo_factor), minimal_count = 1)
+			self.last_frame = None
+		if self.process is not None:
+			self.process.stdin.close()
+			if self.process.wait() != 0:
+				raise RuntimeError(f"ffmpeg failed to encode {self.file_name}")
+			self.process = None
+
+class MeshFramePool:
+	"""
+	Fixed number of rendering processes fed through a bounded queue of frames.
+	submit() blocks when max_pending frames are waiting, so the simulation can never
+	get more than max_pending frames ahead of the renderers. Rendered frames are collected
+	in the submission order, so they can be passed to a MeshVideoStream.
+	"""
+	def __init__(self, layout, processes = 0, max_pending = 32, video = None):
+		"""
+		:param layout: MeshPlotLayout shared by all frames
+		:param processes: number of rendering processes, 0 - number of CPU cores
+		:param max_pending: maximal number of submitted frames not rendered yet
+		:param video: MeshVideoStream receiving every rendered frame, None - frames are only saved as PNG files
+		"""
+		self.pool = mp.Pool(processes or None, initializer = _init_worker, initargs = (layout,))
+		self.max_pending = max_pending
+		self.pending = collections.deque()
+		self.video = video
+		self.frames_rendered = 0
+
+	def submit(self, frame, file_name = None):
+		"""Queues the frame for rendering to file_name (PNG) and/or the video stream"""
+		while len(self.pending) >= self.max_pending:
+			self._collect()
+		self.pending.append((frame.time, self.pool.apply_async(_render_job, (frame, file_name, self.video is not None))))
+		while self.pending and self.pending[0][1].ready():
+			self._collect()
+
+	def _collect(self):
+		time, job = self.pending.popleft()
+		result = job.get()	# raises the exception of a failed rendering
+		self.frames_rendered += 1
+		if self.video is not None:
+			self.video.add_frame(time, *result)
+
+	def close(self):
+		"""Waits until all submitted frames are rendered, stops the processes and finishes the video"""
+		while self.pending:
+			self._collect()
+		self.pool.close()
+		self.pool.join()
+		if self.video is not None:
+			self.video.close()
+
+def render_recording(results_dir, config, dpi = 200, png = True, mp4 = False, slowmo_factor = 5, processes = 0, max_pending = 32, fps = 25):
+	"""
+	Renders the frames recorded in results_dir (frames.bin) in parallel
+
+	:param config: KSSMconfig with the plot settings (font size, range circles)
+	:param png: save the frames as results_dir/png/*.png
+	:param mp4: encode the frames to results_dir/result.mp4 (streamed to ffmpeg)
+	:return: number of rendered frames
+	"""
+	reader = MeshFrameReader(results_dir)
+	if png:
+		os.makedirs(os.path.join(results_dir, "png"), exist_ok = True)
+	video = MeshVideoStream(os.path.join(results_dir, "result.mp4"), slowmo_factor, fps) if mp4 else None
+	if video is not None:
+		video.end_time = reader.index.get('end_time')
+	pool = MeshFramePool(reader.layout(dpi, config), processes = processes, max_pending = max_pending, video = video)
+	for frame in reader:
+		file_name = os.path.join(results_dir, "png", "{:010d}.png".format(frame.time)) if png else None
+		pool.submit(frame, file_name)
+	pool.close()
+	return pool.frames_rendered
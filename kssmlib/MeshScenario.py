@@ -0,0 +1,181 @@
+import csv
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from kssmlib.LoRaConstants import lora_mode_by_name
+from kssmlib.MeshtasticNode import Role
+
+"""
+Columnar scenarios
+
+Besides the JSON list of node dicts, a scenario can be given as columns, one value per node:
+	- CSV (scenario.csv) with a header row of the column names,
+	- NPZ (scenario.npz, numpy.savez) with one array per column.
+The columns are the keys of the JSON format (SCENARIO_COLUMNS) with the position split to x, y and z.
+A missing column takes its default value for every node, an empty node_id cell gets a random id.
+Large meshes (MeshTopology.py) are written in these formats, they are loaded without building a
+dict per node, and the role and lora_mode names are converted to the enums once per column.
+
+scenario_columns() turns any of the formats (including the JSON list) into the same dict of columns,
+which MeshSim.create_nodes() reads.
+"""
+
+SCENARIO_COLUMNS = {	# column -> default value, None - required
+	'type': 'meshtastic',
+	'node_id': '',		# hexadecimal, '' - random
+	'long_name': None,
+	'x': None,
+	'y': None,
+	'z': 10,
+	'tx_power': None,
+	'noise_level': None,
+	'frequency': None,
+	'lora_mode': 'MediumFast',
+	'hop_start': None,
+	'role': 'CLIENT',
+	'position_interval': 0,
+	'nodeinfo_interval': 0,
+	'text_message_min_interval': None,
+	'text_message_max_interval': None,
+	'debug': False,
+}
+STRING_COLUMNS = ['type', 'node_id', 'long_name', 'lora_mode', 'role']
+SIMULATED_ROLES = ['CLIENT', 'CLIENT_MUTE', 'CLIENT_HIDDEN', 'ROUTER', 'ROUTER_CLIENT', 'REPEATER', 'ROUTER_LATE']	# all other roles work as a CLIENT
+SCENARIO_FORMATS = ('.json', '.csv', '.npz')
+SCENARIO_INPUT_NAMES = ['input' + extension for extension in SCENARIO_FORMATS]	# copy of the scenario in the results directory
+
+def scenario_format(file_path):
+	"""Extension of a scenario file (SCENARIO_FORMATS), '.json' for any other name"""
+	extension = os.path.splitext(file_path)[1].lower()
+	return extension if extension in SCENARIO_FORMATS else '.json'
+
+def _records_columns(nodes_data):
+	"""Columns of the JSON list of node dicts"""
+	columns = {}
+	for name, default in SCENARIO_COLUMNS.items():
+		if name in ('x', 'y', 'z'):
+			continue
+		if default is None:
+			columns[name] = [n[name] for n in nodes_data]
+		else:
+			columns[name] = [n.get(name, default) for n in nodes_data]
+	positions = [n.get("position", (0, 0, 0)) for n in nodes_data]
+	columns['x'] = [p[0] for p in positions]
+	columns['y'] = [p[1] for p in positions]
+	columns['z'] = [p[2] if len(p) > 2 else SCENARIO_COLUMNS['z'] for p in positions]
+	return columns
+
+def scenario_columns(scenario):
+	"""
+	Dict of columns (lists or arrays of equal length) of a scenario
+	:param scenario: list of node dicts (JSON format) or dict of columns, possibly with some columns missing
+	"""
+	if not isinstance(scenario, dict):
+		return _records_columns(scenario)
+	count = len(scenario['x'])
+	columns = {}
+	for name, default in SCENARIO_COLUMNS.items():
+		if name in scenario:
+			columns[name] = scenario[name]
+		elif default is None:
+			raise ValueError(f"Scenario column {name} is missing")
+		else:
+			columns[name] = [default] * count
+	return columns
+
+def scenario_records(scenario):
+	"""List of node dicts (JSON format) of a scenario, e.g. for a sweep"""
+	columns = {name: column_list(column) for name, column in scenario_columns(scenario).items()}
+	records = []
+	for i in range(len(columns['x'])):
+		n = {name: columns[name][i] for name in SCENARIO_COLUMNS if name not in ('x', 'y', 'z')}
+		n["position"] = [columns['x'][i], columns['y'][i], columns['z'][i]]
+		if n["node_id"] == '':
+			del n["node_id"]
+		records.append(n)
+	return records
+
+def column_list(column):
+	"""Column as a list of Python values (not numpy scalars)"""
+	return column.tolist() if isinstance(column, np.ndarray) else list(column)
+
+def node_ids(column):
+	"""Integer node ids of the node_id column (hexadecimal strings or integers), None for the empty ones"""
+	ids = []
+	for value in column_list(column):
+		if isinstance(value, str):
+			ids.append(int(value, 16) & 0xffffffff if value != '' else None)
+		else:
+			ids.append(int(value) & 0xffffffff)
+	return ids
+
+def enum_column(column, by_name):
+	"""List of enum values of a column of names, every distinct name is looked up once"""
+	column = column_list(column)
+	values = {name: by_name(name) for name in set(column)}
+	return [values[name] for name in column]
+
+def lora_mode_column(column):
+	return enum_column(column, lora_mode_by_name)
+
+def role_by_name(name):
+	"""Role of a role name, the roles the simulator does not model (SIMULATED_ROLES) and unknown names (with a warning) work as a CLIENT"""
+	if name in SIMULATED_ROLES:
+		return Role[name]
+	if name not in Role.__members__:
+		print(f"Unknown role {name}, the node works as a CLIENT")
+	return Role.CLIENT
+
+def role_column(column):
+	return enum_column(column, role_by_name)
+
+def scenario_size(scenario, margin = 0.2):
+	"""Plot area (x_min, x_max, y_min, y_max) of a scenario: the bounding box of the nodes enlarged by margin of its size on every side"""
+	columns = scenario_columns(scenario)
+	x = np.asarray(columns['x'])
+	y = np.asarray(columns['y'])
+	x_min, x_max, y_min, y_max = x.min().item(), x.max().item(), y.min().item(), y.max().item()
+	x_r = x_max - x_min
+	y_r = y_max - y_min
+	return (x_min - int(margin * x_r), x_max + int(margin * x_r), y_min - int(margin * y_r), y_max + int(margin * y_r))
+
+def read_scenario(file_path):
+	"""Scenario of a file: list of node dicts of a JSON file, dict of numpy columns of a CSV or NPZ file"""
+	extension = scenario_format(file_path)
+	if extension == '.npz':
+		with np.load(file_path, allow_pickle = False) as data:
+			return {name: data[name] for name in data.files}
+	if extension == '.csv':
+		frame = pd.read_csv(file_path, dtype = {name: str for name in STRING_COLUMNS}, keep_default_na = False)
+		columns = {name: frame[name].to_numpy() for name in frame.columns}
+		if 'debug' in columns and columns['debug'].dtype != bool:
+			columns['debug'] = np.isin(np.char.lower(columns['debug'].astype(str)), ('true', '1'))
+		return columns
+	with open(file_path, 'r') as f:
+		return json.load(f)
+
+def copy_scenario(file_path, results_dir):
+	"""Copies the scenario file to results_dir as input.json, input.csv or input.npz (SCENARIO_INPUT_NAMES), a copy in another format is removed"""
+	for name in SCENARIO_INPUT_NAMES:
+		if os.path.isfile(os.path.join(results_dir, name)):
+			os.remove(os.path.join(results_dir, name))
+	shutil.copy(file_path, os.path.join(results_dir, 'input' + scenario_format(file_path)))
+
+def write_scenario(file_path, scenario):
+	"""Writes a scenario (list of node dicts or dict of columns) in the format of the file name: JSON, CSV or NPZ"""
+	extension = scenario_format(file_path)
+	if extension == '.json':
+		with open(file_path, 'w') as f:
+			json.dump(scenario_records(scenario), f, indent = 4)
+		return
+	columns = scenario_columns(scenario)
+	if extension == '.npz':
+		np.savez_compressed(file_path, **{name: np.asarray(column_list(column)) for name, column in columns.items()})
+		return
+	lists = [column_list(columns[name]) for name in SCENARIO_COLUMNS]
+	with open(file_path, 'w', newline = '') as f:
+		writer = csv.writer(f)
+		writer.writerow(SCENARIO_COLUMNS.keys())
+		writer.writerows(zip(*lists))
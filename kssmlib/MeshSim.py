@@ -1,27 +1,49 @@
-import random
 import math
 import tempfile
-import glob
-import re
 import json
 import os
+import shutil
 import subprocess
 import base64
+import time
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import multiprocessing as mp
 import numpy as np
 import pandas as pd
 from datetime import datetime, timezone
-from kssmlib.BasicMeshNode import BasicMeshNode
-from kssmlib.MeshtasticNode import MeshtasticNode, NodeState, Role
+from kssmlib.BasicMeshNode import BasicMeshNode, slot_time, theoretical_range
+from kssmlib.MeshtasticNode import MeshtasticNode, NodeState, Role, meshtastic_slot_time
 from kssmlib import LoRaConstants, MeshConfig
-from kssmlib.KSSMconfig import KSSMconfig
+from kssmlib.MeshContext import MeshContext
 from kssmlib.MeshPropagation import MeshPropagation
+from kssmlib.MeshEventQueue import MeshEventQueue
+from kssmlib.MeshMessage import tx_time_table
+from kssmlib.MeshLogger import MeshLogger
+from kssmlib.MeshDelivery import MeshDeliveryIndex
+from kssmlib.MeshMetrics import MeshMetrics
+from kssmlib.MeshNodeArrays import MeshNodeArrays
+from kssmlib.MeshNodeScheduler import MeshNodeScheduler
+from kssmlib.MeshScenario import scenario_columns, column_list, node_ids, lora_mode_column, role_column, SCENARIO_INPUT_NAMES
+from kssmlib.MeshCheckpoint import instance_state, save_checkpoint, load_checkpoint, CHECKPOINT_NAME
+from kssmlib.MeshProgress import MeshProgress, format_duration
+from kssmlib.MeshProfiler import MeshPhaseTimers, cache_rows, function_cache_stats, top_functions, write_rows, PROFILE_STATS_NAME, PROFILE_COLLAPSED_NAME
+from kssmlib.MeshRenderer import MeshFrame, MeshFramePool, MeshFramePolicy, MeshFrameRecorder, MeshPlotLayout, MeshVideoStream, render_frame, frame_duration, node_info
 
 class MeshSim:
-	def __init__(self, nodes_data, config_file, size = (0, 1000, 0, 1000), results_dir = '.', generate_png = False, generate_mp4 = False, plot_dpi = 200):
+	def __init__(self, nodes_data, config_file, size = (0, 1000, 0, 1000), results_dir = '.', generate_png = False, generate_mp4 = False, plot_dpi = 200, engine = 'tick', reception_model = 'tick', log_format = 'csv', verbose = True, plot_map = True, config_overrides = None, seed = None, context = None, mp4_mode = 'png', slowmo_factor = MeshConfig.SLOWMO_FACTOR, record_frames = False, phase_timers = False, progress_interval = 0, report_interval = 0, checkpoint_interval = 0, max_step = 0):
+		"""
+		:param mp4_mode: 'png' - the MP4 is made by make_video() from the PNG frames, 'stream' - frames are piped to ffmpeg during the simulation
+		:param slowmo_factor: slowdown factor of the streamed MP4
+		:param record_frames: record the network state frames to frames.bin for rendering them later (render_recording())
+		:param seed: seed of the simulation random number generator (random if None)
+		:param context: MeshContext to use instead of creating one from config_file, config_overrides and seed
+		:param phase_timers: time every call of the node and logger methods too, not only the coarse phases (see MeshProfiler.py)
+		:param progress_interval: wall seconds between the progress lines printed by run(), 0 - none
+		:param report_interval: wall seconds between the rewrites of the partial index.html during run(), 0 - none
+		:param checkpoint_interval: simulated µs between the checkpoints written by run() (see save_checkpoint()), 0 - none
+		:param max_step: adaptive stepping of the tick, vector and wheel engines, the largest step in µs (see adaptive_step()), 0 - every step is time_resolution
+		"""
 		self.size = size # x_min, x_max, y_min, y_max
 		self.nodes_data = nodes_data
 		self.nodes = []
@@ -29,193 +51,478 @@ class MeshSim:
 		self.results_dir = results_dir
 		self.generate_mp4 = generate_mp4
 		self.generate_png = generate_png
+		if mp4_mode not in ('png', 'stream'):
+			raise ValueError(f"Unknown MP4 mode: {mp4_mode}")
+		self.stream_mp4 = generate_mp4 and mp4_mode == 'stream'
+		self.slowmo_factor = slowmo_factor
 		self.messages_csv_name = self.results_dir + "/messages.csv"
 		self.nodes_csv_name = self.results_dir + "/nodes.csv"
 		self.backoff_csv_name = self.results_dir + "/backoff.csv"
 		self.current_time = 0
 		self.dpi = plot_dpi
-		self.config = KSSMconfig()
-		self.config.load_config(config_file)
+		self.context = context if context is not None else MeshContext(config_file, seed = seed, config_overrides = config_overrides)
+		self.config = self.context.config
+		self.constants = self.context.constants
+		self.verbose = verbose
 		self.propagation_model = MeshPropagation(model=self.config.propagation_model)
+		self.logger = MeshLogger(message_file_path = self.messages_csv_name, nodes_file_path = self.nodes_csv_name, backoff_file_path = self.backoff_csv_name, buffer_rows = self.constants.LOGGER_BUFFER_ROWS, log_format = log_format)
+		self.engine = engine
+		self.event_queue = None
+		self.node_stepper = None	# MeshNodeArrays (vector engine) or MeshNodeScheduler (wheel engine), steps the nodes instead of time_advance()
+		self.frame_pool = None
+		self.frame_recorder = None
+		self.frame_policy = MeshFramePolicy.from_config(self.config)
+		self.frame_times = []	# times of the animation frames
+		self.timers = MeshPhaseTimers()
+		self.phase_timers = phase_timers
+		self.progress_interval = progress_interval
+		self.report_interval = report_interval
+		self.progress = None
+		self.checkpoint_interval = checkpoint_interval
+		self.time_resolution = MeshConfig.SIMULATION_INTERVAL	# of the last run(), a resumed simulation continues with it
+		self.max_step = max_step
+		self.step_histogram = {}	# step µs -> number of steps taken by the tick, vector and wheel engines
 
 		self.create_nodes()
-		self.plot_nodes(name = self.results_dir + "/nodes_map.png")
+		self.link_table = self.propagation_model.build_link_table(self.nodes, constants = self.constants)
+		self.delivery_index = MeshDeliveryIndex(len(self.nodes))
+		self.metrics = MeshMetrics(len(self.nodes), self.constants.METRICS_WINDOW)
+		if reception_model not in ('tick', 'interval'):
+			raise ValueError(f"Unknown reception model: {reception_model}")
+		self.reception_model = 'interval' if self.engine == 'event' else reception_model
+		self.active_transmissions = {}
+		for n in self.nodes:
+			n.link_table = self.link_table
+			n.delivery_index = self.delivery_index
+			n.metrics = self.metrics
+			n.reception_model = self.reception_model
+			n.active_transmissions = self.active_transmissions
+		if self.engine == 'event':
+			self.event_queue = MeshEventQueue()
+			for n in self.nodes:
+				n.attach_event_queue(self.event_queue)
+		elif self.engine not in ('tick', 'vector', 'wheel'):
+			raise ValueError(f"Unknown simulation engine: {self.engine}")
+		self.set_up_wrappers()
+		if record_frames:
+			self.frame_recorder = MeshFrameRecorder(self.results_dir, [node_info(n) for n in self.nodes], self.size)
+		if plot_map:
+			self.plot_nodes(name = self.results_dir + "/nodes_map.png")
+		self.timers.wrap(self, 'plot_nodes')	# after the map, animation frames only
 
 	def create_nodes(self):
-		for n in self.nodes_data:
-			if "node_id" in n.keys():
-				node_id = int(n["node_id"], 16) & 0xffffffff
-			else:
-				node_id = random.getrandbits(32)
-
-			if "lora_mode" in n.keys():
-				if n["lora_mode"] == 'MediumFast':
-					lora_mode = LoRaConstants.LoRaMode.MEDIUM_FAST
-				elif n["lora_mode"] == 'LongFast':
-					lora_mode = LoRaConstants.LoRaMode.LONG_FAST
-				elif n["lora_mode"] == 'LongSlow':
-					lora_mode = LoRaConstants.LoRaMode.LONG_SLOW
-				elif n["lora_mode"] == 'VeryLongSlow':
-					lora_mode = LoRaConstants.LoRaMode.VERY_LONG_SLOW
-				elif n["lora_mode"] == 'MediumSlow':
-					lora_mode = LoRaConstants.LoRaMode.MEDIUM_SLOW
-				elif n["lora_mode"] == 'ShortSlow':
-					lora_mode = LoRaConstants.LoRaMode.SHORT_SLOW
-				elif n["lora_mode"] == 'ShortFast':
-					lora_mode = LoRaConstants.LoRaMode.SHORT_FAST
-				elif n["lora_mode"] == 'LongModerate':
-					lora_mode = LoRaConstants.LoRaMode.LONG_MODERATE
-				elif n["lora_mode"] == 'ShortTurbo':
-					lora_mode = LoRaConstants.LoRaMode.SHORT_TURBO
-				elif n["lora_mode"] == 'CustomFastest':
-					lora_mode = LoRaConstants.LoRaMode.CUSTOM_FASTEST
-			else:
-				lora_mode = LoRaConstants.LoRaMode.MEDIUM_FAST
-
-			if not ("type" in n.keys()):
-				n["type"] = "meshtastic"
-
-			if n["type"] == "basic":
-				node = BasicMeshNode(
-					node_id = node_id,
-					long_name = n["long_name"],
-					position = n["position"],
-					tx_power = n["tx_power"],
-					noise_level = n["noise_level"],
-					frequency = n["frequency"],
-					lora_mode = lora_mode,
-					propagation_model = self.propagation_model,
-					hop_start = n["hop_start"],
-					text_message_min_interval = n["text_message_min_interval"] * 1000000,
-					text_message_max_interval = n["text_message_max_interval"] * 1000000,
-					neighbors = self.nodes,
-					debug = n["debug"],
-					messages_csv_name = self.messages_csv_name,
-					nodes_csv_name = self.nodes_csv_name,
-					backoff_csv_name = self.backoff_csv_name
-				)
-			elif n["type"] == "meshtastic":
-
-				role = Role.CLIENT
-				if "role" in n.keys():
-					if n["role"] == 'ROUTER':
-						role = Role.ROUTER
-					elif n["role"] == 'CLIENT_MUTE':
-						role = Role.CLIENT_MUTE
-					elif n["role"] == 'ROUTER_CLIENT':
-						role = Role.ROUTER_CLIENT
-					elif n["role"] == 'ROUTER_LATE':
-						role = Role.ROUTER_LATE
-					elif n["role"] == 'REPEATER':
-						role = Role.REPEATER
-
-				if not "nodeinfo_interval" in n.keys():
-					n["nodeinfo_interval"] = 0
-				if not "position_interval" in n.keys():
-					n["position_interval"] = 0
-
-				node = MeshtasticNode(
-					node_id = node_id,
-					long_name = n["long_name"],
-					position = n["position"],
-					tx_power = n["tx_power"],
-					noise_level = n["noise_level"],
-					frequency = n["frequency"],
-					lora_mode = lora_mode,
-					propagation_model = self.propagation_model,
-					hop_start = n["hop_start"],
-					nodeinfo_interval = n["nodeinfo_interval"] * 1000000,
-					position_interval = n["position_interval"] * 1000000,
-					text_message_min_interval = n["text_message_min_interval"] * 1000000,
-					text_message_max_interval = n["text_message_max_interval"] * 1000000,
-					neighbors = self.nodes,
-					debug = n["debug"],
-					role = role,
-					messages_csv_name = self.messages_csv_name,
-					nodes_csv_name = self.nodes_csv_name,
-					backoff_csv_name = self.backoff_csv_name
+		"""Creates the nodes of the scenario column by column (see MeshScenario.py), the names are converted to enums once per column"""
+		columns = scenario_columns(self.nodes_data)
+		types = column_list(columns['type'])
+		ids = node_ids(columns['node_id'])
+		lora_modes = lora_mode_column(columns['lora_mode'])
+		roles = role_column([r if t == 'meshtastic' else 'CLIENT' for t, r in zip(types, column_list(columns['role']))])
+		long_names, x, y, z, tx_power, noise_level, frequency, hop_start, nodeinfo_interval, position_interval, text_min, text_max, debug = [
+			column_list(columns[name]) for name in ('long_name', 'x', 'y', 'z', 'tx_power', 'noise_level', 'frequency', 'hop_start', 'nodeinfo_interval',
+			'position_interval', 'text_message_min_interval', 'text_message_max_interval', 'debug')]
+		for i in range(len(types)):
+			node_id = ids[i] if ids[i] is not None else self.context.random_id()
+			common = dict(
+				node_id = node_id,
+				long_name = long_names[i],
+				position = [x[i], y[i], z[i]],
+				tx_power = tx_power[i],
+				noise_level = noise_level[i],
+				frequency = frequency[i],
+				lora_mode = lora_modes[i],
+				propagation_model = self.propagation_model,
+				hop_start = hop_start[i],
+				text_message_min_interval = text_min[i] * 1000000,
+				text_message_max_interval = text_max[i] * 1000000,
+				neighbors = self.nodes,
+				debug = debug[i],
+				messages_csv_name = self.messages_csv_name,
+				nodes_csv_name = self.nodes_csv_name,
+				backoff_csv_name = self.backoff_csv_name,
+				logger = self.logger,
+				context = self.context
 			)
-
+			if types[i] == "basic":
+				node = BasicMeshNode(**common)
+			elif types[i] == "meshtastic":
+				node = MeshtasticNode(
+					nodeinfo_interval = nodeinfo_interval[i] * 1000000,
+					position_interval = position_interval[i] * 1000000,
+					role = roles[i],
+					**common
+				)
 			else:
 				continue
 
-			print(node)
+			if self.verbose:
+				print(node)
+			node.index = len(self.nodes)
 			self.nodes.append(node)
 			self.nodes_by_id[node_id] = node
 
+	def set_up_wrappers(self):
+		"""Per-instance method wrappers: log write timers, phase timers, vector and wheel engines (not stored in the checkpoints)"""
+		for table in self.logger.tables:
+			self.timers.wrap(table, 'flush', 'log_write')
+		if self.phase_timers:
+			self.instrument()
+		if self.engine == 'vector':	# after instrument(), the receiver wrappers call the timed methods
+			self.node_stepper = MeshNodeArrays(self.nodes, self.reception_model, self.current_time)
+		elif self.engine == 'wheel':
+			self.node_stepper = MeshNodeScheduler(self.nodes, self.reception_model, self.current_time, self.time_resolution)
+
+	def __getstate__(self):
+		"""Checkpoint state, see MeshCheckpoint.py"""
+		return instance_state(self, drop = ('frame_pool', 'node_stepper', 'progress'))
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.frame_pool = None
+		self.node_stepper = None
+		self.progress = None
+		self.set_up_wrappers()
+		self.timers.wrap(self, 'plot_nodes')
+
+	def save_checkpoint(self, file_path = None):
+		"""
+		Writes the state of the simulation to file_path (default <results_dir>/checkpoint.pkl) between two steps,
+		load it with MeshSim.resume()
+		"""
+		start = time.perf_counter_ns()
+		self.sync_nodes()
+		self.logger.checkpoint()
+		if self.frame_recorder is not None:
+			self.frame_recorder.checkpoint()
+		save_checkpoint(self, file_path if file_path is not None else os.path.join(self.results_dir, CHECKPOINT_NAME))
+		self.timers.add('checkpoint', start)
+
+	@classmethod
+	def resume(cls, file_path, results_dir = None, verbose = None, progress_interval = None, report_interval = None, checkpoint_interval = None):
+		"""
+		Simulation restored from a checkpoint, run() continues it exactly like the original one would have continued
+		:param results_dir: results directory of the continued simulation, None - the original one; the logs written
+			after the checkpoint are cut off, a new directory gets a copy of the logs up to the checkpoint
+		:param verbose, progress_interval, report_interval, checkpoint_interval: None - the values of the original simulation
+		"""
+		sim = load_checkpoint(file_path)
+		if results_dir is not None:
+			sim.move_results(results_dir)
+		sim.logger.resume(sim.results_dir)
+		if sim.frame_recorder is not None:
+			sim.frame_recorder.resume(sim.results_dir)
+		for name, value in [('verbose', verbose), ('progress_interval', progress_interval), ('report_interval', report_interval), ('checkpoint_interval', checkpoint_interval)]:
+			if value is not None:
+				setattr(sim, name, value)
+		return sim
+
+	def move_results(self, results_dir):
+		"""Results of a continued simulation go to results_dir, the scenario (input.json, .csv or .npz) is copied there"""
+		if os.path.abspath(results_dir) == os.path.abspath(self.results_dir):
+			return
+		for name in SCENARIO_INPUT_NAMES:
+			old_input = os.path.join(self.results_dir, name)
+			if os.path.isfile(old_input):
+				shutil.copy(old_input, os.path.join(results_dir, name))
+		self.results_dir = results_dir
+		self.messages_csv_name = results_dir + "/messages.csv"
+		self.nodes_csv_name = results_dir + "/nodes.csv"
+		self.backoff_csv_name = results_dir + "/backoff.csv"
+
+	def prepare_fork(self):
+		"""Brings the nodes and the logs up to date before the process is forked, see fork() and MeshBranch.py"""
+		self.sync_nodes()
+		self.logger.checkpoint()
+
+	def fork(self, results_dir):
+		"""
+		Continues the simulation in results_dir in a forked process, with a copy of the logs up to the fork;
+		the animation output, progress reports and checkpoints are switched off, their files and workers belong to the parent
+		"""
+		self.move_results(results_dir)
+		self.logger.fork(results_dir)
+		self.frame_pool = None
+		self.frame_recorder = None
+		self.generate_png = self.generate_mp4 = self.stream_mp4 = False
+		self.progress = None
+		self.progress_interval = self.report_interval = self.checkpoint_interval = 0
+		self.verbose = False
+
+	PROFILED_NODE_METHODS = ['time_advance', 'message_generator', 'dequeue_message', 'calculate_backoff_time', 'inform_neighbors', 'inform',
+		'check_rx_timeouts', 'process_received_message', 'handle_event', 'begin_reception', 'end_reception', 'conclude_transmission']
+	PROFILED_LOGGER_METHODS = ['log_message', 'log_node', 'log_backoff']
+
+	def instrument(self):
+		"""Wraps the node and logger methods in phase timers, node methods are reported as node.<method>"""
+		for n in self.nodes:
+			for method in self.PROFILED_NODE_METHODS:
+				self.timers.wrap(n, method, 'node.' + method)
+		for method in self.PROFILED_LOGGER_METHODS:
+			self.timers.wrap(self.logger, method)
+
 	def time_advance(self, step_interval = 1000): #step interval in microseconds
 		self.current_time += step_interval
 		changedState = False
-		for n in self.nodes:
-			n.time_advance(step_interval)
-			if n.state_was_changed():
-				changedState = True
+		start = time.perf_counter_ns()
+		if self.node_stepper is not None:
+			changedState = self.node_stepper.step(step_interval)
+		else:
+			for n in self.nodes:
+				n.time_advance(step_interval)
+				if n.state_was_changed():
+					changedState = True
+		self.timers.add('node_steps', start)
 
 		if changedState or self.config.plot_every_n_microseconds_if_state_not_changed > 0 and self.current_time % self.config.plot_every_n_microseconds_if_state_not_changed == 0:
+			self.report_state()
+		elif self.frame_policy.pending is not None and self.frame_policy.due(self.current_time):
+			self.plot_nodes(self.current_time)
+
+	def run(self, simulation_time, time_resolution = MeshConfig.SIMULATION_INTERVAL): #times in microseconds
+		start = time.perf_counter_ns()
+		self.time_resolution = time_resolution
+		self.frame_policy.plan(self.current_time + simulation_time)	# the whole simulation, also when continued from a checkpoint
+		if self.progress_interval > 0 or self.report_interval > 0:
+			self.progress = MeshProgress(self, self.current_time, self.current_time + simulation_time, self.progress_interval, self.report_interval)
+		if self.engine == 'event':
+			self.run_events(self.current_time + simulation_time)
+		else:
+			progress = self.progress
+			if self.engine == 'wheel':
+				self.node_stepper.set_resolution(time_resolution)
+			next_checkpoint = self.next_checkpoint_time()
+			end_time = self.current_time + simulation_time // time_resolution * time_resolution
+			histogram = self.step_histogram
+			while self.current_time < end_time:
+				step = self.adaptive_step(time_resolution, end_time, next_checkpoint) if self.max_step > time_resolution else time_resolution
+				histogram[step] = histogram.get(step, 0) + 1
+				self.time_advance(step)
+				if progress is not None:
+					progress.update()
+				if next_checkpoint is not None and self.current_time >= next_checkpoint:
+					self.save_checkpoint()
+					next_checkpoint = self.next_checkpoint_time()
+			self.sync_nodes()
+		if self.checkpoint_interval > 0 and self.current_time % self.checkpoint_interval != 0:
+			self.save_checkpoint()	# the end of the run, e.g. of a warm-up
+		if self.progress is not None:
+			self.progress.finish()
+			self.progress = None
+		self.timers.add('run', start)
+
+	def adaptive_step(self, time_resolution, end_time, next_checkpoint = None):
+		"""
+		Next step of the adaptive tick engine: a multiple of time_resolution up to the tick before the first one
+		in which a node timer fires (message generation, end of backoff, end of transmission in the interval
+		reception model), a frame is due or a checkpoint is written, but at most max_step. The nodes only count
+		their timers down in a long step, the tick of the timer is a step of time_resolution, in which the nodes
+		see the state (e.g. air_util) of the previous tick, so the results are those of the tick engine with
+		time_resolution. While a node is transmitting or receiving in the tick reception model, every step is
+		time_resolution.
+		"""
+		steps = min(self.max_step, end_time - self.current_time) // time_resolution
+		boundaries = [next_checkpoint, self.frame_policy.pending]
+		plot_interval = self.config.plot_every_n_microseconds_if_state_not_changed
+		if plot_interval > 0 and (self.verbose or self.generate_png or self.stream_mp4 or self.frame_recorder is not None):	# report_state() of time_advance()
+			boundaries.append((self.current_time // plot_interval + 1) * plot_interval)
+		for boundary in boundaries:
+			if boundary is not None:
+				steps = min(steps, -(-(boundary - self.current_time) // time_resolution))
+		if self.node_stepper is not None:
+			node_steps = self.node_stepper.idle_steps(time_resolution)
+			if node_steps is not None:
+				steps = min(steps, node_steps)
+		else:
+			for n in self.nodes:
+				if steps <= 1:
+					break
+				node_steps = n.idle_steps(time_resolution)
+				if node_steps is not None:
+					steps = min(steps, node_steps)
+		return max(steps - 1, 1) * time_resolution
+
+	def step_rows(self):
+		"""Rows of the step size histogram: step µs, number of steps, their share of the steps and of the simulated time"""
+		steps = sum(self.step_histogram.values())
+		simulated = sum(step * count for step, count in self.step_histogram.items())
+		return [{'step_us': step, 'steps': count, 'share_of_steps': round(count / steps, 4), 'share_of_time': round(step * count / simulated, 4)}
+			for step, count in sorted(self.step_histogram.items())]
+
+	def run_events(self, end_time): #end time in microseconds
+		"""
+		Discrete-event engine: jumps from one scheduled node event to the next one,
+		so idle periods cost nothing regardless of their length
+		"""
+		for n in self.nodes:
+			n.resume_events()
+		next_checkpoint = self.next_checkpoint_time()
+		while True:
+			event_time = self.event_queue.next_time()
+			while next_checkpoint is not None and next_checkpoint < min(end_time + 1, event_time if event_time is not None else end_time + 1):
+				self.plot_pending_frame(next_checkpoint)
+				self.current_time = next_checkpoint
+				self.save_checkpoint()
+				next_checkpoint = self.next_checkpoint_time()
+			if event_time is None or event_time > end_time:
+				break
+			self.plot_pending_frame(event_time)
+			self.current_time = event_time
+			start = time.perf_counter_ns()
+			while self.event_queue.next_time() == event_time:
+				_, event_type, node = self.event_queue.pop()
+				node.handle_event(event_type, event_time)
+			self.timers.add('node_events', start)
+			changedState = False
+			for n in self.nodes:
+				if n.state_was_changed():
+					changedState = True
+			if changedState:
+				self.report_state()
+			if self.progress is not None:
+				self.progress.update()
+
+		self.plot_pending_frame(end_time)
+		self.current_time = end_time
+		for n in self.nodes:
+			n.finish_events(end_time)
+
+	def next_checkpoint_time(self):
+		"""Time of the next periodic checkpoint, None if there are none"""
+		if self.checkpoint_interval <= 0:
+			return None
+		return (self.current_time // self.checkpoint_interval + 1) * self.checkpoint_interval
+
+	def plot_pending_frame(self, time):
+		"""Event engine: takes the coalesced frame due before time, the state has not changed since the last event"""
+		due = self.frame_policy.pending
+		if due is not None and due <= time and self.frame_policy.due(due):
+			self.current_time = due
+			self.plot_nodes(due)
+
+	def sync_nodes(self):
+		"""Vector and wheel engines: brings the nodes skipped in the last ticks up to date, before their state is read"""
+		if self.node_stepper is not None:
+			self.node_stepper.sync_all()
+
+	def refresh_schedules(self):
+		"""Re-derives the schedules of the vector, wheel and event engines after the node parameters were changed between runs, see MeshBranch.py"""
+		if self.node_stepper is not None:
+			self.node_stepper.refresh_all()
+		if self.event_queue is not None:
+			for n in self.nodes:
+				n.schedule_generation()
+
+	def close(self):
+		"""Writes the buffered logs, waits for the frame rendering and closes the output files, call it once the simulation is finished"""
+		self.logger.close()
+		self.finish_rendering()
+		if self.frame_recorder is not None:
+			self.frame_recorder.close(self.current_time)
+
+	NODE_STAT_FIELDS = ['tx_origin', 'messages_confirmed', 'tx_done', 'forwarded', 'tx_cancelled', 'collisions_caused', 'rx_success',
+		'rx_fail', 'rx_dups', 'rx_unicast', 'air_util', 'tx_util']
+
+	def node_stats(self):
+		"""
+		Final counters of all nodes as NumPy columns (NODE_STAT_FIELDS, messages_heard, history_evicted,
+		known_nodes, neighbors), one entry per node
+		"""
+		stats = {f: np.array([getattr(n, f) for n in self.nodes]) for f in self.NODE_STAT_FIELDS}
+		stats['messages_heard'] = np.array([n.messages_heard.heard for n in self.nodes])
+		stats['history_evicted'] = np.array([n.messages_heard.evicted + n.messages_heard.expired for n in self.nodes])
+		stats['known_nodes'] = np.array([len(n.known_nodes) for n in self.nodes])
+		stats['neighbors'] = np.array([len(n.neighbors) - 1 for n in self.nodes])
+		return stats
+
+	def metrics_snapshot(self):
+		"""Node counters and metric windows at the current time, the start of an interval of summary_metrics()"""
+		self.sync_nodes()
+		return {'time': self.current_time, 'stats': self.node_stats(), 'metrics': self.metrics.snapshot(self.current_time)}
+
+	def summary_metrics(self, start = None):
+		"""
+		Network-wide totals and averages of the node counters, one row of a parameter sweep table
+		:param start: metrics_snapshot() taken at the start of the summarized interval (e.g. the fork of a branch),
+			None - the whole simulation
+		"""
+		stats = self.node_stats()
+		if start is not None:
+			elapsed = self.current_time - start['time']
+			for f, column in start['stats'].items():
+				if f in ('air_util', 'tx_util'):
+					stats[f] = (stats[f] * self.current_time - column * start['time']) / elapsed if elapsed > 0 else np.zeros(len(column))
+				elif f not in ('known_nodes', 'neighbors'):
+					stats[f] = stats[f] - column
+		expected = int(np.sum(stats['tx_origin'] * stats['neighbors']))
+		confirmed = int(np.sum(stats['messages_confirmed']))
+		metrics = {
+			'nodes': len(self.nodes),
+			'tx_origin': int(np.sum(stats['tx_origin'])),
+			'messages_confirmed': confirmed,
+			'success_rate': confirmed / expected if expected > 0 else 0,
+		}
+		for f in ['tx_done', 'forwarded', 'tx_cancelled', 'collisions_caused', 'rx_success', 'rx_fail', 'rx_dups']:
+			metrics[f] = int(np.sum(stats[f]))
+		metrics['air_util_mean'] = float(np.mean(stats['air_util'])) if self.nodes else 0
+		metrics['air_util_max'] = float(np.max(stats['air_util'])) if self.nodes else 0
+		metrics['tx_util_mean'] = float(np.mean(stats['tx_util'])) if self.nodes else 0
+		metrics['history_evicted'] = int(np.sum(stats['history_evicted']))
+		metrics.update(self.metrics.summary(self.current_time, None if start is None else start['metrics']))
+		return metrics
+
+	def report_state(self):
+		if self.verbose:
+			start = time.perf_counter_ns()
 			print("{:>10.6f} ".format(self.current_time/1000000), end='')
 			for n in self.nodes:
 				print("{:14s} ".format(str(n.state)), end='')
 			print()
-			if self.generate_png:
-				self.plot_nodes(self.current_time)
+			self.timers.add('console', start)
+		if (self.generate_png or self.stream_mp4 or self.frame_recorder is not None) and self.frame_policy.request(self.current_time):
+			self.plot_nodes(self.current_time)
+
+	def cache_stats(self):
+		"""name -> (hits, misses, entries) of the propagation model and node method caches"""
+		stats = {'propagation.' + name: value for name, value in self.propagation_model.cache_stats().items()}
+		stats.update(function_cache_stats({
+			'slot_time': slot_time,
+			'meshtastic_slot_time': meshtastic_slot_time,
+			'theoretical_range': theoretical_range,
+			'MeshMessage.tx_time_table': tx_time_table,
+		}))
+		return stats
+
+	def write_profile(self):
+		"""Writes the phase timers (profile_phases.csv), the cache statistics (profile_caches.csv) and the step sizes (profile_steps.csv)"""
+		write_rows(self.results_dir + "/profile_phases.csv", self.timers.rows(total = 'run'))
+		write_rows(self.results_dir + "/profile_caches.csv", cache_rows(self.cache_stats()))
+		write_rows(self.results_dir + "/profile_steps.csv", self.step_rows())
 
 	def make_summary(self):
-		node_names = []
-		known_nodes = {'known_nodes': []}
-		messages_heard = {'messages_heard': []}
-		tx_stat = {
-			'tx_origin': [],
-			'tx_done': [],
-			'forwarded': [],
-			'collisions_caused': [],
-			'tx_cancelled': [],
-		}
-		air_stat = {
-			'air_util': [],
-			'tx_util': []
-		}
-		rx_stat = {
-			'rx_success': [],
-			'rx_fail': [],
-			'rx_dups': [],
-			'rx_unicast': [],
-		}
-		success_rate = {
-			'normalized_success_rate': [],
-		}
-
 		for n in self.nodes:
 			print(n.summarize())
-			node_names.append(f"0x{n.node_id:08x}\n{n.long_name}")
-			messages_heard["messages_heard"].append(len(n.messages_heard))
-			known_nodes["known_nodes"].append(len(n.known_nodes))
-			tx_stat["tx_origin"].append(n.tx_origin)
-			tx_stat["tx_done"].append(n.tx_done)
-			tx_stat["forwarded"].append(n.forwarded)
-			tx_stat["collisions_caused"].append(n.collisions_caused)
-			tx_stat["tx_cancelled"].append(n.tx_cancelled)
-			air_stat["air_util"].append(n.air_util)
-			air_stat["tx_util"].append(n.tx_util)
-			rx_stat["rx_success"].append(n.rx_success)
-			rx_stat["rx_fail"].append(n.rx_fail)
-			rx_stat["rx_dups"].append(n.rx_dups)
-			rx_stat["rx_unicast"].append(n.rx_unicast)
-			if n.tx_origin > 0:
-				success_rate["normalized_success_rate"].append(n.messages_confirmed / (n.tx_origin * (len(n.neighbors)-1)))
-			else:
-				success_rate["normalized_success_rate"].append(0)
-
-		self.plot_stats(node_names, known_nodes, 'known_nodes', 'Number of known nodes')
-		self.plot_stats(node_names, messages_heard, 'messages_heard', 'Number of unique messages heard')
-		self.plot_stats(node_names, tx_stat, 'tx_stat', 'Number of transmitted messages')
-		self.plot_stats(node_names, air_stat, 'air_stat', 'Air statistics')
-		self.plot_stats(node_names, rx_stat, 'rx_stat', 'RX statistics')
-		self.plot_stats(node_names, success_rate, 'normalized_success_rate', 'Normalized success rate')
+		node_names = [f"0x{n.node_id:08x}\n{n.long_name}" for n in self.nodes]
+		stats = self.node_stats()
+		with np.errstate(divide='ignore', invalid='ignore'):
+			expected = stats['tx_origin'] * stats['neighbors']
+			normalized_success_rate = np.where(expected > 0, stats['messages_confirmed'] / expected, 0)
+
+		def columns(*fields):
+			return {f: stats[f].tolist() for f in fields}
+
+		self.plot_stats(node_names, columns('known_nodes'), 'known_nodes', 'Number of known nodes')
+		self.plot_stats(node_names, columns('messages_heard'), 'messages_heard', 'Number of unique messages heard')
+		self.plot_stats(node_names, columns('tx_origin', 'tx_done', 'forwarded', 'collisions_caused', 'tx_cancelled'), 'tx_stat', 'Number of transmitted messages')
+		self.plot_stats(node_names, columns('air_util', 'tx_util'), 'air_stat', 'Air statistics')
+		self.plot_stats(node_names, columns('rx_success', 'rx_fail', 'rx_dups', 'rx_unicast'), 'rx_stat', 'RX statistics')
+		self.plot_stats(node_names, {'normalized_success_rate': normalized_success_rate.tolist()}, 'normalized_success_rate', 'Normalized success rate')
 
 		self.plot_air_util()
 
 		self.plot_messages_success_rate()
 
+		self.metrics.write_csv(self.results_dir + "/metrics.csv", [n.node_id for n in self.nodes], self.current_time)
+		self.plot_metrics()
+
 	def plot_air_util(self):
 		x_coords = [node.position[0] for node in self.nodes]
 		y_coords = [node.position[1] for node in self.nodes]
@@ -264,64 +571,70 @@ class MeshSim:
 		plt.savefig(self.results_dir + "/" + filename + ".png", dpi=self.dpi, bbox_inches='tight')
 
 	def plot_messages_success_rate(self):
-		for node in self.nodes:
-			fig, ax = plt.subplots(figsize=((self.size[1]-self.size[0])/1000, (self.size[3]-self.size[2])/1000))
-			plt.grid()
-			plt.title(f'Messages from 0x{node.node_id:08x} success rate')
-			ax.set_xlim(self.size[0], self.size[1])
-			ax.set_ylim(self.size[2], self.size[3])
-			base_size = (self.size[1] - self.size[0]) * 0.001
-			tx_origin = len(node.tx_origin_list)
-			if tx_origin == 0:
-				plt.close()
-				continue
-			for nodedest in self.nodes:
-				if node.node_id != nodedest.node_id:
-					msgs_received = 0
-					hops_away = 0
-					for tx_msg_id in node.tx_origin_list:
-						if tx_msg_id in nodedest.messages_heard:
-							msgs_received += 1
-							hops_away += nodedest.messages_heard[tx_msg_id]["hops_away"]
-					success_rate = msgs_received / tx_origin
-					if msgs_received > 0:
-						hops_away_avg = hops_away / msgs_received
-						size = base_size * 100 * success_rate
-						ax.scatter(nodedest.position[0], nodedest.position[1], s=size, c='red', alpha=0.9)
-						ax.annotate(f"{nodedest.long_name}\n0x{nodedest.node_id:08x}\nReceived: {msgs_received} msgs ({(success_rate*100):.1f}%)\nAvg hops away: {hops_away_avg:.1f}", (nodedest.position[0], nodedest.position[1]), fontsize=self.config.plot_node_font_size)
-					else:
-						ax.scatter(nodedest.position[0], nodedest.position[1], s=base_size * 5, c='red', alpha=0.9)
-						ax.annotate(f"{nodedest.long_name}\n0x{nodedest.node_id:08x}\nReceived: 0 msgs", (nodedest.position[0], nodedest.position[1]), fontsize=self.config.plot_node_font_size)
-				else:
-					ax.scatter(node.position[0], node.position[1], s=base_size * 100, c='green', alpha=0.9)
-					ax.annotate(f"{node.long_name}\n0x{node.node_id:08x}\nSent: {tx_origin} messages", (node.position[0], node.position[1]), fontsize=self.config.plot_node_font_size)
-			plt.savefig(self.results_dir + f"/success_rate_{node.node_id:08x}" + ".png", dpi=self.dpi, bbox_inches='tight')
-			plt.close()
-
+		"""
+		Delivery rate and mean hops count of the messages of every origin (rows) at every receiver (columns),
+		computed from the delivery index and drawn as one heatmap (success_rate.png)
+		"""
+		block = -(-len(self.nodes) // self.constants.SUCCESS_RATE_MAX_CELLS)	# large meshes are drawn in blocks of nodes
+		delivered, delivery_rate, mean_hops = self.delivery_index.matrices(block)
+		sent = self.delivery_index.sent()
+		n = len(delivery_rate)
+		cell = 0.9 if n <= 30 else max(0.1, 27 / n)
+		size = min(cell * n, self.constants.SUCCESS_RATE_MAX_INCHES)
+		fig, ax = plt.subplots(layout='constrained', figsize=(size + 3, size + 2))
+		image = ax.imshow(np.ma.masked_invalid(delivery_rate * 100), cmap='RdYlGn', vmin=0, vmax=100)
+		fig.colorbar(image, ax=ax, label='Delivery rate [%]', shrink=0.8)
+		ax.set_title('Messages success rate (rows: origin, columns: receiver)')
+		if n <= 30:
+			names = [f"{node.long_name}\n0x{node.node_id:08x}" for node in self.nodes]
+			ax.set_xticks(np.arange(n), names, rotation=90, fontsize=self.config.plot_node_font_size)
+			ax.set_yticks(np.arange(n), [f"{name}\nSent: {s}" for name, s in zip(names, sent)], fontsize=self.config.plot_node_font_size)
+			for origin, receiver in zip(*np.nonzero(delivered)):
+				ax.text(receiver, origin, f"{delivery_rate[origin, receiver]*100:.0f}%\n{mean_hops[origin, receiver]:.1f} hops",
+					ha='center', va='center', fontsize=self.config.plot_node_font_size)
+		blocks = f" (blocks of {block} nodes)" if block > 1 else ''
+		ax.set_xlabel('Receiver' + blocks)
+		ax.set_ylabel('Origin' + blocks)
+		plt.savefig(self.results_dir + "/success_rate.png", dpi=self.dpi, bbox_inches='tight')
+		plt.close()
+
+	def plot_metrics(self):
+		"""Time series of the streaming metrics (metrics.png): utilization, collisions, deliveries and queue length per window"""
+		if self.metrics.windows == 0:
+			return
+		t = np.arange(self.metrics.windows) * self.metrics.window / 1000000
+		tx_util, air_util = self.metrics.utilization(self.current_time)
+		fig, axs = plt.subplots(4, 1, sharex=True, layout='constrained', figsize=(10, 12))
+		axs[0].plot(t, air_util.mean(axis=1) * 100, label='air_util (mean)')
+		axs[0].plot(t, air_util.max(axis=1) * 100, label='air_util (max)')
+		axs[0].plot(t, tx_util.mean(axis=1) * 100, label='tx_util (mean)')
+		axs[0].set_ylabel('Utilization [%]')
+		axs[1].plot(t, self.metrics.series('collisions').sum(axis=1), label='collisions')
+		axs[1].set_ylabel('Collisions')
+		axs[2].plot(t, self.metrics.series('deliveries').sum(axis=1), label='deliveries')
+		axs[2].set_ylabel('Deliveries')
+		axs[3].plot(t, self.metrics.mean_queue().mean(axis=1), label='queue length (mean)')
+		axs[3].plot(t, self.metrics.series('queue_max').max(axis=1), label='queue length (max)')
+		axs[3].set_ylabel('TX queue length')
+		axs[3].set_xlabel(f'Time [s], window = {self.metrics.window / 1000000:g} s')
+		for ax in axs:
+			ax.grid()
+			ax.legend(loc='upper right')
+		axs[0].set_title('Network metrics per time window')
+		plt.savefig(self.results_dir + "/metrics.png", dpi=self.dpi, bbox_inches='tight')
+		plt.close()
 
 	def make_video(self, slowmo_factor):
-		def extract_us(filename):
-			match = re.search(r'(\d{8,10})\.png$', filename)
-			if match:
-				return int(match.group(1))
-			return 0
-		png_files = glob.glob(self.results_dir + "/png/*.png")
+		self.finish_rendering()
+		if self.stream_mp4:
+			return	# already encoded during the simulation
+		png_files = ["{}/png/{:010d}.png".format(self.results_dir, t) for t in self.frame_times]
 		self.ffmpeg_input = open(self.results_dir + "/png/ffmpeg_input.txt", "w")
 
-		png_files.sort(key=extract_us)
-		frames = []
-
 		durations = []
-		times = [extract_us(file) for file in png_files]
-
-		for i in range(len(times)-1):
-			duration = times[i+1] - times[i]
-			if duration < 1000:
-				duration = 1000
-			else:
-				duration *= slowmo_factor
-			durations.append(duration)
-		durations.append(1000)
+		times = self.frame_times + [self.current_time]
+		for i in range(len(png_files)):
+			durations.append(frame_duration(times[i+1] - times[i], slowmo_factor))
 
 		for i in range(len(png_files)):
 			self.ffmpeg_input.write(f"file {png_files[i]}\nduration {durations[i]/1000000}\n")
@@ -333,118 +646,73 @@ class MeshSim:
 		"-vsync", "vfr", "-pix_fmt", "yuv420p", "-hide_banner", "-loglevel", "error", f"{self.results_dir}/result.mp4"
 		])
 
-	def save_plot_async(self, fig, filename, **kwargs):
-		def _save_fig(fig_copy, filename, kwargs):
-			fig_copy.savefig(filename, **kwargs)
-			plt.close(fig_copy)
-
-		# Create a process for saving the figure
-		process = mp.Process(
-			target=_save_fig,
-			args=(fig, filename, kwargs)
-		)
-		process.start()
-
-		return process
-
 	def plot_nodes(self, time = 0, name = None):
-		fig, ax = plt.subplots(figsize=((self.size[1]-self.size[0])/1000, (self.size[3]-self.size[2])/1000))
-
-		# Draw nodes and ranges
-		for node in self.nodes:
-			x, y = node.position[0], node.position[1]
-
-			# Draw a point representing the node
-			ax.scatter(x, y, color=node.color_from_state(), s = (node.tx_power + 10)**2)
-			ax.annotate("{}".format(node), (x, y-200), fontsize=self.config.plot_node_font_size)
-
-		for node in self.nodes:
-			if node.state == NodeState.RX_BUSY:
-				for n_id, rx in node.currently_receiving.items():
-					l_width = 1 + int(((node.currently_receiving[n_id]["signal_snr"] + 20) / 30) * 4)
-
-					if node.currently_receiving[n_id]["signal_snr"] > 0:
-						l_color='#00ff00'
-					elif node.currently_receiving[n_id]["signal_snr"] > -10:
-						l_color='#a3a300'
-					else:
-						l_color='#ff0000'
-
-					ax.annotate(
-						'',
-						xy=(node.position[0], node.position[1]),
-						xytext=(self.nodes_by_id[n_id].position[0], self.nodes_by_id[n_id].position[1]),
-						color='gray',
-						arrowprops=dict(
-							#color='gray',
-							color=l_color,
-							shrink=0.05,
-							width=l_width,
-							headwidth=5,
-							headlength=5
-						)
-					)
-				if len(node.currently_receiving) > 1:
-					ax.text(node.position[0], node.position[1], 'x', color='red', fontsize=20, ha='center', va='center')
-			elif node.state == NodeState.TX_BUSY and self.config.plot_range_circles:
-				distance = node.calculate_theoretical_range(minimal_rx_rssi = self.config.plot_range_circles_minimal_rssi)
-				color = 'red'
-				if self.config.plot_range_circles_color_from_message_id:
-					color = "#{:06x}".format(node.msg_tx_buffer.message_id & 0x00ffffff)
-				circle = plt.Circle((node.position[0], node.position[1]), distance,
-					color=color,
-					fill=True,
-					facecolor='blue',
-					alpha=0.3,
-					linestyle='--',
-					linewidth=1)
-				ax.add_artist(circle)
-
-		ax.set_xlim(self.size[0], self.size[1])
-		ax.set_ylim(self.size[2], self.size[3])
-		ax.set_title(f't = {(time/1000000):.06f} s')
-		ax.set_xlabel('X [m]')
-		ax.set_ylabel('Y [m]')
-		ax.grid(True)
-		if name is None:
-			name = "{}/png/{:010d}.png".format(self.results_dir, time)
-		save_process = self.save_plot_async(fig, name, dpi=self.dpi, bbox_inches='tight')
-
-	def make_html(self, simulation_time, time_resolution):
+		"""
+		Plots the current network state, animation frames (name = None) are recorded to frames.bin
+		and/or rendered by the frame pool
+		"""
+		frame = MeshFrame.from_nodes(self.nodes, self.nodes_by_id, time)
+		if name is not None:
+			render_frame(self.plot_layout(), frame, name)
+			return
+		self.frame_policy.frame_taken(time)
+		self.frame_times.append(time)
+		if self.frame_recorder is not None:
+			self.frame_recorder.write(frame)
+		if not (self.generate_png or self.stream_mp4):
+			return
+		if self.frame_pool is None:
+			video = MeshVideoStream(self.results_dir + "/result.mp4", self.slowmo_factor, self.constants.VIDEO_FPS) if self.stream_mp4 else None
+			self.frame_pool = MeshFramePool(self.plot_layout(), processes = self.constants.RENDER_PROCESSES, max_pending = self.constants.RENDER_QUEUE_SIZE, video = video)
+		file_name = "{}/png/{:010d}.png".format(self.results_dir, time) if self.generate_png else None
+		self.frame_pool.submit(frame, file_name)
+
+	def plot_layout(self):
+		return MeshPlotLayout.from_nodes(self.nodes, self.size, self.dpi, self.config)
+
+	def finish_rendering(self):
+		"""Waits for the frame pool to render all submitted frames"""
+		if self.frame_pool is not None:
+			if self.frame_pool.video is not None:
+				self.frame_pool.video.end_time = self.current_time
+			self.frame_pool.close()
+			self.frame_pool = None
+
+	def html_head(self, refresh = None):
+		"""Beginning of the HTML report up to the generation date, refresh - seconds between reloads in the browser"""
 		def image_to_base64_html(image_path):
 			with open(image_path, 'rb') as image_file:
 				encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
 				html = f'<img src="data:image/png;base64,{encoded_string}" alt="">'
 			return html
 
-		def embed_image(name):
-			return f'<a href="{name}"><img src="{name}" alt="" style="width: 50%"></a>'
-
 		utc_dt = datetime.now(timezone.utc)
 		iso_date = utc_dt.isoformat()
+		refresh_tag = f'<meta http-equiv="refresh" content="{refresh}">' if refresh else ''
 
-		html = """
+		html = f"""
 		<!DOCTYPE html>
 			<html lang="pl">
 			<head>
 				<meta charset="UTF-8">
 				<meta name="viewport" content="width=device-width, initial-scale=1.0">
+				{refresh_tag}
 				<title>KSSM generated report</title>
 				<style>
-					body {
+					body {{
 						font-family: sans-serif;
 						margin: 0 auto;
 						width: 80%;
 						padding: 20px;
 						line-height: 1.6;
-					}
-					table {
+					}}
+					table {{
 						border-collapse: collapse;
-					}
-					th, td {
+					}}
+					th, td {{
 						border: 1px solid gray;
 						padding: 0.5ex;
-					}
+					}}
 				</style>
 			</head>
 			<body>
@@ -452,11 +720,52 @@ class MeshSim:
 		html += "<p>" + image_to_base64_html('misc/icon.png') + "</p>\n"
 		html += "<h1><a href=\"https://github.com/krzysztof-sawicki/KSSM\">KSSM</a> autogenerated report</h1>\n"
 		html += f"<p><small>Generated on: {iso_date}</small></p>\n"
+		return html
 
+	def make_progress_html(self, status):
+		"""
+		Partial index.html of a running simulation, built from the online statistics (summary metrics,
+		node counters, metrics per time window), replaced by make_html() at the end
+		"""
+		self.sync_nodes()
+		self.metrics.write_csv(self.results_dir + "/metrics.csv", [n.node_id for n in self.nodes], self.current_time)
+		self.plot_metrics()
+		eta = format_duration(status['eta']) if status['eta'] is not None else '?'
+		html = self.html_head(refresh = max(10, int(self.report_interval)))
+		html += "<h2>Simulation in progress</h2>\n"
+		html += f"""
+		<ul>
+			<li>simulated time: {status['simulated_time']:.3f} s of {status['end_time']:.3f} s ({status['done']*100:.1f}%)</li>
+			<li>elapsed: {format_duration(status['wall_time'])}, estimated time to the end: {eta}</li>
+			<li>speed: {status['sim_to_wall']:.3f}x real time, {status['events_per_s']:.0f} logged events/s</li>
+		</ul>
+		"""
+		html += "<h2>Summary</h2>\n"
+		html += pd.DataFrame([self.summary_metrics()]).to_html(index=False, justify='center')
+		stats = self.node_stats()
+		nodes = pd.DataFrame({'node_id': [f"{n.node_id:08x}" for n in self.nodes], 'long_name': [n.long_name for n in self.nodes]})
+		for f, column in stats.items():
+			nodes[f] = column
+		html += "<h2>Nodes</h2>\n"
+		html += nodes.to_html(index=False, justify='center', float_format=lambda v: f"{v:.4f}")
+		if os.path.exists(self.results_dir + "/metrics.png"):
+			html += '<p><a href="metrics.png"><img src="metrics.png" alt="" style="width: 50%"></a></p>'
+		html += '<p><a href="metrics.csv">metrics per time window (CSV)</a></p>'
+		html += "</body></html>"
+		with open(self.results_dir + "/index.html", "w") as f:
+			f.write(html)
+
+	def make_html(self, simulation_time, time_resolution):
+		def embed_image(name):
+			return f'<a href="{name}"><img src="{name}" alt="" style="width: 50%"></a>'
+
+		html = self.html_head()
+
+		input_name = next((name for name in SCENARIO_INPUT_NAMES if os.path.isfile(os.path.join(self.results_dir, name))), SCENARIO_INPUT_NAMES[0])
 		html += "<h2>Parameters</h2>\n"
 		html += f"""
 		<ul>
-			<li><a href="input.json">input file</a></li>
+			<li><a href="{input_name}">input file</a></li>
 			<li>simulation time: {simulation_time} s</li>
 			<li>time resolution: {time_resolution} µs</li>
 		</ul>
@@ -476,18 +785,28 @@ class MeshSim:
 
 		html += "<h2>Results</h2>\n"
 
-		df = pd.read_csv(self.results_dir + '/nodes.csv')
-		last_rows = df.groupby('node_id').last().reset_index()
+		last_rows = pd.DataFrame(self.logger.last_node_rows(), columns=MeshLogger.NODE_FIELDS)
 		html += last_rows.to_html(index=False, justify='center')
 
-		result_pngs = ['air_stat.png', 'air_util.png', 'rx_stat.png', 'tx_stat.png', 'tx_util.png', 'known_nodes.png', 'messages_heard.png', 'normalized_success_rate.png']
+		result_pngs = ['air_stat.png', 'air_util.png', 'rx_stat.png', 'tx_stat.png', 'tx_util.png', 'known_nodes.png', 'messages_heard.png', 'normalized_success_rate.png', 'success_rate.png', 'metrics.png']
 		for p in result_pngs:
 			html += '<p>' + embed_image(p) + '</p>'
-
-		png_files = glob.glob(self.results_dir + "success_rate*.png")
-
-		for p in png_files:
-			html += '<p>' + embed_image(os.path.basename(p)) + '</p>'
+		html += '<p><a href="metrics.csv">metrics per time window (CSV)</a></p>'
+
+		html += "<h2>Performance</h2>\n"
+		html += "<p>Wall time of the simulation phases (inclusive, share of the whole run)"
+		if not self.phase_timers:
+			html += ", run with <code>--phase_timers</code> for the breakdown of the node steps"
+		html += "</p>\n"
+		html += pd.DataFrame(self.timers.rows(total = 'run')).to_html(index=False, justify='center')
+		html += "<p>Caches</p>\n"
+		html += pd.DataFrame(cache_rows(self.cache_stats())).to_html(index=False, justify='center')
+		if self.step_histogram:
+			html += "<p>Step sizes of the tick engine</p>\n"
+			html += pd.DataFrame(self.step_rows()).to_html(index=False, justify='center')
+		if os.path.exists(self.results_dir + "/" + PROFILE_STATS_NAME):
+			html += f'<p><a href="{PROFILE_STATS_NAME}">cProfile statistics</a>, <a href="{PROFILE_COLLAPSED_NAME}">collapsed stacks</a> (flame graph input), functions with the longest own time:</p>'
+			html += pd.DataFrame(top_functions(self.results_dir + "/" + PROFILE_STATS_NAME)).to_html(index=False, justify='center')
 
 		if os.path.exists(self.results_dir + "/result.mp4"):
 			html += f"""
@@ -0,0 +1,127 @@
+import copy
+import csv
+import itertools
+import os
+import time
+import multiprocessing as mp
+from kssmlib import MeshConfig
+from kssmlib.MeshSim import MeshSim
+
+"""
+Parameter sweep runner
+
+A sweep file is a JSON object mapping parameter names to lists of values, e.g.
+	{"role": ["CLIENT", "ROUTER_LATE"], "hop_start": [3, 5], "propagation_model": ["City", "FSPL"], "seed": [1, 2, 3]}
+Every combination of the values is one run of the base scenario:
+	- node parameters (NODE_PARAMETERS) are set on every node of the scenario,
+	  "<node_id or long_name>.<parameter>" sets the parameter of a single node,
+	- simulation parameters (SIMULATION_PARAMETERS) replace the command line values,
+	- any other name overrides the kssm.json entry of the same name.
+Runs are executed on a process pool with plotting switched off, the summary metrics of every
+run are written to <results_dir>/sweep.csv and the logs of run N to <results_dir>/runs/N/.
+"""
+
+NODE_PARAMETERS = ['type', 'role', 'hop_start', 'lora_mode', 'tx_power', 'noise_level', 'frequency', 'nodeinfo_interval',
+	'position_interval', 'text_message_min_interval', 'text_message_max_interval']
+SIMULATION_PARAMETERS = ['seed', 'simulation_time', 'time_resolution', 'engine', 'reception', 'log_format']
+
+def expand_grid(grid):
+	"""List of all combinations of the grid values, single values are treated as one-element lists"""
+	keys = list(grid.keys())
+	values = [grid[k] if isinstance(grid[k], list) else [grid[k]] for k in keys]
+	return [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+
+def apply_variant(nodes_data, variant):
+	"""Copy of the scenario with the node parameters of the variant applied"""
+	nodes_data = copy.deepcopy(nodes_data)
+	for key, value in variant.items():
+		if key in NODE_PARAMETERS:
+			for n in nodes_data:
+				n[key] = value
+		elif '.' in key:
+			name, parameter = key.rsplit('.', 1)
+			matched = [n for n in nodes_data if _node_matches(n, name)]
+			if not matched:
+				raise ValueError(f"Sweep parameter {key}: node {name} not found")
+			for n in matched:
+				n[parameter] = value
+	return nodes_data
+
+def config_overrides(variant):
+	return {k: v for k, v in variant.items() if k not in NODE_PARAMETERS and k not in SIMULATION_PARAMETERS and '.' not in k}
+
+def _node_matches(node_data, name):
+	if node_data.get("long_name") == name:
+		return True
+	try:
+		return "node_id" in node_data and int(node_data["node_id"], 16) == int(name, 16)
+	except ValueError:
+		return False
+
+def run_variant(task):
+	"""Runs one variant in a worker process and returns its row of the sweep table"""
+	run, nodes_data, variant, settings = task
+	settings = dict(settings)
+	for key in SIMULATION_PARAMETERS:
+		if key in variant:
+			settings[key] = variant[key]
+	run_dir = os.path.join(settings['results_dir'], 'runs', f"{run:04d}")
+	os.makedirs(run_dir, exist_ok = True)
+
+	start = time.perf_counter()
+	mesh_sim = MeshSim(apply_variant(nodes_data, variant), config_file = settings['config_file'], results_dir = run_dir,
+		engine = settings['engine'], reception_model = settings['reception'], log_format = settings['log_format'],
+		verbose = False, plot_map = False, config_overrides = config_overrides(variant), seed = settings['seed'])
+	mesh_sim.run(int(settings['simulation_time'] * 1000000), settings['time_resolution'])
+	mesh_sim.close()
+	row = {'run': run}
+	row.update(variant)
+	row['seed'] = mesh_sim.context.seed
+	row.update(mesh_sim.summary_metrics())
+	row['wall_time'] = round(time.perf_counter() - start, 3)
+	return row
+
+def run_sweep(nodes_data, grid, results_dir, config_file = 'kssm.json', simulation_time = MeshConfig.SIMULATION_TIME,
+		time_resolution = MeshConfig.SIMULATION_INTERVAL, engine = 'tick', reception_model = 'tick', log_format = 'csv', processes = None, seed = None):
+	"""
+	Runs every combination of the grid on a process pool
+
+	:param nodes_data: base scenario (list of node dicts, as in the --nodes_data file)
+	:param grid: parameter name -> list of values
+	:param processes: number of worker processes, all cores by default
+	:return: list of result rows, also written to <results_dir>/sweep.csv
+	"""
+	settings = {
+		'results_dir': results_dir,
+		'config_file': config_file,
+		'simulation_time': simulation_time,
+		'time_resolution': time_resolution,
+		'engine': engine,
+		'reception': reception_model,
+		'log_format': log_format,
+		'seed': seed,
+	}
+	variants = expand_grid(grid)
+	tasks = [(run, nodes_data, variant, settings) for run, variant in enumerate(variants)]
+	if processes is None:
+		processes = os.cpu_count() or 1
+	processes = max(1, min(processes, len(tasks)))
+
+	results = []
+	with mp.Pool(processes) as pool:
+		for row in pool.imap_unordered(run_variant, tasks):
+			results.append(row)
+			print(f"sweep: {len(results)}/{len(tasks)} run {row['run']:04d} success_rate = {row['success_rate']:.4f} ({row['wall_time']} s)")
+	results.sort(key = lambda row: row['run'])
+	write_results(os.path.join(results_dir, 'sweep.csv'), results)
+	return results
+
+def write_results(file_path, rows):
+	"""Writes the result rows to a CSV file, the columns are the union of the row keys"""
+	fields = []
+	for row in rows:
+		fields += [f for f in row.keys() if f not in fields]
+	with open(file_path, 'w', newline='') as f:
+		writer = csv.DictWriter(f, fieldnames = fields)
+		writer.writeheader()
+		writer.writerows(rows)
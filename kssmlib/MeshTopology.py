@@ -0,0 +1,170 @@
+import math
+import numpy as np
+
+"""
+Generators of large meshes
+
+generate_topology() draws a Meshtastic mesh of 1k-100k nodes as a dict of columns (see MeshScenario.py),
+ready to be written to a CSV or NPZ scenario (write_scenario()) or passed to MeshSim directly. The positions
+are drawn by one of the layouts (LAYOUTS), vectorized with numpy:
+	- uniform - uniformly random in a square,
+	- grid - a square grid with a normal jitter,
+	- clustered - Thomas process: normal clusters around uniformly random centers (neighborhoods of a city),
+	- corridor - uniformly random along a polyline of waypoints within its width (a road, a river valley),
+	- poisson_disc - Bridson's algorithm, no two nodes closer than min_distance (evenly spread rooftops),
+	  the slowest one, about 10 s for 100k nodes.
+node_spacing is the mean distance between neighboring nodes, the area grows with the number of nodes, so
+the node density does not depend on the mesh size. The roles are drawn by a role mix, e.g.
+{"CLIENT": 0.8, "CLIENT_MUTE": 0.15, "ROUTER": 0.05}: the numbers of the nodes of every role follow the
+fractions (largest remainder) and the roles are shuffled among the nodes.
+"""
+
+NODE_HEIGHT = 10	# m
+
+def uniform_layout(nodes, rng, node_spacing):
+	side = node_spacing * math.sqrt(nodes)
+	return rng.uniform(0, side, size = (nodes, 2))
+
+def grid_layout(nodes, rng, node_spacing, jitter = 0.1):
+	"""
+	:param jitter: standard deviation of the position around the grid point, as a fraction of node_spacing
+	"""
+	columns = math.ceil(math.sqrt(nodes))
+	index = np.arange(nodes)
+	positions = np.column_stack((index % columns, index // columns)) * float(node_spacing)
+	return positions + rng.normal(0, jitter * node_spacing, size = (nodes, 2))
+
+def clustered_layout(nodes, rng, node_spacing, clusters = None, cluster_spread = 0.5):
+	"""
+	:param clusters: number of clusters, default one per 100 nodes
+	:param cluster_spread: standard deviation of a cluster as a fraction of the radius of the area its nodes would cover at node_spacing
+	"""
+	if clusters is None:
+		clusters = max(1, nodes // 100)
+	side = node_spacing * math.sqrt(nodes)
+	centers = rng.uniform(0, side, size = (clusters, 2))
+	sigma = cluster_spread * node_spacing * math.sqrt(nodes / clusters / math.pi)
+	members = rng.integers(0, clusters, size = nodes)
+	return centers[members] + rng.normal(0, sigma, size = (nodes, 2))
+
+def corridor_layout(nodes, rng, node_spacing, width = None, waypoints = None):
+	"""
+	:param width: width of the corridor in m, default 3 * node_spacing
+	:param waypoints: [[x, y], ...] of the polyline, default a straight corridor along the x axis, as long as needed for the node density
+	"""
+	if width is None:
+		width = 3 * node_spacing
+	if waypoints is None:
+		waypoints = [[0, 0], [nodes * node_spacing ** 2 / width, 0]]
+	waypoints = np.asarray(waypoints, dtype = float)
+	segments = np.diff(waypoints, axis = 0)
+	lengths = np.hypot(segments[:, 0], segments[:, 1])
+	ends = np.cumsum(lengths)
+	distance = rng.uniform(0, ends[-1], size = nodes)
+	segment = np.minimum(np.searchsorted(ends, distance, side = 'right'), len(lengths) - 1)
+	along = (distance - (ends[segment] - lengths[segment])) / lengths[segment]
+	direction = segments[segment] / lengths[segment, None]
+	normal = np.column_stack((-direction[:, 1], direction[:, 0]))
+	offset = rng.uniform(-width / 2, width / 2, size = nodes)
+	return waypoints[segment] + segments[segment] * along[:, None] + normal * offset[:, None]
+
+def poisson_disc_layout(nodes, rng, node_spacing, min_distance = None, candidates = 30, batch = 64):
+	"""
+	Bridson's algorithm grown from the center of the area until there are nodes points. A batch of the active
+	points is extended at once, a new point closer than min_distance to another new point of the batch is dropped.
+	:param min_distance: smallest distance between two nodes, default 0.8 * node_spacing
+	:param candidates: candidates drawn around an active point before it is retired
+	:param batch: active points extended at once
+	"""
+	r = 0.8 * node_spacing if min_distance is None else min_distance
+	cell = r / math.sqrt(2)		# at most one point in a cell
+	side = r * math.sqrt(2 * math.pi * nodes)	# enough for a maximal sampling of nodes points
+	cells = math.ceil(side / cell)
+	grid = np.full((cells + 4, cells + 4), -1, dtype = np.int64)	# point index of a cell, 2 cells of margin
+	points = np.full((nodes + 1, 2), np.inf)	# the last row is the point of the empty cells (index -1), far from any
+	offsets = np.array([(dx, dy) for dx in range(-2, 3) for dy in range(-2, 3) if abs(dx) + abs(dy) < 4])	# the corners are always further than r
+	r2 = r * r
+
+	points[0] = side / 2
+	grid[int(side / 2 // cell) + 2, int(side / 2 // cell) + 2] = 0
+	count = 1
+	active = np.array([0])
+	while len(active) and count < nodes:
+		picked = rng.permutation(len(active))[:batch]
+		angle = rng.uniform(0, 2 * math.pi, (len(picked), candidates))
+		radius = r * np.sqrt(rng.uniform(1, 4, (len(picked), candidates)))	# uniform in the annulus r..2r
+		candidate = points[active[picked]][:, None, :] + np.stack((np.cos(angle) * radius, np.sin(angle) * radius), axis = 2)
+		centers = np.clip((candidate // cell).astype(np.int64), -2, cells + 1) + 2
+		neighbors = grid[centers[..., 0, None] + offsets[:, 0], centers[..., 1, None] + offsets[:, 1]]
+		distance2 = ((points[neighbors] - candidate[..., None, :]) ** 2).sum(axis = 3)
+		valid = (distance2.min(axis = 2) >= r2) & (candidate >= 0).all(axis = 2) & (candidate < side).all(axis = 2)
+		found = valid.any(axis = 1)
+		first = candidate[np.arange(len(picked)), valid.argmax(axis = 1)][found]
+		close = ((first[:, None, :] - first[None, :, :]) ** 2).sum(axis = 2) < r2
+		new = first[~np.tril(close, -1).any(axis = 1)][:nodes - count]
+		points[count:count + len(new)] = new
+		grid[(new[:, 0] // cell).astype(np.int64) + 2, (new[:, 1] // cell).astype(np.int64) + 2] = np.arange(count, count + len(new))
+		retired = np.zeros(len(active), dtype = bool)
+		retired[picked[~found]] = True
+		active = np.concatenate((active[~retired], np.arange(count, count + len(new))))
+		count += len(new)
+	if count < nodes:
+		raise ValueError(f"Poisson disc layout: only {count} of {nodes} nodes fit")
+	return points[:count]
+
+LAYOUTS = {
+	'uniform': uniform_layout,
+	'grid': grid_layout,
+	'clustered': clustered_layout,
+	'corridor': corridor_layout,
+	'poisson_disc': poisson_disc_layout,
+}
+
+def role_mix(nodes, mix, rng):
+	"""Array of role names of nodes nodes, their numbers follow the fractions of mix (normalized to 1), shuffled"""
+	names = list(mix.keys())
+	fractions = np.array([mix[name] for name in names], dtype = float)
+	if len(names) == 0 or fractions.sum() <= 0 or (fractions < 0).any():
+		raise ValueError(f"Invalid role mix: {mix}")
+	quotas = fractions / fractions.sum() * nodes
+	counts = np.floor(quotas).astype(int)
+	remainders = np.argsort(-(quotas - counts), kind = 'stable')
+	counts[remainders[:nodes - counts.sum()]] += 1
+	return rng.permutation(np.repeat(np.array(names), counts))
+
+def generate_topology(layout, nodes, roles = None, lora_mode = 'MediumFast', text_interval = 10, node_spacing = 1500, seed = 1, **layout_parameters):
+	"""
+	Random Meshtastic mesh as a dict of columns (MeshScenario.py)
+
+	:param layout: name of the layout of the positions (LAYOUTS)
+	:param roles: role mix, role name -> fraction of the nodes, default all CLIENT
+	:param text_interval: mean time between text messages of a node in seconds, 0 - no text messages
+	:param node_spacing: mean distance between neighboring nodes, m
+	:param layout_parameters: parameters of the layout function, e.g. clusters, width, waypoints, min_distance
+	"""
+	if layout not in LAYOUTS:
+		raise ValueError(f"Unknown layout: {layout}")
+	rng = np.random.default_rng(seed)
+	positions = LAYOUTS[layout](nodes, rng, node_spacing, **layout_parameters)
+	positions = np.round(positions - positions.min(axis = 0), 1)	# the layouts may spread below 0
+	ids = rng.choice(0xffffffff, size = nodes, replace = False)
+	digits = len(str(nodes - 1))
+	return {
+		'type': np.full(nodes, 'meshtastic'),
+		'node_id': np.char.mod('0x%08x', ids),
+		'long_name': np.char.add('Node ', np.char.zfill(np.arange(nodes).astype(str), digits)),
+		'x': positions[:, 0],
+		'y': positions[:, 1],
+		'z': np.full(nodes, NODE_HEIGHT),
+		'tx_power': rng.integers(14, 23, size = nodes),
+		'noise_level': rng.integers(-110, -94, size = nodes),
+		'frequency': np.full(nodes, 869525000),
+		'lora_mode': np.full(nodes, lora_mode),
+		'hop_start': np.full(nodes, 3),
+		'role': role_mix(nodes, roles, rng) if roles else np.full(nodes, 'CLIENT'),
+		'position_interval': rng.integers(600, 901, size = nodes),
+		'nodeinfo_interval': rng.integers(600, 901, size = nodes),
+		'text_message_min_interval': np.full(nodes, max(1, int(text_interval // 2)) if text_interval > 0 else 0),
+		'text_message_max_interval': np.full(nodes, int(text_interval * 3 // 2) if text_interval > 0 else 0),
+		'debug': np.zeros(nodes, dtype = bool),
+	}
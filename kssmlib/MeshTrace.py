@@ -0,0 +1,206 @@
+import csv
+import json
+import os
+import numpy as np
+from kssmlib.MeshCheckpoint import resume_file
+
+"""
+Binary columnar trace format
+
+Every log table is stored as a raw file of fixed-width NumPy records (<table>.bin).
+IDs are stored as integers and enums (role, LoRa mode, node state, message type) as small
+integer codes. Values that never change during the run (long name, position, tx power,
+noise level, frequency) are stored once per node in the index file (trace.json), together
+with the record layout and the code -> text mapping of every categorical column.
+MeshTraceReader memory-maps the files, so even very long traces load instantly.
+"""
+
+TRACE_INDEX_NAME = 'trace.json'
+
+# field -> NumPy type, 'category' for enums stored as codes, None for per-node static values stored in the index
+MESSAGE_TYPES = {
+	'timestamp': 'i8', 'message_id': 'u4', 'sender_addr': 'u4', 'dest_addr': 'u4', 'message_type': 'category',
+	'message_length': 'i2', 'message_tx_time': 'i8', 'hop_start': 'i1', 'hop_limit': 'i1', 'tx_node': 'u4', 'rx_node': 'u4',
+	'rssi': 'f8', 'snr': 'f8', 'collision': 'i1', 'complete_reception': 'i1',
+}
+NODE_TYPES = {
+	'time': 'i8', 'node_id': 'u4', 'long_name': None, 'role': 'category', 'position': None, 'tx_power': None, 'noise_level': None,
+	'frequency': None, 'lora_mode': 'category', 'state': 'category', 'backoff_time': 'f8', 'message_queue_len': 'i2',
+	'messages_heard': 'i4', 'known_nodes': 'i4', 'rx_success': 'i4', 'rx_fail': 'i4', 'rx_dups': 'i4', 'rx_unicast': 'i4',
+	'tx_done': 'i4', 'forwarded': 'i4', 'tx_cancelled': 'i4', 'collisions_caused': 'i4', 'tx_origin': 'i4',
+	'messages_confirmed': 'i4', 'tx_sime_sum': 'i8', 'rx_time_sum': 'i8', 'backoff_time_sum': 'i8', 'tx_util': 'f8', 'air_util': 'f8',
+}
+BACKOFF_TYPES = {
+	'time': 'i8', 'node_id': 'u4', 'long_name': None, 'role': 'category', 'tx_util': 'f8', 'air_util': 'f8', 'rebroadcast': 'i1',
+	'SNR': 'f8', 'CWsize': 'i1', 'calculated_backoff': 'f8',
+}
+TABLE_TYPES = {'messages': MESSAGE_TYPES, 'nodes': NODE_TYPES, 'backoff': BACKOFF_TYPES}
+
+class MeshTraceIndex:
+	"""Record layouts, categories and static node data of all binary tables of one run"""
+	def __init__(self, index_path):
+		self.index_path = index_path
+		self.tables = {}
+		self.nodes = {}	# node_id -> {static field: value}
+
+	def add_table(self, name, file_path, field_types):
+		self.tables[name] = {
+			'file': os.path.basename(file_path),
+			'dtype': [(f, 'i2' if t == 'category' else t) for f, t in field_types.items() if t is not None],
+			'categories': {f: {} for f, t in field_types.items() if t == 'category'},
+		}
+
+	def write(self):
+		data = {
+			'tables': {
+				name: {
+					'file': t['file'],
+					'dtype': t['dtype'],
+					'categories': {f: [str(v) for v in cat] for f, cat in t['categories'].items()},
+				} for name, t in self.tables.items()
+			},
+			'nodes': {str(node_id): info for node_id, info in self.nodes.items()},
+		}
+		with open(self.index_path, 'w') as f:
+			json.dump(data, f, indent=1)
+
+class MeshTraceSink:
+	"""Writes flushed MeshLogTable columns as fixed-width records of a binary table"""
+	def __init__(self, trace_index, name, file_path, field_types):
+		self.trace_index = trace_index
+		self.name = name
+		self.file_path = file_path
+		self.field_types = field_types
+		trace_index.add_table(name, file_path, field_types)
+		self.table = trace_index.tables[name]
+		self.dtype = np.dtype([tuple(d) for d in self.table['dtype']])
+		self.file_descriptor = None
+		self.offset = None	# size of the file at the last checkpoint
+
+	def __getstate__(self):
+		state = dict(self.__dict__)
+		state['file_descriptor'] = None
+		return state
+
+	def checkpoint(self):
+		self.offset = os.path.getsize(self.file_path) if os.path.isfile(self.file_path) else None
+
+	def resume(self, file_path):
+		resume_file(self.file_path, file_path, self.offset)
+		self.file_path = file_path
+
+	def detach(self):
+		"""Forgets the open file without closing it, it belongs to the parent of a forked process"""
+		self.file_descriptor = None
+
+	def write(self, fields, columns, size):
+		if self.file_descriptor is None:
+			self.file_descriptor = open(self.file_path, 'wb' if self.offset is None else 'ab')
+		records = np.empty(size, dtype=self.dtype)
+		values = dict(zip(fields, columns))
+		for f, t in self.field_types.items():
+			column = values[f][:size]
+			if t is None:
+				continue
+			if t == 'category':
+				categories = self.table['categories'][f]
+				records[f] = [categories.setdefault(v, len(categories)) for v in column]
+			else:
+				records[f] = column
+		static = [f for f, t in self.field_types.items() if t is None]
+		if static:
+			node_ids = values['node_id'][:size]
+			static_columns = [values[f][:size] for f in static]
+			for node_id, row in zip(node_ids, zip(*static_columns)):
+				if node_id not in self.trace_index.nodes:
+					self.trace_index.nodes[node_id] = {}
+				info = self.trace_index.nodes[node_id]
+				if static[0] not in info:
+					info.update(zip(static, [list(v) if isinstance(v, (list, tuple)) else v for v in row]))
+		records.tofile(self.file_descriptor)
+		self.file_descriptor.flush()
+
+	def close(self):
+		if self.file_descriptor is not None:
+			self.file_descriptor.close()
+			self.file_descriptor = None
+		self.trace_index.write()
+
+class MeshTraceReader:
+	"""
+	Memory-mapped access to a binary trace:
+		trace = MeshTraceReader('kssm/')
+		trace.table('messages')['rssi']			# NumPy array, read lazily from the disk
+		trace.decode('nodes', 'state', codes)	# codes -> text
+		trace.export_csv('nodes', 'nodes.csv')	# the same columns as the CSV logs
+	"""
+	def __init__(self, results_dir):
+		self.results_dir = results_dir
+		with open(os.path.join(results_dir, TRACE_INDEX_NAME), 'r') as f:
+			self.index = json.load(f)
+		self.nodes = {int(node_id): info for node_id, info in self.index['nodes'].items()}
+		self._tables = {}
+
+	def table_names(self):
+		return list(self.index['tables'].keys())
+
+	def table(self, name):
+		if name not in self._tables:
+			t = self.index['tables'][name]
+			dtype = np.dtype([tuple(d) for d in t['dtype']])
+			path = os.path.join(self.results_dir, t['file'])
+			if not os.path.isfile(path) or os.path.getsize(path) == 0:
+				self._tables[name] = np.zeros(0, dtype=dtype)
+			else:
+				self._tables[name] = np.memmap(path, dtype=dtype, mode='r')
+		return self._tables[name]
+
+	def decode(self, name, field, codes):
+		categories = np.array(self.index['tables'][name]['categories'][field], dtype=object)
+		return categories[np.asarray(codes)]
+
+	def last_node_rows(self):
+		"""Indexes of the last 'nodes' record of every node, sorted by node_id"""
+		nodes = self.table('nodes')
+		if len(nodes) == 0:
+			return np.zeros(0, dtype=int)
+		reversed_ids = nodes['node_id'][::-1]
+		_, first = np.unique(reversed_ids, return_index=True)
+		return len(nodes) - 1 - first
+
+	def export_csv(self, name, csv_path, rows = None):
+		"""Writes the table (or the selected rows) in the format of the CSV logs"""
+		table = self.table(name)
+		if rows is not None:
+			table = table[rows]
+		field_types = TABLE_TYPES[name]
+		columns = []
+		for f, t in field_types.items():
+			if t is None:
+				columns.append([self.static_value(node_id, f) for node_id in table['node_id'].tolist()])
+			elif t == 'category':
+				columns.append(self.decode(name, f, table[f]).tolist())
+			elif f in ('message_id', 'sender_addr', 'dest_addr', 'tx_node', 'rx_node'):
+				columns.append([f"0x{v:08x}" for v in table[f].tolist()])
+			elif f == 'node_id':
+				columns.append([f"{v:08x}" for v in table[f].tolist()])
+			elif f in ('tx_util', 'air_util'):
+				columns.append([f"{v:.4f}" for v in table[f].tolist()])
+			else:
+				columns.append(table[f].tolist())
+		with open(csv_path, 'w', newline='') as csv_file:
+			writer = csv.writer(csv_file)
+			writer.writerow(list(field_types.keys()))
+			writer.writerows(zip(*columns))
+
+	def static_value(self, node_id, field):
+		value = self.nodes.get(node_id, {}).get(field)
+		if field == 'position' and value is not None:
+			return str(value)
+		return value
+
+	def export_all_csv(self, output_dir = None):
+		if output_dir is None:
+			output_dir = self.results_dir
+		for name in self.table_names():
+			self.export_csv(name, os.path.join(output_dir, name + '.csv'))